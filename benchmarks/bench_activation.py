@@ -0,0 +1,107 @@
+"""Concurrent activation code redemption stress test.
+
+Seeds ``--codes`` unused codes into a temporary SQLite database, then fires
+``--redemptions`` activations through the ASGI app with ``--concurrency``
+requests in flight. Every code is tried by several users at once, so the run
+fails loudly if any code is activated more than once or any user's premium
+period does not add up to the codes they redeemed.
+
+    python -m benchmarks.bench_activation --codes 5000 --redemptions 20000 --concurrency 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+
+async def run(codes: int, redemptions: int, concurrency: int, users: int) -> dict:
+    import httpx
+    from sqlalchemy import func, select
+    from src.main import app
+    from src.models.models import ActivationCode, SessionLocal, User, as_utc, create_db_tables, engine
+    from src.services.activation_codes import generate_codes
+
+    await create_db_tables()
+    raw_codes = []
+    async with SessionLocal() as db:
+        async for chunk in generate_codes(db, codes, 30):
+            raw_codes.extend(raw for raw, _ in chunk)
+
+    attempts = [(random.choice(raw_codes), f"user_{random.randrange(users)}") for _ in range(redemptions)]
+    statuses = {}
+    latencies = []
+    queue = asyncio.Queue()
+    for attempt in attempts:
+        queue.put_nowait(attempt)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            while not queue.empty():
+                code, user_id = queue.get_nowait()
+                started = time.perf_counter()
+                resp = await client.post("/api/subscription/activate", json={"code": code, "user_id": user_id})
+                latencies.append(time.perf_counter() - started)
+                statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    async with SessionLocal() as db:
+        used = await db.scalar(select(func.count()).select_from(ActivationCode).where(ActivationCode.is_used.is_(True)))
+        rows = await db.execute(
+            select(ActivationCode.user_id, func.count(), func.min(ActivationCode.activated_at))
+            .where(ActivationCode.is_used.is_(True))
+            .group_by(ActivationCode.user_id)
+        )
+        per_user = {uid: (n, first) for uid, n, first in rows}
+        expiries = dict((await db.execute(select(User.id, User.premium_expires_at))).all())
+    await engine.dispose()
+
+    mismatched = [
+        uid for uid, (n, first) in per_user.items()
+        if abs(as_utc(expiries[uid]) - (as_utc(first) + timedelta(days=30 * n))) > timedelta(seconds=elapsed + 1)
+    ]
+    latencies.sort()
+    return {
+        "codes": codes,
+        "redemptions": redemptions,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "redemptions_per_s": round(redemptions / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+        "statuses": statuses,
+        "activated": statuses.get(200, 0),
+        "codes_marked_used": used,
+        "double_activations": statuses.get(200, 0) - used,
+        "users_with_wrong_expiry": len(mismatched),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--codes", type=int, default=5000)
+    parser.add_argument("--redemptions", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--users", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The app builds its engine on import, so point it at the scratch database first.
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        result = asyncio.run(run(args.codes, args.redemptions, args.concurrency, args.users))
+
+    print(json.dumps(result, indent=2))
+    if result["double_activations"] or result["users_with_wrong_expiry"] or result["activated"] != result["codes_marked_used"]:
+        sys.exit("activation invariants violated")
+
+
+if __name__ == "__main__":
+    main()
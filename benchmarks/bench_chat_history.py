@@ -0,0 +1,114 @@
+"""Chat history fetch latency before and after the composite chat index.
+
+Seeds one user with N messages into a temporary SQLite database and times
+the queries issued by ``src/routes/chat_routes.py`` (first history page, a
+deep keyset page and the LLM context fetch), first with only the legacy
+single-column ``user_id`` index and then with ``ix_chat_messages_user_created``.
+
+    python -m benchmarks.bench_chat_history --sizes 10000,100000,1000000
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text
+from src.models.models import Base
+from src.routes.chat_routes import newest_first, CHAT_HISTORY_PAGE_SIZE, CHAT_CONTEXT_MAX_MESSAGES
+
+USER_ID = "bench_user"
+OTHER_USERS = 100
+OTHER_MESSAGES_PER_USER = 100
+
+
+def seed(engine, size: int):
+    start = datetime(2024, 1, 1)
+    rows = [
+        (str(uuid.uuid4()), USER_ID, f"message {i}", i % 2 == 0, start + timedelta(seconds=i))
+        for i in range(size)
+    ]
+    rows += [
+        (str(uuid.uuid4()), f"other_{u}", "noise", True, start + timedelta(seconds=i))
+        for u in range(OTHER_USERS)
+        for i in range(OTHER_MESSAGES_PER_USER)
+    ]
+    raw = engine.raw_connection()
+    try:
+        raw.executemany(
+            "INSERT INTO chat_messages (id, user_id, content, is_user, created_at) VALUES (?, ?, ?, ?, ?)",
+            [(mid, uid, content, is_user, created.isoformat(sep=" ")) for mid, uid, content, is_user, created in rows],
+        )
+        raw.commit()
+    finally:
+        raw.close()
+    return start + timedelta(seconds=size // 2)
+
+
+def use_legacy_index(conn):
+    conn.execute(text("DROP INDEX IF EXISTS ix_chat_messages_user_created"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_chat_messages_user_id ON chat_messages (user_id)"))
+
+
+def use_composite_index(conn):
+    conn.execute(text("DROP INDEX IF EXISTS ix_chat_messages_user_id"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_chat_messages_user_created ON chat_messages (user_id, created_at, id)"))
+
+
+def time_query(conn, query, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(query).fetchall()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+    }
+
+
+def query_plan(conn, query) -> list[str]:
+    compiled = query.compile(conn, compile_kwargs={"literal_binds": True})
+    return [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))]
+
+
+def run(size: int, repeat: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        middle = seed(engine, size)
+
+        queries = {
+            "first_page": newest_first(USER_ID).limit(CHAT_HISTORY_PAGE_SIZE + 1),
+            "deep_page": newest_first(USER_ID, (middle, "")).limit(CHAT_HISTORY_PAGE_SIZE + 1),
+            "context": newest_first(USER_ID).limit(CHAT_CONTEXT_MAX_MESSAGES),
+        }
+        result = {"messages_per_user": size}
+        for label, prepare in (("before", use_legacy_index), ("after", use_composite_index)):
+            with engine.begin() as conn:
+                prepare(conn)
+                conn.execute(text("ANALYZE"))
+            with engine.connect() as conn:
+                result[label] = {
+                    name: dict(time_query(conn, query, repeat), plan=query_plan(conn, query))
+                    for name, query in queries.items()
+                }
+        engine.dispose()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma separated messages per user")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per query")
+    args = parser.parse_args()
+
+    results = [run(int(size), args.repeat) for size in args.sizes.split(",")]
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
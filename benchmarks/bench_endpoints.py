@@ -0,0 +1,332 @@
+"""Throughput and latency of every router under fixed concurrency.
+
+Seeds a temporary SQLite database with ``--scale`` times the production-sized
+volumes (1M users, 10k meditations, 100M chat messages, 1M activation codes),
+starts a local fake OpenAI server so chat endpoints never leave the machine,
+then drives each scenario through the ASGI app at every ``--concurrency``
+level and prints throughput and latency percentiles as JSON.
+
+    python -m benchmarks.bench_endpoints --scale 0.01 --concurrency 1,16,64 --output results.json
+    python -m benchmarks.bench_endpoints --baseline benchmarks/baseline.json
+
+With ``--baseline`` the run exits non-zero when any scenario's p95 latency is
+more than ``--tolerance`` above the baseline or its throughput is that much
+below it. ``--save-baseline`` records the current run as the new baseline.
+Each level runs ``--repeats`` times and reports per-metric medians. Baselines
+are only comparable on the same machine and settings; on dedicated hardware a
+tighter tolerance than the default 0.5 is practical.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+USERS = 1_000_000
+MEDITATIONS = 10_000
+CHAT_MESSAGES = 100_000_000
+ACTIVATION_CODES = 1_000_000
+CHAT_USERS = 1000
+CATEGORIES = ("Sleep", "Stress", "Focus", "Anxiety", "Morning", "Breathing")
+SEED_BATCH = 50_000
+# Events per POST /plays request, roughly one session of progress pings.
+PLAY_BATCH = 50
+
+
+def scaled(volume: int, scale: float) -> int:
+    return max(1, int(volume * scale))
+
+
+def seed(path: str, scale: float, rng: random.Random) -> dict:
+    """Bulk-load the schema created by ``create_db_tables`` with raw executemany."""
+    users = scaled(USERS, scale)
+    meditations = scaled(MEDITATIONS, scale)
+    messages = scaled(CHAT_MESSAGES, scale)
+    codes = scaled(ACTIVATION_CODES, scale)
+    chat_users = min(users, CHAT_USERS)
+    far_future = datetime(2100, 1, 1)
+    start = datetime(2024, 1, 1)
+
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO meditations (id, title, description, duration_seconds, audio_url, is_premium, category) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            (i, f"Meditation {i}", "Generated for benchmarks", 300 + i % 900, f"https://cdn.example.com/{i}.mp3", i % 3 == 0, CATEGORIES[i % len(CATEGORIES)])
+            for i in range(1, meditations + 1)
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO users (id, name, is_premium, premium_expires_at, last_played_meditation_id) VALUES (?, ?, ?, ?, ?)",
+        (
+            (f"user_{i}", f"User {i}", i % 10 == 0, str(far_future) if i % 10 == 0 else None, rng.randint(1, meditations))
+            for i in range(users)
+        ),
+    )
+    raw_codes = []
+    for offset in range(0, codes, SEED_BATCH):
+        batch = [str(uuid.uuid4()) for _ in range(min(SEED_BATCH, codes - offset))]
+        raw_codes.extend(batch)
+        conn.executemany(
+            "INSERT INTO activation_codes (code, duration_days, is_used) VALUES (?, 30, 0)",
+            ((hashlib.sha256(code.encode()).hexdigest(),) for code in batch),
+        )
+    for offset in range(0, messages, SEED_BATCH):
+        conn.executemany(
+            "INSERT INTO chat_messages (id, user_id, content, is_user, created_at) VALUES (?, ?, ?, ?, ?)",
+            (
+                (str(uuid.uuid4()), f"user_{i % chat_users}", f"message {i}", i % 2 == 0, str(start + timedelta(seconds=i)))
+                for i in range(offset, min(offset + SEED_BATCH, messages))
+            ),
+        )
+    conn.commit()
+    conn.close()
+    return {
+        "users": users,
+        "meditations": meditations,
+        "chat_messages": messages,
+        "chat_users": chat_users,
+        "activation_codes": codes,
+        "raw_codes": raw_codes,
+    }
+
+
+def fake_openai_app(latency: float):
+    """Just enough of ``/v1/chat/completions`` for the OpenAI SDK, plain and streamed."""
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Route
+
+    reply = "Попробуйте сделать несколько медленных вдохов и выдохов."
+
+    async def completions(request):
+        body = await request.json()
+        await asyncio.sleep(latency)
+        common = {"id": "chatcmpl-bench", "created": int(time.time()), "model": body["model"]}
+        usage = {"prompt_tokens": 50, "completion_tokens": 12, "total_tokens": 62}
+        if not body.get("stream"):
+            return JSONResponse({
+                **common,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        async def events():
+            for word in reply.split(" "):
+                chunk = {**common, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return Starlette(routes=[Route("/v1/chat/completions", completions, methods=["POST"])])
+
+
+def start_fake_openai(latency: float) -> str:
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(fake_openai_app(latency), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+def scenarios(data: dict, rng: random.Random) -> dict:
+    """name -> (router, request factory); factories map a request number to (method, url, json)."""
+    users, chat_users, meditations = data["users"], data["chat_users"], data["meditations"]
+    codes = iter(data["raw_codes"])
+
+    def user():
+        return f"user_{rng.randrange(users)}"
+
+    def premium_user():
+        return f"user_{rng.randrange(0, users, 10)}"
+
+    def chat_user():
+        return f"user_{rng.randrange(chat_users)}"
+
+    def cursor():
+        return base64.urlsafe_b64encode(user().encode()).decode()
+
+    def plays():
+        meditation_id = rng.randint(1, meditations)
+        kinds = ["start"] + ["progress"] * (PLAY_BATCH - 2) + ["complete"]
+        return {"events": [
+            {"meditation_id": meditation_id, "kind": kind, "position_seconds": i * 10} for i, kind in enumerate(kinds)
+        ]}
+
+    return {
+        "users.get": ("users", lambda: ("GET", f"/api/users/{user()}", None)),
+        "users.list_page": ("users", lambda: ("GET", f"/api/users/?limit=100&after={cursor()}", None)),
+        "users.last_played": ("users", lambda: ("GET", f"/api/users/{user()}/last_played", None)),
+        "users.set_last_played": ("users", lambda: ("POST", f"/api/users/{user()}/last_played/{rng.randint(1, meditations)}", None)),
+        "users.plays": ("users", lambda: ("POST", f"/api/users/{user()}/plays", plays())),
+        "meditations.list": ("meditations", lambda: ("GET", f"/api/meditations/?user_id={user()}", None)),
+        "meditations.list_category": ("meditations", lambda: ("GET", f"/api/meditations/?category={rng.choice(CATEGORIES)}", None)),
+        "meditations.popular": ("meditations", lambda: ("GET", f"/api/meditations/?sort=popular&limit=20&category={rng.choice(CATEGORIES)}", None)),
+        "meditations.continue": ("meditations", lambda: ("GET", f"/api/meditations/continue?user_id={user()}", None)),
+        "meditations.recommended": ("meditations", lambda: ("GET", f"/api/meditations/recommended?user_id={user()}", None)),
+        "meditations.get": ("meditations", lambda: ("GET", f"/api/meditations/{rng.randint(1, meditations)}?user_id={premium_user()}", None)),
+        "subscription.check": ("subscription", lambda: ("GET", f"/api/subscription/check?code={rng.choice(data['raw_codes'])}", None)),
+        "subscription.activate": ("subscription", lambda: ("POST", "/api/subscription/activate", {"code": next(codes), "user_id": user()})),
+        "chat.history": ("chat", lambda: ("GET", f"/api/chat/history?user_id={chat_user()}", None)),
+        "chat.completion": ("chat", lambda: ("POST", "/api/chat/", {"user_id": chat_user(), "message": "Мне тревожно перед сном"})),
+        "chat.stream": ("chat", lambda: ("POST", "/api/chat/stream", {"user_id": chat_user(), "message": "Как успокоиться?"})),
+    }
+
+
+def percentile(sorted_values, q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+async def drive(client, factory, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            method, url, body = factory()
+            started = time.perf_counter()
+            resp = await client.request(method, url, json=body)
+            latencies.append(time.perf_counter() - started)
+            errors += resp.status_code >= 400
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def median_run(runs: list) -> dict:
+    """Per-metric median over repeated runs, which damps scheduler noise on shared machines."""
+    merged = {}
+    for key in runs[0]:
+        values = sorted(r[key] for r in runs)
+        merged[key] = values[len(values) // 2]
+    merged["errors"] = sum(r["errors"] for r in runs)
+    merged["requests"] = sum(r["requests"] for r in runs)
+    return merged
+
+
+async def run(args, db_path: str) -> dict:
+    import httpx
+    from src.main import app
+    from src.models.models import create_db_tables
+
+    rng = random.Random(args.seed)
+    await create_db_tables()
+    seed_started = time.perf_counter()
+    data = seed(db_path, args.scale, rng)
+    seed_seconds = time.perf_counter() - seed_started
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            for name, (router, factory) in scenarios(data, rng).items():
+                if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                    continue
+                # One untimed pass warms the caches, as in steady-state production.
+                await drive(client, factory, min(args.requests, 50), 1)
+                results[name] = {"router": router}
+                for concurrency in args.concurrency:
+                    runs = [await drive(client, factory, args.requests, concurrency) for _ in range(args.repeats)]
+                    results[name][str(concurrency)] = median_run(runs)
+
+    return {
+        "settings": {
+            "scale": args.scale,
+            "requests": args.requests,
+            "repeats": args.repeats,
+            "concurrency": args.concurrency,
+            "openai_latency_ms": args.openai_latency_ms,
+        },
+        "volumes": {k: v for k, v in data.items() if k != "raw_codes"},
+        "seed_seconds": round(seed_seconds, 1),
+        "scenarios": results,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """Describe every scenario and concurrency level that regressed past ``tolerance``."""
+    regressions = []
+    for name, levels in baseline["scenarios"].items():
+        for level, base in levels.items():
+            now = current["scenarios"].get(name, {}).get(level)
+            if not isinstance(base, dict) or now is None:
+                continue
+            if now["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{name} @ {level}: p95 {now['p95_ms']} ms vs baseline {base['p95_ms']} ms")
+            if now["rps"] < base["rps"] / (1 + tolerance):
+                regressions.append(f"{name} @ {level}: {now['rps']} req/s vs baseline {base['rps']} req/s")
+            if now["errors"] > base["errors"]:
+                regressions.append(f"{name} @ {level}: {now['errors']} errors vs baseline {base['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, default=0.01)
+    parser.add_argument("--concurrency", type=lambda s: [int(c) for c in s.split(",")], default=[1, 16, 64])
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per scenario and concurrency level")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per level; the median of each metric is reported")
+    parser.add_argument("--openai-latency-ms", type=float, default=20)
+    parser.add_argument("--only", type=lambda s: s.split(","), default=None, help="scenario name prefixes, e.g. users,chat.stream")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        # The app reads its settings on import, so configure it before the first ``src`` import.
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+        os.environ["OPENAI_API_KEY"] = "bench"
+        os.environ["OPENAI_BASE_URL"] = start_fake_openai(args.openai_latency_ms / 1000)
+        result = asyncio.run(run(args, db_path))
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w") as f:
+            f.write(output + "\n")
+    elif args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit("Performance regressions:\n  " + "\n  ".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
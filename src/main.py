@@ -1,23 +1,104 @@
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from starlette.staticfiles import StaticFiles
-from starlette.responses import FileResponse
+from starlette.responses import FileResponse, PlainTextResponse
+from starlette.datastructures import MutableHeaders
 from dotenv import load_dotenv
+import anyio
+import logging
+import time
 import uvicorn
 
-from src.models.models import create_db_tables
+from src.models.models import QueryStats, create_db_tables, engine, query_stats
 from src.routes import user_routes, meditation_routes, subscription_routes, chat_routes
+from src.services.openai_client import openai_pool
+from src.services.chat_buffer import chat_buffer
+from src.services.chat_jobs import chat_jobs
+from src.services.play_events import play_events
+from src.services.popularity import popularity
+from src.services.activation_codes import shutdown_code_hash_pool
+from src.services import metrics
+from src.services.catalog import catalog_cache
+from src.services.code_cache import activation_code_cache
+from src.services.completion_cache import completion_cache
+from src.services.entitlements import entitlement_cache
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    create_db_tables()
+    await create_db_tables()
+    await openai_pool.start()
+    await chat_buffer.start()
+    await chat_jobs.start(chat_routes.answer_chat_job)
+    await play_events.start()
+    await popularity.start()
     yield
+    await popularity.close()
+    await chat_jobs.close()
+    await chat_buffer.close()
+    await play_events.close()
+    await openai_pool.close()
+    shutdown_code_hash_pool()
+    await engine.dispose()
+
+
+def server_timing(stats: QueryStats, elapsed: float) -> str:
+    return (
+        f'db;dur={stats.total * 1000:.2f};desc="{stats.count} queries", '
+        f"db-slowest;dur={stats.slowest * 1000:.2f}, "
+        f"total;dur={elapsed * 1000:.2f}"
+    )
+
+
+class QueryTimingMiddleware:
+    """Charge SQL statements to the request that ran them.
+
+    Query count, DB time and the slowest statement go into a ``Server-Timing``
+    header and one log line per request. Streaming responses send headers
+    first, so their header only covers queries made before the first byte;
+    the log line covers the whole response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = query_stats.set(stats)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append("Server-Timing", server_timing(stats, time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            query_stats.reset(token)
+            logger.info(
+                "%s %s %d duration_ms=%.1f db_queries=%d db_ms=%.1f db_slowest_ms=%.1f db_slowest=%r",
+                scope["method"], scope["path"], status_code,
+                (time.perf_counter() - started) * 1000,
+                stats.count, stats.total * 1000, stats.slowest * 1000,
+                stats.slowest_statement,
+            )
 
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(QueryTimingMiddleware)
+app.add_middleware(metrics.RequestMetricsMiddleware)
 
 app.mount("/static", StaticFiles(directory="src/static"), name="static")
 
@@ -27,6 +108,23 @@ app.include_router(subscription_routes.router, prefix="/api/subscription", tags=
 app.include_router(chat_routes.router, prefix="/api/chat", tags=["chat"])
 
 
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    body = metrics.render(
+        pool=engine.pool,
+        thread_limiter=anyio.to_thread.current_default_thread_limiter(),
+        caches={
+            "catalog": catalog_cache.stats(),
+            "entitlements": entitlement_cache.stats(),
+            "activation_codes": activation_code_cache.stats(),
+            "completions": completion_cache.stats(),
+        },
+        chat_jobs=chat_jobs,
+        play_events=play_events.stats(),
+    )
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
 @app.get("/", include_in_schema=False)
 async def read_index():
     return FileResponse("src/static/index.html")
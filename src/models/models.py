@@ -1,15 +1,225 @@
+import asyncio
+import logging
+import os
+import time
 import uuid
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from contextvars import ContextVar
+from sqlalchemy import BigInteger, Column, Integer, SmallInteger, String, Boolean, DateTime, ForeignKey, Index, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from datetime import datetime, timezone
+from typing import Optional
+from dotenv import load_dotenv
+from src.services.metrics import db_checkout_wait
 
-DATABASE_URL = "sqlite:///./app.db"
+load_dotenv()
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+logger = logging.getLogger(__name__)
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def to_async_url(url: str) -> str:
+    """Swap a plain driver name (``sqlite://``, ``postgresql://``) for its async counterpart."""
+    parsed = make_url(url)
+    drivername = ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername)
+    return parsed.set(drivername=drivername).render_as_string(hide_password=False)
+
+
+DATABASE_URL = to_async_url(os.getenv("DATABASE_URL", "sqlite:///./app.db"))
+IS_SQLITE = make_url(DATABASE_URL).get_backend_name() == "sqlite"
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-64000")),
+}
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waits for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_checkout_wait.observe(time.perf_counter() - started)
+
+
+engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=TimedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    pool_recycle=DB_POOL_RECYCLE,
+)
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record=None):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+if IS_SQLITE:
+    event.listen(engine.sync_engine, "connect", apply_sqlite_pragmas)
+
+
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "200"))
+
+
+class QueryStats:
+    """SQL statements run on behalf of one request."""
+
+    __slots__ = ("count", "total", "slowest", "slowest_statement")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement: str, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.slowest:
+            self.slowest = elapsed
+            self.slowest_statement = statement
+
+
+# Set per request by the timing middleware; None outside a request, e.g. for
+# background flushes, so their statements are not charged to anyone.
+query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+
+def _record_query_time(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"]
+    stats = query_stats.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+    if elapsed * 1000 >= SQL_SLOW_QUERY_MS:
+        logger.warning("Slow query took %.1f ms: %s", elapsed * 1000, statement)
+
+
+def instrument_queries(sync_engine):
+    """Time every statement on ``sync_engine`` and charge it to the current request."""
+    event.listen(sync_engine, "before_cursor_execute", _start_query_timer)
+    event.listen(sync_engine, "after_cursor_execute", _record_query_time)
+
+
+instrument_queries(engine.sync_engine)
+
+
+# SQLite allows a single writer per database file. Funnelling every write
+# transaction in the process through one lock queues writers in arrival order
+# instead of letting them race for the file lock until busy_timeout expires.
+sqlite_write_lock = asyncio.Lock()
+
+
+class SerializedWriteSession(AsyncSession):
+    """Holds ``sqlite_write_lock`` from the first write until the transaction ends.
+
+    Writes are the ORM flush inside ``commit()`` or ``flush()`` and any DML
+    statement passed to ``execute()``, ``scalar()`` or ``scalars()``.
+    """
+
+    _holds_write_lock = False
+
+    async def _acquire_write_lock(self):
+        if not self._holds_write_lock:
+            # Check out the connection first. A session waiting for the lock
+            # may already hold one, so taking the lock and then waiting for a
+            # free connection could leave the holder and the pool waiting on
+            # each other until the pool timeout.
+            await self.connection()
+            await sqlite_write_lock.acquire()
+            self._holds_write_lock = True
+
+    def _release_write_lock(self):
+        if self._holds_write_lock:
+            self._holds_write_lock = False
+            sqlite_write_lock.release()
+
+    async def execute(self, statement, *args, **kwargs):
+        if getattr(statement, "is_dml", False):
+            await self._acquire_write_lock()
+        return await super().execute(statement, *args, **kwargs)
+
+    async def scalar(self, statement, *args, **kwargs):
+        if getattr(statement, "is_dml", False):
+            await self._acquire_write_lock()
+        return await super().scalar(statement, *args, **kwargs)
+
+    async def scalars(self, statement, *args, **kwargs):
+        if getattr(statement, "is_dml", False):
+            await self._acquire_write_lock()
+        return await super().scalars(statement, *args, **kwargs)
+
+    async def flush(self, objects=None):
+        await self._acquire_write_lock()
+        await super().flush(objects)
+
+    async def commit(self):
+        await self._acquire_write_lock()
+        try:
+            await super().commit()
+        finally:
+            self._release_write_lock()
+
+    async def rollback(self):
+        try:
+            await super().rollback()
+        finally:
+            self._release_write_lock()
+
+    async def close(self):
+        try:
+            await super().close()
+        finally:
+            self._release_write_lock()
+
+
+SessionLocal = async_sessionmaker(
+    bind=engine,
+    class_=SerializedWriteSession if IS_SQLITE else AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
 Base = declarative_base()
 
 
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """SQLite hands timestamps back naive; every stored timestamp is UTC."""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def premium_active(is_premium: bool, expires_at: Optional[datetime], now: Optional[datetime] = None) -> bool:
+    expires_at = as_utc(expires_at)
+    return bool(is_premium and expires_at is not None and expires_at > (now or datetime.now(timezone.utc)))
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -23,11 +233,7 @@ class User(Base):
     last_played_meditation = relationship("Meditation", foreign_keys=[last_played_meditation_id])
 
     def has_active_premium(self) -> bool:
-        return (
-            self.is_premium
-            and self.premium_expires_at is not None
-            and self.premium_expires_at > datetime.now(timezone.utc)
-        )
+        return premium_active(self.is_premium, self.premium_expires_at)
 
 
 class Meditation(Base):
@@ -39,7 +245,16 @@ class Meditation(Base):
     duration_seconds = Column(Integer)
     audio_url = Column(String)
     is_premium = Column(Boolean, default=False)
-    category = Column(String, index=True)
+    category = Column(String)
+
+    # Gated list queries (tier filter, optional category, keyset order on id)
+    # are answered from an index alone, without touching the table rows. The
+    # second index serves the free tier without a category, whose filter the
+    # category-led one cannot seek on.
+    __table_args__ = (
+        Index("ix_meditations_category_premium_id", "category", "is_premium", "id"),
+        Index("ix_meditations_premium_id", "is_premium", "id"),
+    )
 
 
 class ActivationCode(Base):
@@ -60,19 +275,83 @@ class ChatMessage(Base):
     __tablename__ = "chat_messages"
 
     id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
-    user_id = Column(String, index=True, nullable=False)
+    user_id = Column(String, nullable=False)
     content = Column(String, nullable=False)
     is_user = Column(Boolean, nullable=False)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
 
+    # Serves every chat lookup (filter on user_id, keyset order on created_at, id)
+    # straight from the index, without sorting the user's history.
+    __table_args__ = (
+        Index("ix_chat_messages_user_created", "user_id", "created_at", "id"),
+    )
+
+
+class PlayEvent(Base):
+    """One playback event; ``kind`` indexes ``PLAY_EVENT_KINDS``.
+
+    Append-only and written in bulk by the play event buffer, so it carries no
+    foreign keys and keeps to narrow integer columns.
+    """
+    __tablename__ = "play_events"
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    user_id = Column(String, nullable=False)
+    meditation_id = Column(Integer, nullable=False)
+    kind = Column(SmallInteger, nullable=False)
+    position_seconds = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False)
+
+    # The first serves a user's listening history newest first straight from
+    # the index; the second finds where a popularity window starts.
+    __table_args__ = (
+        Index("ix_play_events_user_id_id", "user_id", "id"),
+        Index("ix_play_events_created_at", "created_at"),
+    )
+
+
+PLAY_EVENT_KINDS = ("start", "progress", "complete")
+
+
+class ListeningProgress(Base):
+    """Latest position per user and meditation, kept up to date from play events."""
+    __tablename__ = "listening_progress"
+
+    user_id = Column(String, primary_key=True)
+    meditation_id = Column(Integer, primary_key=True)
+    position_seconds = Column(Integer, nullable=False, default=0)
+    completed = Column(Boolean, nullable=False, default=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    # "Continue listening" reads a user's most recent unfinished entries in index order.
+    __table_args__ = (
+        Index("ix_listening_progress_user_updated", "user_id", "updated_at"),
+    )
+
+
+# Indexes superseded by a wider one; dropped from databases created before the change.
+OBSOLETE_INDEXES = ["ix_chat_messages_user_id", "ix_meditations_category"]
+
+
+def migrate_indexes(connection):
+    """Bring indexes of already existing tables in line with the models.
+
+    ``create_all`` only creates indexes together with new tables, so indexes
+    added to a model later are created here, and superseded ones dropped.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    for name in OBSOLETE_INDEXES:
+        connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
 
-def create_db_tables():
-    Base.metadata.create_all(bind=engine)
+async def create_db_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(migrate_indexes)
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -1,23 +1,32 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
 import os
-from datetime import datetime, timezone
-from starlette.concurrency import run_in_threadpool
+import json
+import asyncio
+import base64
+import time
+from datetime import datetime
+from typing import List, Optional
 from src.models.models import ChatMessage, get_db
+from src.services.openai_client import get_openai_client, openai_pool
+from src.services.chat_buffer import chat_buffer, message_sort_key
+from src.services.completion_cache import completion_cache
+from src.services.chat_jobs import ChatQueueFull, chat_jobs
+from src.services.metrics import openai_metrics
 
 load_dotenv()
 
 router = APIRouter(tags=["chat"])
 
-
-def get_openai_client():
-    try:
-        from openai import OpenAI
-        return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    except Exception:
-        return None
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+CHAT_HISTORY_MAX_PAGE_SIZE = 200
+CHAT_CONTEXT_MAX_MESSAGES = int(os.getenv("CHAT_CONTEXT_MAX_MESSAGES", "20"))
+CHAT_CONTEXT_MAX_TOKENS = int(os.getenv("CHAT_CONTEXT_MAX_TOKENS", "2000"))
+CHAT_JOB_MAX_WAIT_SECONDS = 30
 
 
 SYSTEM_PROMPT = """
@@ -28,6 +37,69 @@ SYSTEM_PROMPT = """
 """
 
 
+def estimate_tokens(text: str) -> int:
+    # Cyrillic averages roughly three characters per token with the GPT-4o tokenizer.
+    return len(text) // 3 + 1
+
+
+def encode_cursor(message: ChatMessage) -> str:
+    created_at = message.created_at.replace(tzinfo=None).isoformat()
+    return base64.urlsafe_b64encode(f"{created_at}|{message.id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        created_at, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), message_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def newest_first(user_id: str, before: Optional[tuple[datetime, str]] = None):
+    query = select(ChatMessage).where(
+        ChatMessage.user_id == user_id
+    ).order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+    if before:
+        # A row-value comparison lets SQLite seek the composite index directly.
+        query = query.where(tuple_(ChatMessage.created_at, ChatMessage.id) < tuple_(*before))
+    return query
+
+
+def merge_unflushed(rows: List[ChatMessage], unflushed: List[ChatMessage], limit: int, before: Optional[tuple[datetime, str]] = None) -> List[ChatMessage]:
+    """Fold not yet written messages into a newest-first page read from the database.
+
+    ``unflushed`` must be taken before the read: a batch committed while the
+    read is in flight then shows up in one list or both, never in neither.
+    """
+    pending = [m for m in unflushed if before is None or message_sort_key(m) < before]
+    if not pending:
+        return list(rows)
+    # A batch can land in the database between the snapshot and the read.
+    merged = {m.id: m for m in (*rows, *pending)}
+    return sorted(merged.values(), key=message_sort_key, reverse=True)[:limit]
+
+
+def trim_context(recent: List[ChatMessage], max_tokens: int) -> List[ChatMessage]:
+    """Keep the newest messages (given newest first) that fit into ``max_tokens``, oldest first."""
+    kept = []
+    budget = max_tokens
+    for msg in recent:
+        budget -= estimate_tokens(msg.content)
+        if budget < 0:
+            break
+        kept.append(msg)
+    kept.reverse()
+    return kept
+
+
+def fallback_response(message: str) -> str:
+    return f"Это пример ответа ИИ на сообщение: '{message}'."
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 class ChatRequest(BaseModel):
     user_id: str
     message: str
@@ -37,16 +109,17 @@ class ChatResponse(BaseModel):
     response: str
 
 
-@router.post("/", response_model=ChatResponse)
-async def chat_with_psychologist(request: ChatRequest, db: Session = Depends(get_db)):
-    if not request.user_id:
-        raise HTTPException(status_code=400, detail="user_id is required")
+class ChatJobResponse(BaseModel):
+    job_id: str
+    status: str
+    response: Optional[str] = None
 
-    client = get_openai_client()
 
-    history = db.query(ChatMessage).filter(
-        ChatMessage.user_id == request.user_id
-    ).order_by(ChatMessage.created_at.asc()).all()
+async def build_messages(db: AsyncSession, user_id: str, message: str) -> list[dict]:
+    unflushed = chat_buffer.unflushed(user_id)
+    recent = (await db.scalars(newest_first(user_id).limit(CHAT_CONTEXT_MAX_MESSAGES))).all()
+    recent = merge_unflushed(recent, unflushed, CHAT_CONTEXT_MAX_MESSAGES)
+    history = trim_context(recent, CHAT_CONTEXT_MAX_TOKENS - estimate_tokens(message))
 
     messages = [{"role": "system", "content": SYSTEM_PROMPT}]
     for msg in history:
@@ -54,53 +127,215 @@ async def chat_with_psychologist(request: ChatRequest, db: Session = Depends(get
             "role": "user" if msg.is_user else "assistant",
             "content": msg.content
         })
-    messages.append({"role": "user", "content": request.message})
+    messages.append({"role": "user", "content": message})
+    return messages
 
-    now = datetime.now(timezone.utc)
-    db.add(ChatMessage(
-        user_id=request.user_id,
-        content=request.message,
-        is_user=True,
-        created_at=now
-    ))
-    db.commit()
 
-    try:
-        def create_completion():
-            return client.chat.completions.create(
+async def create_completion(client, messages: list[dict]) -> str:
+    async with openai_pool.slots:
+        started = time.perf_counter()
+        try:
+            completion = await client.chat.completions.create(
                 model="gpt-4o-mini",
                 messages=messages,
                 max_tokens=150,
                 temperature=0.7
             )
+        except Exception:
+            openai_metrics.record(time.perf_counter() - started, failed=True)
+            raise
+        openai_metrics.record(time.perf_counter() - started, getattr(completion, "usage", None))
+    return completion.choices[0].message.content.strip()
+
+
+async def stream_completion(client, messages: list[dict]):
+    """Yield the non-empty content deltas of a streamed completion."""
+    async with openai_pool.slots:
+        started = time.perf_counter()
+        usage = None
+        failed = True
+        try:
+            stream = await client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                max_tokens=150,
+                temperature=0.7,
+                stream=True
+            )
+            async for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+            failed = False
+        finally:
+            openai_metrics.record(time.perf_counter() - started, usage, failed)
+
+
+async def reply_to(messages: list[dict], message: str) -> str:
+    """Answer from the completion cache or the model, falling back to a canned reply."""
+    client = get_openai_client()
 
-        if client:
-            completion = await run_in_threadpool(create_completion)
-            response_text = completion.choices[0].message.content.strip()
-        else:
-            raise Exception("OpenAI client not initialized")
+    cache_key = completion_cache.key(messages) if completion_cache.enabled else None
+    response_text = completion_cache.get(cache_key) if cache_key else None
 
-    except Exception:
-        response_text = f"Это пример ответа ИИ на сообщение: '{request.message}'."
+    if response_text is None:
+        try:
+            if client:
+                response_text = await create_completion(client, messages)
+                if cache_key:
+                    completion_cache.put(cache_key, response_text)
+            else:
+                raise Exception("OpenAI client not initialized")
 
-    db.add(ChatMessage(
-        user_id=request.user_id,
-        content=response_text,
-        is_user=False,
-        created_at=datetime.now(timezone.utc)
-    ))
-    db.commit()
+        except Exception:
+            response_text = fallback_response(message)
+
+    return response_text
+
+
+async def answer_chat_job(session_factory, user_id: str, message: str) -> str:
+    # The session is released before the upstream call, which may take seconds.
+    async with session_factory() as db:
+        messages = await build_messages(db, user_id, message)
+    chat_buffer.add(user_id, message, is_user=True)
+    response_text = await reply_to(messages, message)
+    chat_buffer.add(user_id, response_text, is_user=False)
+    return response_text
+
+
+@router.post("/", response_model=ChatResponse)
+async def chat_with_psychologist(request: ChatRequest, db: AsyncSession = Depends(get_db)):
+    if not request.user_id:
+        raise HTTPException(status_code=400, detail="user_id is required")
+
+    messages = await build_messages(db, request.user_id, request.message)
+    # Give the pooled connection back before the upstream call, which may take seconds.
+    await db.close()
+    chat_buffer.add(request.user_id, request.message, is_user=True)
+    response_text = await reply_to(messages, request.message)
+    chat_buffer.add(request.user_id, response_text, is_user=False)
 
     return ChatResponse(response=response_text)
 
 
+@router.post("/jobs", status_code=202, response_model=ChatJobResponse)
+async def enqueue_chat(request: ChatRequest, response: Response):
+    """Queue a turn for the background workers and return its job id at once.
+
+    Poll ``GET /jobs/{job_id}``, or pass ``wait`` to hold the request until
+    the reply is ready. Turns of one user are answered in submission order.
+    """
+    if not request.user_id:
+        raise HTTPException(status_code=400, detail="user_id is required")
+
+    try:
+        job = chat_jobs.submit(request.user_id, request.message)
+    except ChatQueueFull:
+        raise HTTPException(status_code=503, detail="Chat queue is full", headers={"Retry-After": "1"})
+
+    response.headers["Location"] = f"/api/chat/jobs/{job.id}"
+    return ChatJobResponse(job_id=job.id, status=job.status)
+
+
+@router.get("/jobs/{job_id}", response_model=ChatJobResponse)
+async def get_chat_job(job_id: str, wait: float = Query(0, ge=0, le=CHAT_JOB_MAX_WAIT_SECONDS)):
+    job = chat_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if wait and not job.done.is_set():
+        try:
+            await asyncio.wait_for(job.done.wait(), wait)
+        except asyncio.TimeoutError:
+            pass
+
+    return ChatJobResponse(job_id=job.id, status=job.status, response=job.response)
+
+
+@router.post("/stream")
+async def stream_chat_with_psychologist(request: ChatRequest, db: AsyncSession = Depends(get_db)):
+    """Stream the reply as Server-Sent Events.
+
+    Emits a ``token`` event per content delta and a final ``done`` event with
+    the full reply, which is persisted once the upstream stream has ended. If
+    the client disconnects first, the part received so far is persisted.
+    """
+    if not request.user_id:
+        raise HTTPException(status_code=400, detail="user_id is required")
+
+    client = get_openai_client()
+
+    messages = await build_messages(db, request.user_id, request.message)
+    # The stream can stay open for a long time and only needs the chat buffer.
+    await db.close()
+    chat_buffer.add(request.user_id, request.message, is_user=True)
+
+    cache_key = completion_cache.key(messages) if completion_cache.enabled else None
+    cached = completion_cache.get(cache_key) if cache_key else None
+
+    async def events():
+        parts = []
+        persisted = False
+        try:
+            try:
+                if cached is not None:
+                    parts.append(cached)
+                    yield sse_event("token", {"content": cached})
+                elif not client:
+                    raise Exception("OpenAI client not initialized")
+                else:
+                    async for delta in stream_completion(client, messages):
+                        parts.append(delta)
+                        yield sse_event("token", {"content": delta})
+                    if cache_key:
+                        completion_cache.put(cache_key, "".join(parts).strip())
+            except Exception:
+                if not parts:
+                    parts.append(fallback_response(request.message))
+                    yield sse_event("token", {"content": parts[0]})
+
+            response_text = "".join(parts).strip()
+            chat_buffer.add(request.user_id, response_text, is_user=False)
+            persisted = True
+            yield sse_event("done", {"response": response_text})
+        finally:
+            if not persisted:
+                # The client went away mid-stream; keep what arrived so far so
+                # the user's message is not left without a reply in the history.
+                response_text = "".join(parts).strip() or fallback_response(request.message)
+                chat_buffer.add(request.user_id, response_text, is_user=False)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/history", response_model=list[ChatResponse])
-def get_chat_history(user_id: str, db: Session = Depends(get_db)):
+async def get_chat_history(
+    response: Response,
+    user_id: str,
+    limit: int = Query(CHAT_HISTORY_PAGE_SIZE, ge=1, le=CHAT_HISTORY_MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Return one page of history in chronological order.
+
+    Pages walk backwards from the newest message; pass the ``X-Next-Cursor``
+    header of a page as ``before`` to fetch the page preceding it.
+    """
     if not user_id:
         raise HTTPException(status_code=400, detail="user_id is required")
 
-    messages = db.query(ChatMessage).filter(
-        ChatMessage.user_id == user_id
-    ).order_by(ChatMessage.created_at.asc()).all()
+    cursor = decode_cursor(before) if before else None
+    unflushed = chat_buffer.unflushed(user_id)
+    rows = (await db.scalars(newest_first(user_id, cursor).limit(limit + 1))).all()
+    messages = merge_unflushed(rows, unflushed, limit + 1, cursor)
+    if len(messages) > limit:
+        messages = messages[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(messages[-1])
+    messages.reverse()
 
     return [ChatResponse(response=m.content) for m in messages]
@@ -1,12 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List, Optional
-from datetime import datetime, timezone
-from src.models.models import Meditation, User, get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import and_, or_, select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, List, Optional
+import base64
+import bisect
+import os
+import orjson
+from src.models.models import ChatMessage, ListeningProgress, Meditation, PlayEvent, get_db
+from src.services.catalog import catalog_cache, make_etag
+from src.services.chat_buffer import chat_buffer
+from src.services.entitlements import entitlement_cache
+from src.services.play_events import COMPLETE
+from src.services.popularity import popularity
+from src.services.search import DURATION_BUCKETS
 from pydantic import BaseModel, ConfigDict
 
+MEDITATIONS_PAGE_SIZE = int(os.getenv("MEDITATIONS_PAGE_SIZE", "50"))
+MEDITATIONS_MAX_PAGE_SIZE = 500
+CONTINUE_LISTENING_MAX = 50
+RECOMMEND_MAX = 50
+RECOMMEND_HISTORY_EVENTS = 200
+RECOMMEND_CHAT_MESSAGES = 20
+
 router = APIRouter()
 
+DURATION_PATTERN = "^(" + "|".join(name for name, _ in DURATION_BUCKETS) + ")$"
+
 
 class MeditationSchema(BaseModel):
     id: int
@@ -21,9 +40,38 @@ class MeditationSchema(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class ContinueListeningItem(MeditationSchema):
+    position_seconds: int
+
+
+class RecommendedMeditation(MeditationSchema):
+    score: float
+
+
+class MeditationSearchResponse(BaseModel):
+    total: int
+    items: List[MeditationSchema]
+    facets: Dict[str, Dict[str, int]]
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def catalog_response(request: Request, body: bytes, etag: str, headers: Optional[dict] = None) -> Response:
+    headers = {**(headers or {}), "ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @router.post("/seed", status_code=201)
-def seed_meditations(db: Session = Depends(get_db)):
-    if db.query(Meditation).count() > 0:
+async def seed_meditations(db: AsyncSession = Depends(get_db)):
+    if await db.scalar(select(func.count()).select_from(Meditation)) > 0:
         raise HTTPException(status_code=400, detail="Meditation data already exists.")
 
     sample_data = [
@@ -37,61 +85,269 @@ def seed_meditations(db: Session = Depends(get_db)):
 
     for med in sample_data:
         db.add(Meditation(**med))
-    db.commit()
+    await db.commit()
     return {"message": "Meditation data seeded successfully"}
 
 
-@router.get("/", response_model=List[MeditationSchema])
-def get_meditations(user_id: Optional[str] = None, category: Optional[str] = None, db: Session = Depends(get_db)):
-    query = db.query(Meditation)
-    if category:
-        query = query.filter(Meditation.category == category)
-    meditations = query.all()
-
-    is_premium_user = False
-    last_played_id = None
-
-    if user_id:
-        user = db.query(User).filter(User.id == user_id).first()
-        if user:
-            now_utc = datetime.now(timezone.utc)
-            if user.premium_expires_at:
-                premium_dt = user.premium_expires_at
-                if premium_dt.tzinfo is None:
-                    premium_dt = premium_dt.replace(tzinfo=timezone.utc)
-                is_premium_user = user.is_premium and premium_dt > now_utc
-            last_played_id = user.last_played_meditation_id
-
-    result = []
-    for med in meditations:
-        if med.is_premium and not is_premium_user:
+def encode_cursor(sort: str, value, med_id: int) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps([sort, value, med_id])).decode()
+
+
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    try:
+        cursor_sort, value, med_id = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if cursor_sort != sort or not isinstance(med_id, int) or isinstance(value, str) != (sort == "title"):
+            raise ValueError(cursor_sort)
+        return value, med_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def meditations_page(
+    include_premium: bool,
+    category: Optional[str],
+    min_duration: Optional[int],
+    max_duration: Optional[int],
+    sort: str,
+    after: Optional[tuple],
+    limit: int,
+):
+    """Select ``(id, sort value)`` for one keyset page, filtered and ordered in SQL."""
+    if sort == "duration":
+        key = func.coalesce(Meditation.duration_seconds, 0)
+    elif sort == "title":
+        key = func.coalesce(Meditation.title, "")
+    else:
+        key = Meditation.id
+    query = select(Meditation.id, key)
+
+    if not include_premium:
+        query = query.where(Meditation.is_premium.is_(False))
+    if category is not None:
+        query = query.where(Meditation.category == category)
+    if min_duration is not None:
+        query = query.where(Meditation.duration_seconds >= min_duration)
+    if max_duration is not None:
+        query = query.where(Meditation.duration_seconds <= max_duration)
+
+    # Ascending, ties broken on id.
+    if after is not None:
+        value, med_id = after
+        if sort == "id":
+            query = query.where(Meditation.id > med_id)
+        else:
+            query = query.where(or_(key > value, and_(key == value, Meditation.id > med_id)))
+    if sort == "id":
+        return query.order_by(Meditation.id).limit(limit + 1)
+    return query.order_by(key, Meditation.id).limit(limit + 1)
+
+
+def popular_page(
+    catalog,
+    window: str,
+    include_premium: bool,
+    category: Optional[str],
+    min_duration: Optional[int],
+    max_duration: Optional[int],
+    after: Optional[tuple],
+    limit: int,
+) -> List[tuple]:
+    """``(id, plays)`` for one page of the precomputed popularity ranking."""
+    keys, rows = popularity.ranking(catalog, window, category, include_premium)
+    start = bisect.bisect_right(keys, (-after[0], after[1])) if after else 0
+    page = []
+    for i in range(start, len(rows)):
+        duration = rows[i]["duration_seconds"]
+        if min_duration is not None and (duration is None or duration < min_duration):
             continue
-        result.append(MeditationSchema(**med.__dict__, last_played=(med.id == last_played_id)))
+        if max_duration is not None and (duration is None or duration > max_duration):
+            continue
+        page.append((keys[i][1], -keys[i][0]))
+        if len(page) > limit:
+            break
+    return page
+
 
-    return result
+@router.get("/", response_model=List[MeditationSchema])
+async def get_meditations(
+    request: Request,
+    user_id: Optional[str] = None,
+    category: Optional[str] = None,
+    min_duration: Optional[int] = Query(None, ge=0),
+    max_duration: Optional[int] = Query(None, ge=0),
+    sort: Optional[str] = Query(None, pattern="^(id|duration|title|popular)$"),
+    window: str = Query("week", pattern="^(day|week)$"),
+    limit: Optional[int] = Query(None, ge=1, le=MEDITATIONS_MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """List the meditations the caller may play.
+
+    Without filters the whole listing is served from the catalog snapshot.
+    ``min_duration``/``max_duration`` (seconds), ``sort`` and ``limit`` switch
+    to a keyset-paginated query that filters and orders in SQL; pass the
+    ``X-Next-Cursor`` header as ``after`` to fetch the next page.
+    ``sort=popular`` pages through the precomputed ranking of plays over the
+    last ``window`` instead, most played first.
+    """
+    catalog = await catalog_cache.get(db)
+
+    entitlement = await entitlement_cache.resolve(db, user_id) if user_id else None
+    is_premium_user = entitlement.active() if entitlement else False
+    last_played_id = entitlement.last_played_id if entitlement else None
+
+    if min_duration is None and max_duration is None and sort is None and limit is None and after is None:
+        body, etag = catalog.encoded_listing(category, is_premium_user, last_played_id)
+        return catalog_response(request, body, etag)
+
+    sort = sort or "id"
+    if sort == "popular":
+        sort = f"popular-{window}"
+    limit = limit or MEDITATIONS_PAGE_SIZE
+    cursor = decode_cursor(after, sort) if after else None
+    if sort.startswith("popular"):
+        rows = popular_page(catalog, window, is_premium_user, category, min_duration, max_duration, cursor, limit)
+    else:
+        rows = (await db.execute(
+            meditations_page(is_premium_user, category, min_duration, max_duration, sort, cursor, limit)
+        )).all()
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(sort, rows[-1][1], rows[-1][0])
+
+    ids = [row[0] for row in rows]
+    if any(med_id not in catalog.encoded_items for med_id in ids):
+        # Added by another process since the snapshot was built.
+        catalog_cache.invalidate()
+        catalog = await catalog_cache.get(db)
+    body = catalog.encoded_rows([med_id for med_id in ids if med_id in catalog.encoded_items], last_played_id)
+    return catalog_response(request, body, make_etag(body), headers)
+
+
+@router.get("/continue", response_model=List[ContinueListeningItem])
+async def continue_listening(
+    user_id: str,
+    limit: int = Query(10, ge=1, le=CONTINUE_LISTENING_MAX),
+    db: AsyncSession = Depends(get_db),
+):
+    """Meditations the user started but did not finish, most recent first.
+
+    Reads the ``listening_progress`` rows kept up to date by the play event
+    writer, in index order, and the catalog snapshot for everything else.
+    """
+    entitlement = await entitlement_cache.resolve(db, user_id)
+    if entitlement is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    catalog = await catalog_cache.get(db)
+
+    rows = (await db.execute(
+        select(ListeningProgress.meditation_id, ListeningProgress.position_seconds)
+        .where(ListeningProgress.user_id == user_id, ListeningProgress.completed.is_(False))
+        .order_by(ListeningProgress.updated_at.desc())
+        .limit(limit)
+    )).all()
+    include_premium = entitlement.active()
+    items = [
+        dict(catalog.items[med_id], last_played=med_id == entitlement.last_played_id, position_seconds=position)
+        for med_id, position in rows
+        if med_id in catalog.items and (include_premium or not catalog.items[med_id]["is_premium"])
+    ]
+    return Response(orjson.dumps(items), media_type="application/json")
+
+
+@router.get("/recommended", response_model=List[RecommendedMeditation])
+async def recommended_meditations(
+    user_id: str,
+    limit: int = Query(10, ge=1, le=RECOMMEND_MAX),
+    db: AsyncSession = Depends(get_db),
+):
+    """Meditations matching the user's listening habits and recent chat moods.
+
+    Scores the whole catalog against the user's last plays (categories and
+    durations) and the mood words of their recent chat messages, in process;
+    see ``src.services.recommendations``. Premium items are left out for users
+    without an active subscription.
+    """
+    entitlement = await entitlement_cache.resolve(db, user_id)
+    if entitlement is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    catalog = await catalog_cache.get(db)
+
+    plays = (await db.execute(
+        select(PlayEvent.meditation_id, PlayEvent.kind)
+        .where(PlayEvent.user_id == user_id)
+        .order_by(PlayEvent.id.desc())
+        .limit(RECOMMEND_HISTORY_EVENTS)
+    )).all()
+    # Taken before the read, so a batch committed meanwhile is not missed.
+    unflushed = {m.id: m.content for m in chat_buffer.unflushed(user_id) if m.is_user}
+    stored = (await db.execute(
+        select(ChatMessage.id, ChatMessage.content)
+        .where(ChatMessage.user_id == user_id, ChatMessage.is_user.is_(True))
+        .order_by(ChatMessage.created_at.desc())
+        .limit(RECOMMEND_CHAT_MESSAGES)
+    )).all()
+    messages = list({**dict(stored), **unflushed}.values())
+
+    features = catalog.features
+    profile = features.profile(plays, messages)
+    completed = {med_id for med_id, kind in plays if kind == COMPLETE}
+    prior = features.prior(popularity.totals(), popularity.generation)
+    ranked = features.recommend(profile, entitlement.active(), limit, completed, prior)
+
+    items = [
+        dict(catalog.items[med_id], last_played=med_id == entitlement.last_played_id, score=score)
+        for med_id, score in ranked
+    ]
+    return Response(orjson.dumps(items), media_type="application/json")
+
+
+@router.get("/search", response_model=MeditationSearchResponse)
+async def search_meditations(
+    request: Request,
+    q: str = "",
+    user_id: Optional[str] = None,
+    category: Optional[str] = None,
+    duration: Optional[str] = Query(None, pattern=DURATION_PATTERN),
+    premium: Optional[bool] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db),
+):
+    """Full-text search over titles and descriptions with facet counts.
+
+    Words match by prefix after Russian stemming, so "рассл" finds
+    "Расслабляющий вечер". ``facets`` counts every match the caller may see,
+    before the ``category``, ``duration`` and ``premium`` filters.
+    """
+    catalog = await catalog_cache.get(db)
+
+    entitlement = await entitlement_cache.resolve(db, user_id) if user_id else None
+    is_premium_user = entitlement.active() if entitlement else False
+    last_played_id = entitlement.last_played_id if entitlement else None
+
+    ids, facets = catalog.search.search(q, is_premium_user, category, duration, premium)
+    items = catalog.encoded_rows(ids[offset:offset + limit], last_played_id)
+    head = orjson.dumps({"total": len(ids), "facets": facets})
+    body = head[:-1] + b',"items":' + items + b"}"
+    return catalog_response(request, body, make_etag(body))
 
 
 @router.get("/{meditation_id}", response_model=MeditationSchema)
-def get_meditation(meditation_id: int, user_id: Optional[str] = None, db: Session = Depends(get_db)):
-    meditation = db.query(Meditation).filter(Meditation.id == meditation_id).first()
+async def get_meditation(request: Request, meditation_id: int, user_id: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    catalog = await catalog_cache.get(db)
+    meditation = catalog.encoded_items.get(meditation_id)
     if not meditation:
         raise HTTPException(status_code=404, detail="Meditation not found")
 
-    is_premium_user = False
-    last_played = False
-
-    if user_id:
-        user = db.query(User).filter(User.id == user_id).first()
-        if user:
-            now_utc = datetime.now(timezone.utc)
-            if user.premium_expires_at:
-                premium_dt = user.premium_expires_at
-                if premium_dt.tzinfo is None:
-                    premium_dt = premium_dt.replace(tzinfo=timezone.utc)
-                is_premium_user = user.is_premium and premium_dt > now_utc
-            last_played = (user.last_played_meditation_id == meditation_id)
-
-    if meditation.is_premium and not is_premium_user:
+    entitlement = await entitlement_cache.resolve(db, user_id) if user_id else None
+    is_premium_user = entitlement.active() if entitlement else False
+    last_played = entitlement is not None and entitlement.last_played_id == meditation_id
+
+    if catalog.items[meditation_id]["is_premium"] and not is_premium_user:
         raise HTTPException(status_code=403, detail="Premium meditation. Upgrade required.")
 
-    return MeditationSchema(**meditation.__dict__, last_played=last_played)
+    if last_played:
+        return catalog_response(request, meditation.played_body, meditation.played_etag)
+    return catalog_response(request, meditation.body, meditation.etag)
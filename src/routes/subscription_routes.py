@@ -1,9 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import String, case, func, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta, timezone
-from src.models.models import User, ActivationCode, get_db
+from src.models.models import User, ActivationCode, as_utc, get_db
+from src.services.code_cache import activation_code_cache
+from src.services.entitlements import entitlement_cache
+from src.services.activation_codes import (
+    CODE_BATCH_CHUNK_SIZE, CODE_BATCH_MAX_COUNT, CODE_FORMATS,
+    code_hash_pool, format_codes, format_header, generate_codes, hash_code,
+)
 from pydantic import BaseModel
-import hashlib
 import uuid
 from typing import List, Optional
 
@@ -32,14 +41,9 @@ class ActivationCodeHistoryResponse(BaseModel):
     is_used: bool
 
 
-def hash_code(code: str) -> str:
-    return hashlib.sha256(code.encode()).hexdigest()
-
-
 @router.get("/check", response_model=ActivationCodeCheckResponse)
-def check_activation_code(code: str, db: Session = Depends(get_db)):
-    hashed = hash_code(code)
-    entry = db.query(ActivationCode).filter(ActivationCode.code == hashed).first()
+async def check_activation_code(code: str, db: AsyncSession = Depends(get_db)):
+    entry = await activation_code_cache.lookup(db, hash_code(code))
     if not entry:
         raise HTTPException(status_code=404, detail="Code not found")
     if entry.is_used:
@@ -47,61 +51,123 @@ def check_activation_code(code: str, db: Session = Depends(get_db)):
     return {"status": "valid", "expires_in": f"{entry.duration_days} days"}
 
 
+def grant_premium(db: AsyncSession, user_id: str, now: datetime, days: int):
+    """Create the user or extend their premium period, in one upsert.
+
+    A period that is still running is extended by ``days``; otherwise the new
+    one starts at ``now``. Returns the user row.
+    """
+    dialect = db.get_bind().dialect.name
+    insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+    current = User.__table__.c.premium_expires_at
+    if dialect == "postgresql":
+        extended = current + timedelta(days=days)
+    else:
+        # Timestamps are stored as "YYYY-MM-DD HH:MM:SS.ffffff"; shift the
+        # date and time and carry the fraction over unchanged.
+        extended = func.strftime("%Y-%m-%d %H:%M:%S", current, f"+{days} days", type_=String) + func.substr(current, 20)
+    stmt = insert(User).values(id=user_id, name="New User", is_premium=True, premium_expires_at=now + timedelta(days=days))
+    return (
+        stmt.on_conflict_do_update(
+            index_elements=[User.id],
+            set_={
+                "is_premium": True,
+                "premium_expires_at": case((current > now, extended), else_=stmt.excluded.premium_expires_at),
+            },
+        )
+        .returning(User)
+        .execution_options(populate_existing=True)
+    )
+
+
 @router.post("/activate", response_model=ActivationCodeActivateResponse)
-def activate_subscription(request: ActivationCodeActivateRequest, db: Session = Depends(get_db)):
+async def activate_subscription(request: ActivationCodeActivateRequest, db: AsyncSession = Depends(get_db)):
     hashed = hash_code(request.code)
-    entry = db.query(ActivationCode).filter(ActivationCode.code == hashed).first()
-    if not entry:
-        raise HTTPException(status_code=404, detail="Code not found")
-    if entry.is_used:
+    # Codes known to be spent are turned away before anything is written, so
+    # they never wait for or hold the SQLite writer lock. A cached absence is
+    # not trusted: another process may have created the code since.
+    entry = activation_code_cache.cached(hashed)
+    if entry is not None and entry.is_used:
         raise HTTPException(status_code=400, detail="Code already used")
-
-    user = db.query(User).filter(User.id == request.user_id).first()
-    if not user:
-        user = User(id=request.user_id, name="New User")
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-
     now_utc = datetime.now(timezone.utc)
-    current_exp = user.premium_expires_at or now_utc
-    if current_exp.tzinfo is None:
-        current_exp = current_exp.replace(tzinfo=timezone.utc)
-    if current_exp < now_utc:
-        current_exp = now_utc
 
-    entry.is_used = True
-    entry.activated_at = now_utc
-    entry.user_id = user.id
+    # Claiming the code is a single conditional UPDATE, so of any number of
+    # concurrent redemptions exactly one sees a row come back.
+    duration_days = await db.scalar(
+        update(ActivationCode)
+        .where(ActivationCode.code == hashed, ActivationCode.is_used.is_(False))
+        .values(is_used=True, activated_at=now_utc, user_id=request.user_id)
+        .returning(ActivationCode.duration_days)
+    )
+    if duration_days is None:
+        # Either no such code exists or another request claimed it first.
+        if await activation_code_cache.load(db, hashed) is None:
+            raise HTTPException(status_code=404, detail="Code not found")
+        raise HTTPException(status_code=400, detail="Code already used")
 
-    user.premium_expires_at = current_exp + timedelta(days=entry.duration_days)
-    user.is_premium = True
+    # The expiry is computed by the upsert itself, so concurrent redemptions
+    # by one user stack without a separate locking read.
+    user = await db.scalar(grant_premium(db, request.user_id, now_utc, duration_days))
+    until = as_utc(user.premium_expires_at)
 
-    db.commit()
-    db.refresh(entry)
-    db.refresh(user)
+    await db.commit()
+    activation_code_cache.used(hashed)
+    entitlement_cache.invalidate(request.user_id)
 
-    return {"status": "activated", "until": user.premium_expires_at}
+    return {"status": "activated", "until": until}
 
 
 @router.post("/generate_code", status_code=status.HTTP_201_CREATED, response_model=dict)
-def generate_activation_code(duration_days: int = 30, db: Session = Depends(get_db)):
+async def generate_activation_code(duration_days: int = 30, db: AsyncSession = Depends(get_db)):
     raw_code = str(uuid.uuid4())
     hashed = hash_code(raw_code)
     new_code = ActivationCode(code=hashed, duration_days=duration_days, is_used=False)
     db.add(new_code)
-    db.commit()
-    db.refresh(new_code)
+    await db.commit()
+    await db.refresh(new_code)
+    activation_code_cache.created([hashed])
     return {"raw_code": raw_code, "hashed_code": hashed, "duration_days": duration_days}
 
 
+@router.post("/generate_codes", status_code=status.HTTP_201_CREATED)
+async def generate_activation_codes(
+    count: int = Query(..., ge=1, le=CODE_BATCH_MAX_COUNT),
+    duration_days: int = 30,
+    fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    db: AsyncSession = Depends(get_db),
+):
+    """Create ``count`` codes and stream the raw codes back as CSV or NDJSON.
+
+    Codes are inserted in chunks and each chunk is sent only after it has been
+    committed, so every streamed code is redeemable.
+    """
+    executor = code_hash_pool() if count > CODE_BATCH_CHUNK_SIZE else None
+
+    async def body():
+        yield format_header(fmt)
+        async for chunk in generate_codes(db, count, duration_days, executor=executor):
+            yield format_codes(chunk, duration_days, fmt)
+
+    return StreamingResponse(
+        body(),
+        status_code=status.HTTP_201_CREATED,
+        media_type=CODE_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="activation_codes.{fmt}"'},
+    )
+
+
 @router.get("/history", response_model=List[ActivationCodeHistoryResponse])
-def get_subscription_history(user_id: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
+async def get_subscription_history(user_id: str, db: AsyncSession = Depends(get_db)):
+    rows = (await db.execute(
+        select(User.id, ActivationCode)
+        .outerjoin(ActivationCode, ActivationCode.user_id == User.id)
+        .where(User.id == user_id)
+        .order_by(ActivationCode.activated_at.desc())
+    )).all()
+    if not rows:
         raise HTTPException(status_code=404, detail="User not found")
 
-    codes = db.query(ActivationCode).filter(ActivationCode.user_id == user_id).order_by(ActivationCode.activated_at.desc()).all()
+    codes = [code for _, code in rows if code is not None]
     if not codes:
         raise HTTPException(status_code=404, detail="No activation history")
 
@@ -1,9 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from pydantic import BaseModel, ConfigDict
-from typing import List, Optional
-from datetime import datetime
-from src.models.models import User, Meditation, ActivationCode, get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing import List, Literal, Optional
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+import base64
+import os
+import orjson
+from src.models.models import PLAY_EVENT_KINDS, User, ActivationCode, PlayEvent, as_utc, get_db
+from src.services.catalog import catalog_cache
+from src.services.entitlements import entitlement_cache
+from src.services.play_events import START, PlayEventsFull, play_events
+
+load_dotenv()
+
+USERS_PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", "100"))
+USERS_MAX_PAGE_SIZE = 1000
+USERS_EXPORT_BATCH_SIZE = int(os.getenv("USERS_EXPORT_BATCH_SIZE", "1000"))
+PLAYS_MAX_BATCH = 1000
+PLAYS_PAGE_SIZE = 50
+PLAYS_MAX_PAGE_SIZE = 500
 
 router = APIRouter(prefix="/api/users", tags=["users"])
 
@@ -45,14 +64,109 @@ class UserResponse(BaseModel):
     last_played_meditation_id: Optional[int]
 
 
+class PlayEventIn(BaseModel):
+    meditation_id: int
+    kind: Literal["start", "progress", "complete"]
+    # Bounded by the 32-bit column, so every accepted event can be written.
+    position_seconds: int = Field(0, ge=0, le=2**31 - 1)
+    at: Optional[datetime] = None
+
+    @field_validator("at")
+    @classmethod
+    def at_in_utc(cls, value: Optional[datetime]) -> Optional[datetime]:
+        if value is None:
+            return value
+        try:
+            return as_utc(value).astimezone(timezone.utc)
+        except OverflowError:
+            raise ValueError("timestamp out of range")
+
+
+class PlayEventBatch(BaseModel):
+    events: List[PlayEventIn] = Field(min_length=1, max_length=PLAYS_MAX_BATCH)
+
+
+class PlayEventOut(BaseModel):
+    id: int
+    meditation_id: int
+    kind: str
+    position_seconds: int
+    at: datetime
+
+
+USER_FIELDS = tuple(UserSchema.model_fields)
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return list(USER_FIELDS)
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in USER_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    # The id is the pagination key, so it is always returned.
+    return ["id"] + [f for f in dict.fromkeys(requested) if f != "id"]
+
+
+def encode_cursor(user_id: str) -> str:
+    return base64.urlsafe_b64encode(user_id.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        return base64.urlsafe_b64decode(cursor.encode()).decode()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def users_after(columns: List[str], after: Optional[str] = None):
+    query = select(*(getattr(User, c) for c in columns)).order_by(User.id)
+    if after is not None:
+        query = query.where(User.id > after)
+    return query
+
+
 @router.get("/", response_model=List[UserSchema])
-def get_users(db: Session = Depends(get_db)):
-    return db.query(User).all()
+async def get_users(
+    limit: Optional[int] = Query(None, ge=1, le=USERS_MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    fmt: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+    db: AsyncSession = Depends(get_db),
+):
+    """List users ordered by id, reading only the requested ``fields``.
+
+    JSON returns one page of ``limit`` users; pass the ``X-Next-Cursor`` header
+    as ``after`` to fetch the next one. NDJSON streams every user after the
+    cursor (or ``limit`` of them) in constant memory, for exports.
+    """
+    columns = parse_fields(fields)
+    cursor = decode_cursor(after) if after else None
+
+    if fmt == "ndjson":
+        query = users_after(columns, cursor).execution_options(yield_per=USERS_EXPORT_BATCH_SIZE)
+        if limit:
+            query = query.limit(limit)
+
+        async def body():
+            result = await db.stream(query)
+            async for batch in result.partitions():
+                yield b"".join(orjson.dumps(row._asdict()) + b"\n" for row in batch)
+
+        return StreamingResponse(body(), media_type="application/x-ndjson")
+
+    limit = limit or USERS_PAGE_SIZE
+    rows = (await db.execute(users_after(columns, cursor).limit(limit + 1))).all()
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1].id)
+    return Response(orjson.dumps([row._asdict() for row in rows]), media_type="application/json", headers=headers)
 
 
 @router.get("/{user_id}", response_model=UserResponse)
-def get_user(user_id: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def get_user(user_id: str, db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -66,67 +180,137 @@ def get_user(user_id: str, db: Session = Depends(get_db)):
 
 
 @router.post("/", response_model=UserSchema)
-def create_user(user: UserCreate, db: Session = Depends(get_db)):
-    existing = db.query(User).filter(User.id == user.id).first()
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    existing = await db.scalar(select(User).where(User.id == user.id))
     if existing:
         raise HTTPException(status_code=400, detail="User already exists")
 
     new_user = User(id=user.id, name=user.name)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    entitlement_cache.invalidate(user.id)
+    await db.refresh(new_user)
     return new_user
 
 
 @router.put("/{user_id}", response_model=UserSchema)
-def update_user(user_id: str, user_update: UserUpdate, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def update_user(user_id: str, user_update: UserUpdate, db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     user.name = user_update.name
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return user
 
 
 @router.delete("/{user_id}", status_code=204)
-def delete_user(user_id: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def delete_user(user_id: str, db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    db.delete(user)
-    db.commit()
+    await db.delete(user)
+    await db.commit()
+    entitlement_cache.invalidate(user_id)
     return None
 
 
 @router.post("/{user_id}/last_played/{meditation_id}")
-def update_last_played(user_id: str, meditation_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    meditation = db.query(Meditation).filter(Meditation.id == meditation_id).first()
-    if not meditation:
+async def update_last_played(user_id: str, meditation_id: int, db: AsyncSession = Depends(get_db)):
+    """Mark a meditation as played right away; prefer ``POST /{user_id}/plays``.
+
+    The meditation is checked against the catalog snapshot and the user by the
+    UPDATE's row count, so this is a single round trip. A ``start`` event is
+    buffered as well, so these plays show up in the listening history.
+    """
+    catalog = await catalog_cache.get(db)
+    if meditation_id not in catalog.items:
+        if await entitlement_cache.resolve(db, user_id) is None:
+            raise HTTPException(status_code=404, detail="User not found")
         raise HTTPException(status_code=404, detail="Meditation not found")
 
-    user.last_played_meditation_id = meditation_id
-    db.commit()
-    db.refresh(user)
+    result = await db.execute(update(User).where(User.id == user_id).values(last_played_meditation_id=meditation_id))
+    if result.rowcount == 0:
+        raise HTTPException(status_code=404, detail="User not found")
+    await db.commit()
+    entitlement_cache.invalidate(user_id)
+    try:
+        play_events.add([(user_id, meditation_id, START, 0, datetime.now(timezone.utc))])
+    except PlayEventsFull:
+        pass  # last_played is already stored; only the history entry is dropped
     return {"message": "Last played meditation updated", "last_played_meditation_id": meditation_id}
 
 
+@router.post("/{user_id}/plays", status_code=202)
+async def record_plays(user_id: str, batch: PlayEventBatch, db: AsyncSession = Depends(get_db)):
+    """Queue a batch of playback events for the user.
+
+    Events are written in bulk by a background task within
+    ``PLAY_FLUSH_INTERVAL_MS``, which also moves ``last_played_meditation_id``
+    to the meditation of the newest one. Both checks below are normally
+    answered from memory, so accepting a batch costs no round trip.
+    """
+    if await entitlement_cache.resolve(db, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    catalog = await catalog_cache.get(db)
+    unknown = sorted({e.meditation_id for e in batch.events if e.meditation_id not in catalog.items})
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown meditations: {', '.join(map(str, unknown))}")
+
+    now = datetime.now(timezone.utc)
+    try:
+        play_events.add([
+            (user_id, e.meditation_id, PLAY_EVENT_KINDS.index(e.kind), e.position_seconds, e.at or now)
+            for e in batch.events
+        ])
+    except PlayEventsFull:
+        raise HTTPException(status_code=503, detail="Play event queue is full", headers={"Retry-After": "1"})
+    return {"accepted": len(batch.events)}
+
+
+@router.get("/{user_id}/plays", response_model=List[PlayEventOut])
+async def get_plays(
+    user_id: str,
+    limit: int = Query(PLAYS_PAGE_SIZE, ge=1, le=PLAYS_MAX_PAGE_SIZE),
+    before: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Listening history, newest first. Pass ``X-Next-Cursor`` as ``before`` for older events."""
+    query = select(
+        PlayEvent.id, PlayEvent.meditation_id, PlayEvent.kind, PlayEvent.position_seconds, PlayEvent.created_at
+    ).where(PlayEvent.user_id == user_id)
+    if before is not None:
+        query = query.where(PlayEvent.id < before)
+    rows = (await db.execute(query.order_by(PlayEvent.id.desc()).limit(limit + 1))).all()
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = str(rows[-1].id)
+    body = orjson.dumps([
+        {
+            "id": row.id,
+            "meditation_id": row.meditation_id,
+            "kind": PLAY_EVENT_KINDS[row.kind],
+            "position_seconds": row.position_seconds,
+            "at": row.created_at,
+        }
+        for row in rows
+    ])
+    return Response(body, media_type="application/json", headers=headers)
+
+
 @router.get("/{user_id}/last_played")
-def get_last_played(user_id: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def get_last_played(user_id: str, db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(
+        select(User).options(joinedload(User.last_played_meditation)).where(User.id == user_id)
+    )
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    if not user.last_played_meditation_id:
-        return None
-
-    meditation = db.query(Meditation).filter(Meditation.id == user.last_played_meditation_id).first()
+    meditation = user.last_played_meditation
     if not meditation:
         return None
 
@@ -142,18 +326,21 @@ def get_last_played(user_id: str, db: Session = Depends(get_db)):
 
 
 @router.get("/{user_id}/subscriptions", response_model=List[ActivationInfo])
-def get_user_subscriptions(user_id: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
+async def get_user_subscriptions(user_id: str, db: AsyncSession = Depends(get_db)):
+    # One round trip: the outer join yields a single (id, None) row for a
+    # user without codes and no rows at all for an unknown user.
+    rows = (
+        await db.execute(
+            select(User.id, ActivationCode)
+            .outerjoin(ActivationCode, ActivationCode.user_id == User.id)
+            .where(User.id == user_id)
+            .order_by(ActivationCode.activated_at.desc())
+        )
+    ).all()
+    if not rows:
         raise HTTPException(status_code=404, detail="User not found")
 
-    codes = (
-        db.query(ActivationCode)
-        .filter(ActivationCode.user_id == user_id)
-        .order_by(ActivationCode.activated_at.desc())
-        .all()
-    )
-
+    codes = [code for _, code in rows if code is not None]
     if not codes:
         raise HTTPException(status_code=404, detail="No activation history")
 
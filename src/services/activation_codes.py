@@ -0,0 +1,146 @@
+"""Activation code hashing and bulk generation.
+
+Also usable offline, writing straight to ``DATABASE_URL``::
+
+    python -m src.services.activation_codes --count 1000000 --days 30 --format csv --output codes.csv
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import uuid
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import AsyncIterator, List, Optional, Tuple
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.models.models import ActivationCode, SessionLocal, create_db_tables, engine
+from src.services.code_cache import activation_code_cache
+
+CODE_BATCH_CHUNK_SIZE = int(os.getenv("CODE_BATCH_CHUNK_SIZE", "5000"))
+CODE_BATCH_MAX_COUNT = int(os.getenv("CODE_BATCH_MAX_COUNT", "1000000"))
+CODE_HASH_WORKERS = int(os.getenv("CODE_HASH_WORKERS", str(os.cpu_count() or 1)))
+
+CODE_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+_hash_pool: Optional[ProcessPoolExecutor] = None
+
+
+def hash_code(code: str) -> str:
+    return hashlib.sha256(code.encode()).hexdigest()
+
+
+def generate_chunk(size: int) -> List[Tuple[str, str]]:
+    """Create ``size`` raw codes with their hashes; runs in worker processes."""
+    return [(raw, hash_code(raw)) for raw in (str(uuid.uuid4()) for _ in range(size))]
+
+
+def new_hash_pool() -> ProcessPoolExecutor:
+    # Forking a process that runs an event loop and driver threads is unsafe.
+    return ProcessPoolExecutor(CODE_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+def code_hash_pool() -> ProcessPoolExecutor:
+    """Shared worker pool for the API, created on first use."""
+    global _hash_pool
+    if _hash_pool is None:
+        _hash_pool = new_hash_pool()
+    return _hash_pool
+
+
+def shutdown_code_hash_pool():
+    global _hash_pool
+    if _hash_pool is not None:
+        _hash_pool.shutdown(cancel_futures=True)
+        _hash_pool = None
+
+
+async def generate_codes(
+    db: AsyncSession,
+    count: int,
+    duration_days: int,
+    chunk_size: int = CODE_BATCH_CHUNK_SIZE,
+    executor: Optional[Executor] = None,
+    prefetch: int = CODE_HASH_WORKERS,
+) -> AsyncIterator[List[Tuple[str, str]]]:
+    """Insert ``count`` new codes in chunks, yielding each chunk once committed.
+
+    With an ``executor`` up to ``prefetch`` chunks are hashed ahead in parallel
+    while the previous one is written; without one chunks are hashed inline.
+    """
+    loop = asyncio.get_running_loop()
+    sizes = deque(min(chunk_size, count - start) for start in range(0, count, chunk_size))
+    pending = deque()
+
+    def submit():
+        size = sizes.popleft()
+        if executor is None:
+            future = loop.create_future()
+            future.set_result(generate_chunk(size))
+            return future
+        return loop.run_in_executor(executor, generate_chunk, size)
+
+    while sizes and len(pending) < max(prefetch, 1):
+        pending.append(submit())
+
+    while pending:
+        chunk = await pending.popleft()
+        if sizes:
+            pending.append(submit())
+        await db.execute(
+            insert(ActivationCode),
+            [{"code": hashed, "duration_days": duration_days, "is_used": False} for _, hashed in chunk],
+        )
+        await db.commit()
+        activation_code_cache.created(hashed for _, hashed in chunk)
+        yield chunk
+
+
+def format_codes(chunk: List[Tuple[str, str]], duration_days: int, fmt: str) -> str:
+    if fmt == "ndjson":
+        return "".join(
+            json.dumps({"raw_code": raw, "hashed_code": hashed, "duration_days": duration_days}) + "\n"
+            for raw, hashed in chunk
+        )
+    return "".join(f"{raw},{hashed},{duration_days}\n" for raw, hashed in chunk)
+
+
+def format_header(fmt: str) -> str:
+    return "raw_code,hashed_code,duration_days\n" if fmt == "csv" else ""
+
+
+async def _write_codes(count: int, duration_days: int, fmt: str, output) -> int:
+    await create_db_tables()
+    written = 0
+    output.write(format_header(fmt))
+    with new_hash_pool() as executor:
+        async with SessionLocal() as db:
+            async for chunk in generate_codes(db, count, duration_days, executor=executor):
+                output.write(format_codes(chunk, duration_days, fmt))
+                written += len(chunk)
+    await engine.dispose()
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate activation codes in bulk.")
+    parser.add_argument("--count", type=int, required=True)
+    parser.add_argument("--days", type=int, default=30, help="subscription days granted per code")
+    parser.add_argument("--format", choices=sorted(CODE_FORMATS), default="csv")
+    parser.add_argument("--output", help="file for the raw codes, stdout by default")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        written = asyncio.run(_write_codes(args.count, args.days, args.format, output))
+    finally:
+        if args.output:
+            output.close()
+    print(f"Generated {written} codes", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
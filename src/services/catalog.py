@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import orjson
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from src.models.models import Meditation
+from src.services.recommendations import CatalogFeatures
+from src.services.search import SearchIndex
+
+MEDITATION_FIELDS = ("id", "title", "description", "duration_seconds", "audio_url", "is_premium", "category")
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+@dataclass
+class EncodedItem:
+    body: bytes
+    etag: str
+    # Same row with ``last_played`` set to true, swapped in per request.
+    played_body: bytes
+    played_etag: str
+
+
+@dataclass
+class EncodedListing:
+    ids: List[int]
+    body: bytes
+    etag: str
+
+
+@dataclass
+class CatalogSnapshot:
+    version: int
+    items: Dict[int, dict] = field(default_factory=dict)
+    # (category or None, include_premium) -> ordered rows, ``last_played`` preset to False
+    lists: Dict[Tuple[Optional[str], bool], List[dict]] = field(default_factory=dict)
+    encoded_items: Dict[int, EncodedItem] = field(default_factory=dict)
+    encoded_lists: Dict[Tuple[Optional[str], bool], EncodedListing] = field(default_factory=dict)
+    search: SearchIndex = field(default_factory=lambda: SearchIndex([]))
+    features: CatalogFeatures = field(default_factory=lambda: CatalogFeatures([]))
+
+    def listing(self, category: Optional[str], include_premium: bool) -> List[dict]:
+        return self.lists.get((category, include_premium), [])
+
+    def encoded_listing(self, category: Optional[str], include_premium: bool, last_played_id: Optional[int] = None) -> Tuple[bytes, str]:
+        """Return the JSON body and strong ETag for one list variant."""
+        listing = self.encoded_lists.get((category, include_premium))
+        if listing is None:
+            listing = EMPTY_LISTING
+        if last_played_id is None or last_played_id not in listing.ids:
+            return listing.body, listing.etag
+
+        return self.encoded_rows(listing.ids, last_played_id), f'{listing.etag[:-1]}.{last_played_id}"'
+
+    def encoded_rows(self, ids: List[int], last_played_id: Optional[int] = None) -> bytes:
+        return b"[" + b",".join(
+            self.encoded_items[med_id].played_body if med_id == last_played_id else self.encoded_items[med_id].body
+            for med_id in ids
+        ) + b"]"
+
+
+EMPTY_LISTING = EncodedListing(ids=[], body=b"[]", etag=make_etag(b"[]"))
+
+
+def serialize_meditation(med: Meditation) -> dict:
+    data = {name: getattr(med, name) for name in MEDITATION_FIELDS}
+    data["last_played"] = False
+    return data
+
+
+def encode_item(row: dict) -> EncodedItem:
+    body = orjson.dumps(row)
+    played_body = orjson.dumps(dict(row, last_played=True))
+    return EncodedItem(body=body, etag=make_etag(body), played_body=played_body, played_etag=make_etag(played_body))
+
+
+def build_snapshot(version: int, meditations: List[Meditation]) -> CatalogSnapshot:
+    snapshot = CatalogSnapshot(version=version)
+    for med in meditations:
+        row = serialize_meditation(med)
+        snapshot.items[row["id"]] = row
+        snapshot.encoded_items[row["id"]] = encode_item(row)
+        tiers = (True,) if row["is_premium"] else (True, False)
+        for include_premium in tiers:
+            snapshot.lists.setdefault((None, include_premium), []).append(row)
+            snapshot.lists.setdefault((row["category"], include_premium), []).append(row)
+
+    for key, rows in snapshot.lists.items():
+        ids = [row["id"] for row in rows]
+        body = b"[" + b",".join(snapshot.encoded_items[med_id].body for med_id in ids) + b"]"
+        snapshot.encoded_lists[key] = EncodedListing(ids=ids, body=body, etag=make_etag(body))
+    snapshot.search = SearchIndex(snapshot.items.values())
+    snapshot.features = CatalogFeatures(snapshot.items.values())
+    return snapshot
+
+
+class CatalogCache:
+    """Process-local snapshot of the meditation catalog.
+
+    The snapshot is rebuilt lazily on the first read after ``invalidate()``.
+    Concurrent misses share one load, and the build runs in a worker thread
+    so it does not stall the event loop. A load that races with an
+    invalidation is discarded rather than installed, so a stale catalog never
+    outlives the write that replaced it.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._snapshot: Optional[CatalogSnapshot] = None
+        # (version, future) of the load in progress, awaited by concurrent misses.
+        self._loading: Optional[Tuple[int, asyncio.Future]] = None
+
+    def invalidate(self):
+        self.version += 1
+        self._snapshot = None
+
+    async def get(self, db: AsyncSession) -> CatalogSnapshot:
+        while True:
+            snapshot = self._snapshot
+            if snapshot is not None:
+                self.hits += 1
+                return snapshot
+
+            loading = self._loading
+            if loading is None or loading[0] != self.version or loading[1].get_loop() is not asyncio.get_running_loop():
+                return await self._load(db)
+            # A failed or cancelled load leaves the next attempt to this caller.
+            await asyncio.wait([loading[1]])
+            if not loading[1].cancelled():
+                self.hits += 1
+                return loading[1].result()
+
+    async def _load(self, db: AsyncSession) -> CatalogSnapshot:
+        self.misses += 1
+        version = self.version
+        loading = self._loading = (version, asyncio.get_running_loop().create_future())
+        try:
+            meditations = (await db.scalars(select(Meditation).order_by(Meditation.id))).all()
+            snapshot = await asyncio.to_thread(build_snapshot, version, meditations)
+        except BaseException:
+            loading[1].cancel()
+            raise
+        finally:
+            if self._loading is loading:
+                self._loading = None
+        loading[1].set_result(snapshot)
+        if version == self.version:
+            self._snapshot = snapshot
+        return snapshot
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._snapshot.items) if self._snapshot else 0}
+
+
+catalog_cache = CatalogCache()
+
+
+def _touches_catalog(session: Session) -> bool:
+    return any(isinstance(obj, Meditation) for obj in (*session.new, *session.dirty, *session.deleted))
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_catalog_dirty(session, flush_context):
+    if _touches_catalog(session):
+        session.info["catalog_dirty"] = True
+        catalog_cache.invalidate()
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_soft_rollback")
+def _invalidate_catalog(session, *args):
+    if session.info.pop("catalog_dirty", False):
+        catalog_cache.invalidate()
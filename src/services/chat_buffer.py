@@ -0,0 +1,58 @@
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional
+from sqlalchemy import insert
+from src.models.models import ChatMessage, SessionLocal
+from src.services.write_behind import WriteBehindBuffer
+
+CHAT_FLUSH_INTERVAL_MS = int(os.getenv("CHAT_FLUSH_INTERVAL_MS", "50"))
+CHAT_FLUSH_MAX_BATCH = int(os.getenv("CHAT_FLUSH_MAX_BATCH", "500"))
+
+
+def message_sort_key(message: ChatMessage) -> tuple:
+    # Rows read back from SQLite are naive UTC, freshly buffered ones are aware.
+    return message.created_at.replace(tzinfo=None), message.id
+
+
+class ChatWriteBuffer(WriteBehindBuffer):
+    """Write-behind buffer for chat messages.
+
+    Messages from concurrent requests are collected in memory and written with
+    one bulk INSERT every ``flush_interval`` seconds, or as soon as
+    ``max_batch`` rows are waiting. Rows stay visible through ``unflushed()``
+    until their batch is committed, so readers can merge them into what they
+    load from the database.
+    """
+
+    rows_name = "chat messages"
+
+    def __init__(self, session_factory=SessionLocal, flush_interval: float = CHAT_FLUSH_INTERVAL_MS / 1000, max_batch: int = CHAT_FLUSH_MAX_BATCH):
+        super().__init__(session_factory, flush_interval, max_batch)
+        self._pending: List[ChatMessage] = []
+        self._flushing: List[ChatMessage] = []
+
+    def add(self, user_id: str, content: str, is_user: bool, created_at: Optional[datetime] = None) -> ChatMessage:
+        message = ChatMessage(
+            id=str(uuid.uuid4()),
+            user_id=user_id,
+            content=content,
+            is_user=is_user,
+            created_at=created_at or datetime.now(timezone.utc),
+        )
+        self._append([message])
+        return message
+
+    def unflushed(self, user_id: str) -> List[ChatMessage]:
+        return [m for m in (*self._flushing, *self._pending) if m.user_id == user_id]
+
+    async def _write(self, batch: List[ChatMessage]):
+        async with self.session_factory() as db:
+            await db.execute(insert(ChatMessage), [
+                {"id": m.id, "user_id": m.user_id, "content": m.content, "is_user": m.is_user, "created_at": m.created_at}
+                for m in batch
+            ])
+            await db.commit()
+
+
+chat_buffer = ChatWriteBuffer()
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+from src.models.models import SessionLocal
+from src.services.metrics import Histogram
+
+CHAT_JOB_WORKERS = int(os.getenv("CHAT_JOB_WORKERS", "20"))
+CHAT_JOB_MAX_QUEUED = int(os.getenv("CHAT_JOB_MAX_QUEUED", "1000"))
+CHAT_JOB_RESULT_TTL_SECONDS = float(os.getenv("CHAT_JOB_RESULT_TTL_SECONDS", "600"))
+
+logger = logging.getLogger(__name__)
+
+
+class ChatQueueFull(Exception):
+    pass
+
+
+@dataclass
+class ChatJob:
+    user_id: str
+    message: str
+    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    status: str = "queued"
+    response: Optional[str] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    finished_at: Optional[float] = None
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+class ChatJobQueue:
+    """Bounded queue of chat turns answered by a fixed pool of workers.
+
+    Each user's turns run one at a time in submission order, so a reply is
+    always generated with the previous reply already in its context; turns of
+    different users run concurrently on up to ``workers`` tasks. ``submit()``
+    raises ``ChatQueueFull`` once ``max_queued`` turns are waiting, which the
+    route turns into a 503 instead of letting the backlog grow without bound.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        workers: int = CHAT_JOB_WORKERS,
+        max_queued: int = CHAT_JOB_MAX_QUEUED,
+        result_ttl: float = CHAT_JOB_RESULT_TTL_SECONDS,
+    ):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.handler: Optional[Callable[..., Awaitable[str]]] = None
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait = Histogram()
+        self._jobs: Dict[str, ChatJob] = {}
+        self._users: Dict[str, Deque[ChatJob]] = {}
+        self._ready: "asyncio.Queue[str]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+
+    def submit(self, user_id: str, message: str) -> ChatJob:
+        if self.queued >= self.max_queued:
+            self.rejected += 1
+            raise ChatQueueFull()
+        self._expire()
+
+        job = ChatJob(user_id=user_id, message=message)
+        self._jobs[job.id] = job
+        self.queued += 1
+        turns = self._users.get(user_id)
+        if turns is None:
+            self._users[user_id] = deque([job])
+            self._ready.put_nowait(user_id)
+        else:
+            turns.append(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[ChatJob]:
+        return self._jobs.get(job_id)
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.result_ttl
+        expired = []
+        # Jobs finish roughly in insertion order, so stop at the first live one.
+        for job_id, job in self._jobs.items():
+            if job.finished_at is None or job.finished_at > cutoff:
+                break
+            expired.append(job_id)
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    async def _run(self):
+        while True:
+            user_id = await self._ready.get()
+            turns = self._users[user_id]
+            job = turns[0]
+            self.queued -= 1
+            self.running += 1
+            job.status = "running"
+            self.wait.observe(time.monotonic() - job.enqueued_at)
+            try:
+                job.response = await self.handler(self.session_factory, job.user_id, job.message)
+            except Exception:
+                logger.exception("Chat job %s failed", job.id)
+                job.response = None
+            finally:
+                self.running -= 1
+                self.completed += 1
+                job.status = "done" if job.response is not None else "failed"
+                job.finished_at = time.monotonic()
+                job.done.set()
+                turns.popleft()
+                if turns:
+                    # Back of the line, so one chatty user cannot starve the rest.
+                    self._ready.put_nowait(user_id)
+                else:
+                    del self._users[user_id]
+
+    async def start(self, handler: Callable[..., Awaitable[str]]):
+        self.handler = handler
+        self._ready = asyncio.Queue()
+        self._users.clear()
+        self.queued = 0
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "workers": self.workers,
+        }
+
+
+chat_jobs = ChatJobQueue()
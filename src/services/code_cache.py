@@ -0,0 +1,122 @@
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.models.models import ActivationCode
+
+CODE_CACHE_MAX_ENTRIES = int(os.getenv("CODE_CACHE_MAX_ENTRIES", "100000"))
+CODE_CACHE_MAX_MISSING = int(os.getenv("CODE_CACHE_MAX_MISSING", "100000"))
+CODE_CACHE_TTL_SECONDS = float(os.getenv("CODE_CACHE_TTL_SECONDS", "60"))
+
+
+@dataclass(frozen=True)
+class CodeStatus:
+    is_used: bool
+    duration_days: Optional[int]
+
+
+class ActivationCodeCache:
+    """Status of recently checked activation codes, keyed by code hash.
+
+    Known codes and codes that do not exist are kept in two separately bounded
+    LRUs, so a flood of invalid guesses cannot evict real codes. Both expire
+    after ``ttl`` seconds to pick up writes made by other processes; writers in
+    this process call ``created()`` and ``used()`` so their changes are visible
+    at once.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CODE_CACHE_MAX_ENTRIES,
+        max_missing: int = CODE_CACHE_MAX_MISSING,
+        ttl: float = CODE_CACHE_TTL_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.max_missing = max_missing
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._known: "OrderedDict[str, tuple[float, CodeStatus]]" = OrderedDict()
+        self._missing: "OrderedDict[str, float]" = OrderedDict()
+
+    async def lookup(self, db: AsyncSession, hashed: str) -> Optional[CodeStatus]:
+        """Return the code's status, or None when no such code exists."""
+        status = self.cached(hashed)
+        if status is not None:
+            return status
+        expires = self._missing.get(hashed)
+        if expires is not None and expires > self.clock():
+            self._missing.move_to_end(hashed)
+            self.negative_hits += 1
+            return None
+        return await self.load(db, hashed)
+
+    def cached(self, hashed: str) -> Optional[CodeStatus]:
+        """Return the code's status if it is known, without any query.
+
+        None means nothing is known; a cached absence is not reported, since
+        the code may have been created by another process since.
+        """
+        entry = self._known.get(hashed)
+        if entry is None or entry[0] <= self.clock():
+            return None
+        self._known.move_to_end(hashed)
+        self.hits += 1
+        return entry[1]
+
+    async def load(self, db: AsyncSession, hashed: str) -> Optional[CodeStatus]:
+        """Read the code's status from the database and cache it."""
+        self.misses += 1
+        row = (await db.execute(
+            select(ActivationCode.is_used, ActivationCode.duration_days).where(ActivationCode.code == hashed)
+        )).first()
+        now = self.clock()
+        if row is None:
+            self._known.pop(hashed, None)
+            self._put(self._missing, hashed, now + self.ttl, self.max_missing)
+            return None
+        status = CodeStatus(bool(row[0]), row[1])
+        self._missing.pop(hashed, None)
+        self._put(self._known, hashed, (now + self.ttl, status), self.max_entries)
+        return status
+
+    @staticmethod
+    def _put(entries: OrderedDict, key: str, value, limit: int):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > limit:
+            entries.popitem(last=False)
+
+    def created(self, hashes: Iterable[str]):
+        """Forget negative results for codes that have just been inserted."""
+        for hashed in hashes:
+            self._missing.pop(hashed, None)
+
+    def used(self, hashed: str):
+        """Record a redemption; a used code never becomes valid again."""
+        entry = self._known.get(hashed)
+        duration_days = entry[1].duration_days if entry is not None else None
+        self._missing.pop(hashed, None)
+        self._put(self._known, hashed, (self.clock() + self.ttl, CodeStatus(True, duration_days)), self.max_entries)
+
+    def clear(self):
+        self._known.clear()
+        self._missing.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "size": len(self._known),
+            "missing_size": len(self._missing),
+        }
+
+
+activation_code_cache = ActivationCodeCache()
@@ -0,0 +1,85 @@
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+CHAT_CACHE_ENABLED = os.getenv("CHAT_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "10000"))
+CHAT_CACHE_TTL_SECONDS = float(os.getenv("CHAT_CACHE_TTL_SECONDS", "3600"))
+CHAT_CACHE_CONTEXT_MESSAGES = int(os.getenv("CHAT_CACHE_CONTEXT_MESSAGES", "2"))
+CHAT_CACHE_MAX_RESPONSE_CHARS = 4000
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """Case-fold and drop punctuation so "Мне тревожно." and "мне  тревожно" collide."""
+    text = _PUNCTUATION.sub(" ", text.casefold().replace("ё", "е"))
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class CompletionCache:
+    """LRU cache of model replies with a per-entry TTL.
+
+    Keys cover the system prompt, the last ``context_messages`` turns of the
+    conversation and the new user message, all normalized, so identical
+    openings from different users share one upstream completion.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = CHAT_CACHE_ENABLED,
+        max_entries: int = CHAT_CACHE_MAX_ENTRIES,
+        ttl: float = CHAT_CACHE_TTL_SECONDS,
+        context_messages: int = CHAT_CACHE_CONTEXT_MESSAGES,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.context_messages = context_messages
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+
+    def key(self, messages: List[dict]) -> str:
+        system, *context, current = messages
+        recent = context[-self.context_messages:] if self.context_messages else []
+        parts = [normalize(system["content"])]
+        parts += [f'{m["role"]}:{normalize(m["content"])}' for m in recent]
+        parts.append(normalize(current["content"]))
+        return hashlib.blake2b("\x1f".join(parts).encode(), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < self.clock():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, response: str):
+        if len(response) > CHAT_CACHE_MAX_RESPONSE_CHARS:
+            return
+        self._entries[key] = (self.clock() + self.ttl, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self._entries)}
+
+
+completion_cache = CompletionCache()
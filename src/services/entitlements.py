@@ -0,0 +1,76 @@
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.models.models import User, as_utc, premium_active
+
+ENTITLEMENT_CACHE_TTL_SECONDS = float(os.getenv("ENTITLEMENT_CACHE_TTL_SECONDS", "30"))
+ENTITLEMENT_CACHE_MAX_ENTRIES = int(os.getenv("ENTITLEMENT_CACHE_MAX_ENTRIES", "100000"))
+
+
+@dataclass(frozen=True)
+class Entitlement:
+    is_premium: bool
+    expires_at: Optional[datetime]
+    last_played_id: Optional[int]
+
+    def active(self, now: Optional[datetime] = None) -> bool:
+        return premium_active(self.is_premium, self.expires_at, now)
+
+
+class EntitlementCache:
+    """Per-user premium state and last played meditation, cached in memory.
+
+    An entry lives for ``ttl`` seconds, but never past the moment the user's
+    premium expires. Writers that change any of the cached fields must call
+    ``invalidate()`` for the user they touched.
+    """
+
+    def __init__(self, ttl: float = ENTITLEMENT_CACHE_TTL_SECONDS, max_entries: int = ENTITLEMENT_CACHE_MAX_ENTRIES, clock: Callable[[], float] = time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, Tuple[float, Optional[Entitlement]]] = {}
+
+    async def resolve(self, db: AsyncSession, user_id: str) -> Optional[Entitlement]:
+        """Return the user's entitlement, or None when the user does not exist."""
+        now = self.clock()
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > now:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        row = (await db.execute(
+            select(User.is_premium, User.premium_expires_at, User.last_played_meditation_id).where(User.id == user_id)
+        )).first()
+        entitlement = Entitlement(bool(row[0]), as_utc(row[1]), row[2]) if row else None
+
+        expires = now + self.ttl
+        if entitlement is not None and entitlement.active(datetime.fromtimestamp(now, timezone.utc)):
+            expires = min(expires, entitlement.expires_at.timestamp())
+        self._store(user_id, expires, entitlement)
+        return entitlement
+
+    def _store(self, user_id: str, expires: float, entitlement: Optional[Entitlement]):
+        self._entries.pop(user_id, None)
+        if len(self._entries) >= self.max_entries:
+            del self._entries[next(iter(self._entries))]
+        self._entries[user_id] = (expires, entitlement)
+
+    def invalidate(self, user_id: str):
+        self._entries.pop(user_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+entitlement_cache = EntitlementCache()
@@ -0,0 +1,236 @@
+"""In-process counters rendered in the Prometheus text format at ``/metrics``.
+
+Everything a request touches is preallocated: routers are resolved by path
+prefix to a fixed ``RouterMetrics`` and histograms bump a slot in a list, so
+recording costs no allocations beyond the timing floats themselves.
+"""
+import bisect
+import time
+from typing import Dict, Iterable, List, Optional, Sequence
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile the way PromQL's ``histogram_quantile`` does."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+    def render(self, name: str, labels: str = "") -> List[str]:
+        prefix = f"{labels}," if labels else ""
+        suffix = f"{{{labels}}}" if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.bounds, self.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class RouterMetrics:
+    __slots__ = ("name", "prefix", "in_flight", "responses", "latency")
+
+    def __init__(self, name: str, prefix: str):
+        self.name = name
+        self.prefix = prefix
+        self.in_flight = 0
+        self.responses = [0] * 6  # indexed by status class, 1xx..5xx
+        self.latency = Histogram()
+
+
+ROUTERS = (
+    RouterMetrics("users", "/api/users"),
+    RouterMetrics("meditations", "/api/meditations"),
+    RouterMetrics("subscription", "/api/subscription"),
+    RouterMetrics("chat", "/api/chat"),
+)
+OTHER = RouterMetrics("other", "")
+
+
+def router_for(path: str) -> RouterMetrics:
+    for router in ROUTERS:
+        if path.startswith(router.prefix):
+            return router
+    return OTHER
+
+
+class OpenAIMetrics:
+    __slots__ = ("calls", "errors", "prompt_tokens", "completion_tokens", "latency")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency = Histogram()
+
+    def record(self, elapsed: float, usage=None, failed: bool = False):
+        self.calls += 1
+        self.errors += failed
+        self.latency.observe(elapsed)
+        if usage is not None:
+            self.prompt_tokens += usage.prompt_tokens or 0
+            self.completion_tokens += usage.completion_tokens or 0
+
+
+openai_metrics = OpenAIMetrics()
+db_checkout_wait = Histogram(WAIT_BUCKETS)
+
+
+class RequestMetricsMiddleware:
+    """Count requests, responses and latency per router."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        router = router_for(scope["path"])
+        router.in_flight += 1
+        started = time.perf_counter()
+        status_class = 5
+
+        async def send_with_status(message):
+            nonlocal status_class
+            if message["type"] == "http.response.start":
+                status_class = message["status"] // 100
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            router.in_flight -= 1
+            router.responses[status_class] += 1
+            router.latency.observe(time.perf_counter() - started)
+
+
+def _family(lines: List[str], name: str, kind: str, help_text: str):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _cache_lines(lines: List[str], caches: Dict[str, dict]):
+    _family(lines, "app_cache_hits_total", "counter", "Cache lookups answered from memory.")
+    for cache, stats in caches.items():
+        lines.append(f'app_cache_hits_total{{cache="{cache}"}} {stats["hits"] + stats.get("negative_hits", 0)}')
+    _family(lines, "app_cache_misses_total", "counter", "Cache lookups that went to the source.")
+    for cache, stats in caches.items():
+        lines.append(f'app_cache_misses_total{{cache="{cache}"}} {stats["misses"]}')
+    _family(lines, "app_cache_entries", "gauge", "Entries currently cached.")
+    for cache, stats in caches.items():
+        lines.append(f'app_cache_entries{{cache="{cache}"}} {stats["size"]}')
+
+
+def render(
+    pool=None,
+    thread_limiter=None,
+    caches: Optional[Dict[str, dict]] = None,
+    chat_jobs=None,
+    play_events: Optional[dict] = None,
+) -> str:
+    lines: List[str] = []
+    routers: Iterable[RouterMetrics] = (*ROUTERS, OTHER)
+
+    _family(lines, "http_requests_total", "counter", "Responses sent, by router and status class.")
+    for r in routers:
+        for status_class in range(1, 6):
+            if r.responses[status_class]:
+                lines.append(f'http_requests_total{{router="{r.name}",status="{status_class}xx"}} {r.responses[status_class]}')
+    _family(lines, "http_requests_in_flight", "gauge", "Requests currently being served.")
+    for r in routers:
+        lines.append(f'http_requests_in_flight{{router="{r.name}"}} {r.in_flight}')
+    _family(lines, "http_request_duration_seconds", "histogram", "Time from request start to the last response byte.")
+    for r in routers:
+        lines.extend(r.latency.render("http_request_duration_seconds", f'router="{r.name}"'))
+    _family(lines, "http_request_duration_quantile_seconds", "gauge", "Latency quantiles estimated from the histogram.")
+    for r in routers:
+        for q in QUANTILES:
+            lines.append(f'http_request_duration_quantile_seconds{{router="{r.name}",quantile="{q}"}} {r.latency.quantile(q):.6f}')
+
+    if thread_limiter is not None:
+        _family(lines, "threadpool_threads_busy", "gauge", "Worker threads in use by sync endpoints and run_in_threadpool.")
+        lines.append(f"threadpool_threads_busy {thread_limiter.borrowed_tokens}")
+        _family(lines, "threadpool_threads_max", "gauge", "Worker thread limit.")
+        lines.append(f"threadpool_threads_max {thread_limiter.total_tokens}")
+
+    if pool is not None and hasattr(pool, "checkedout"):
+        _family(lines, "db_pool_connections", "gauge", "Pooled database connections by state.")
+        lines.append(f'db_pool_connections{{state="checked_out"}} {pool.checkedout()}')
+        lines.append(f'db_pool_connections{{state="idle"}} {pool.checkedin()}')
+        lines.append(f'db_pool_connections{{state="overflow"}} {max(pool.overflow(), 0)}')
+    _family(lines, "db_pool_checkout_wait_seconds", "histogram", "Time spent waiting for a pooled connection.")
+    lines.extend(db_checkout_wait.render("db_pool_checkout_wait_seconds"))
+
+    m = openai_metrics
+    _family(lines, "openai_requests_total", "counter", "Chat completion calls.")
+    lines.append(f"openai_requests_total {m.calls}")
+    _family(lines, "openai_errors_total", "counter", "Chat completion calls that failed.")
+    lines.append(f"openai_errors_total {m.errors}")
+    _family(lines, "openai_tokens_total", "counter", "Tokens reported by the API.")
+    lines.append(f'openai_tokens_total{{kind="prompt"}} {m.prompt_tokens}')
+    lines.append(f'openai_tokens_total{{kind="completion"}} {m.completion_tokens}')
+    _family(lines, "openai_request_duration_seconds", "histogram", "Chat completion latency, to the last streamed token.")
+    lines.extend(m.latency.render("openai_request_duration_seconds"))
+
+    if chat_jobs is not None:
+        stats = chat_jobs.stats()
+        _family(lines, "chat_jobs_queued", "gauge", "Chat turns waiting for a worker.")
+        lines.append(f"chat_jobs_queued {stats['queued']}")
+        _family(lines, "chat_jobs_running", "gauge", "Chat turns being answered.")
+        lines.append(f"chat_jobs_running {stats['running']}")
+        _family(lines, "chat_jobs_workers", "gauge", "Chat worker tasks.")
+        lines.append(f"chat_jobs_workers {stats['workers']}")
+        _family(lines, "chat_jobs_completed_total", "counter", "Chat turns answered by workers.")
+        lines.append(f"chat_jobs_completed_total {stats['completed']}")
+        _family(lines, "chat_jobs_rejected_total", "counter", "Chat turns refused because the queue was full.")
+        lines.append(f"chat_jobs_rejected_total {stats['rejected']}")
+        _family(lines, "chat_jobs_wait_seconds", "histogram", "Time chat turns spent queued before a worker took them.")
+        lines.extend(chat_jobs.wait.render("chat_jobs_wait_seconds"))
+
+    if play_events is not None:
+        _family(lines, "play_events_pending", "gauge", "Play events buffered and not yet written.")
+        lines.append(f"play_events_pending {play_events['pending']}")
+        _family(lines, "play_events_written_total", "counter", "Play events written to the database.")
+        lines.append(f"play_events_written_total {play_events['written']}")
+        _family(lines, "play_events_rejected_total", "counter", "Play events refused because the buffer was full.")
+        lines.append(f"play_events_rejected_total {play_events['rejected']}")
+        _family(lines, "play_events_dropped_total", "counter", "Play events discarded because they could not be written.")
+        lines.append(f"play_events_dropped_total {play_events['dropped']}")
+
+    if caches:
+        _cache_lines(lines, caches)
+
+    lines.append("")
+    return "\n".join(lines)
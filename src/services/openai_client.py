@@ -0,0 +1,67 @@
+import asyncio
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "30"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "1"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "50"))
+
+
+def create_openai_client():
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    try:
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+        timeout = httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+            timeout=timeout,
+        )
+        return AsyncOpenAI(
+            api_key=api_key,
+            timeout=timeout,
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=http_client,
+        )
+    except Exception:
+        return None
+
+
+class OpenAIClientPool:
+    """One ``AsyncOpenAI`` client per process plus a cap on in-flight completions.
+
+    Opened and closed by the application lifespan; ``slots`` bounds how many
+    completions run upstream at once so a slow provider queues requests here
+    instead of exhausting the HTTP connection pool.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.slots = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+
+    async def start(self):
+        self.client = create_openai_client()
+        self.slots = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+        self.client = None
+
+
+openai_pool = OpenAIClientPool()
+
+
+def get_openai_client():
+    return openai_pool.client
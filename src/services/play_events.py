@@ -0,0 +1,141 @@
+import os
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+from sqlalchemy import bindparam, exists, insert, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.models.models import PLAY_EVENT_KINDS, ListeningProgress, PlayEvent, SessionLocal, User
+from src.services.entitlements import entitlement_cache
+from src.services.write_behind import WriteBehindBuffer
+
+PLAY_FLUSH_INTERVAL_MS = int(os.getenv("PLAY_FLUSH_INTERVAL_MS", "200"))
+PLAY_FLUSH_MAX_BATCH = int(os.getenv("PLAY_FLUSH_MAX_BATCH", "2000"))
+PLAY_MAX_PENDING = int(os.getenv("PLAY_MAX_PENDING", "200000"))
+PLAY_FLUSH_MAX_ATTEMPTS = int(os.getenv("PLAY_FLUSH_MAX_ATTEMPTS", "3"))
+
+# (user_id, meditation_id, kind, position_seconds, created_at)
+PendingEvent = Tuple[str, int, int, int, datetime]
+
+# Core statements: executemany through the ORM costs about twice the CPU per
+# row, and a flush runs on the event loop.
+_insert_events = insert(PlayEvent.__table__)
+# Skipped when an earlier flush already recorded a newer play for the user, so
+# a batch of late events (offline clients, backfills) cannot move it back.
+# ``listening_progress`` keeps the newest event per meditation, which makes it
+# the high-water mark of everything flushed so far.
+_progress = ListeningProgress.__table__
+_set_last_played = (
+    update(User.__table__)
+    .where(User.__table__.c.id == bindparam("b_user_id"))
+    .where(~exists().where(
+        _progress.c.user_id == bindparam("b_user_id"),
+        _progress.c.updated_at > bindparam("b_at"),
+    ))
+    .values(last_played_meditation_id=bindparam("b_meditation_id"))
+)
+
+START = PLAY_EVENT_KINDS.index("start")
+COMPLETE = PLAY_EVENT_KINDS.index("complete")
+
+
+class PlayEventsFull(Exception):
+    pass
+
+
+def latest_per_user(events: Iterable[PendingEvent]) -> Dict[str, Tuple[int, datetime]]:
+    """Meditation and time of each user's most recent event; later events win ties."""
+    latest: Dict[str, Tuple[int, datetime]] = {}
+    for user_id, meditation_id, _, _, created_at in events:
+        seen = latest.get(user_id)
+        if seen is None or created_at >= seen[1]:
+            latest[user_id] = (meditation_id, created_at)
+    return latest
+
+
+def latest_progress(events: Iterable[PendingEvent]) -> List[dict]:
+    """``listening_progress`` rows for the newest event per user and meditation."""
+    latest: Dict[Tuple[str, int], PendingEvent] = {}
+    for event in events:
+        seen = latest.get(event[:2])
+        if seen is None or event[4] >= seen[4]:
+            latest[event[:2]] = event
+    return [
+        {"user_id": u, "meditation_id": m, "position_seconds": p, "completed": k == COMPLETE, "updated_at": at}
+        for u, m, k, p, at in latest.values()
+    ]
+
+
+def upsert_progress(db: AsyncSession):
+    """Insert progress rows, or overwrite existing ones unless they are newer."""
+    table = ListeningProgress.__table__
+    dialect = db.get_bind().dialect.name
+    stmt = (postgresql_insert if dialect == "postgresql" else sqlite_insert)(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.meditation_id],
+        set_={
+            "position_seconds": stmt.excluded.position_seconds,
+            "completed": stmt.excluded.completed,
+            "updated_at": stmt.excluded.updated_at,
+        },
+        where=stmt.excluded.updated_at >= table.c.updated_at,
+    )
+
+
+class PlayEventBuffer(WriteBehindBuffer):
+    """Write-behind buffer for playback events.
+
+    Requests only append tuples to a list; a background task writes them with
+    one bulk INSERT every ``flush_interval`` seconds, or as soon as
+    ``max_batch`` events are waiting. The same transaction moves each user's
+    ``last_played_meditation_id`` to the meditation of their newest event in
+    the batch, unless an earlier batch held a newer one, and records the newest
+    position per meditation in ``listening_progress``. ``add()`` raises
+    ``PlayEventsFull`` once ``max_pending`` events are waiting, so a stalled
+    database sheds load instead of exhausting memory.
+    """
+
+    rows_name = "play events"
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        flush_interval: float = PLAY_FLUSH_INTERVAL_MS / 1000,
+        max_batch: int = PLAY_FLUSH_MAX_BATCH,
+        max_pending: int = PLAY_MAX_PENDING,
+        max_attempts: int = PLAY_FLUSH_MAX_ATTEMPTS,
+    ):
+        super().__init__(session_factory, flush_interval, max_batch, max_attempts)
+        self.max_pending = max_pending
+        self.written = 0
+        self.rejected = 0
+        self._pending: List[PendingEvent] = []
+
+    def add(self, events: List[PendingEvent]):
+        if len(self._pending) + len(events) > self.max_pending:
+            self.rejected += len(events)
+            raise PlayEventsFull()
+        self._append(events)
+
+    async def _write(self, batch: List[PendingEvent]):
+        latest = latest_per_user(batch)
+        async with self.session_factory() as db:
+            await db.execute(_insert_events, [
+                {"user_id": u, "meditation_id": m, "kind": k, "position_seconds": p, "created_at": at}
+                for u, m, k, p, at in batch
+            ])
+            await db.execute(
+                _set_last_played,
+                [{"b_user_id": u, "b_meditation_id": m, "b_at": at} for u, (m, at) in latest.items()],
+            )
+            await db.execute(upsert_progress(db), latest_progress(batch))
+            await db.commit()
+        self.written += len(batch)
+        for user_id in latest:
+            entitlement_cache.invalidate(user_id)
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "written": self.written, "rejected": self.rejected, "dropped": self.dropped}
+
+
+play_events = PlayEventBuffer()
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy import func, select
+from src.models.models import PlayEvent, SessionLocal, as_utc
+from src.services.play_events import START
+
+POPULARITY_REFRESH_SECONDS = float(os.getenv("POPULARITY_REFRESH_SECONDS", "10"))
+POPULARITY_REFRESH_BATCH = int(os.getenv("POPULARITY_REFRESH_BATCH", "10000"))
+POPULARITY_ID_OVERLAP = int(os.getenv("POPULARITY_ID_OVERLAP", "10000"))
+
+# Window name -> length in hourly buckets.
+WINDOWS = {"day": 24, "week": 24 * 7}
+
+logger = logging.getLogger(__name__)
+
+
+def hour_of(moment: datetime) -> int:
+    return int(as_utc(moment).timestamp() // 3600)
+
+
+class PopularityCounters:
+    """Plays per meditation over the last day and week, kept in memory.
+
+    A play is a ``start`` event. Counts live in hourly buckets; each window
+    keeps a running total that gains new plays and loses whole buckets as
+    they age out, so nothing is ever recounted. ``refresh()`` reads only
+    events above the highest id it has seen, less ``id_overlap`` ids: ids are
+    allocated before commit, so with several writers (or on PostgreSQL) a
+    lower id can become visible after a higher one. Ids counted within the
+    overlap are remembered, so those late events are counted exactly once. An
+    event that commits more than ``id_overlap`` ids behind is missed.
+
+    Rankings are sorted lazily once per refresh and per catalog version, so
+    a request reads a precomputed list.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        refresh_interval: float = POPULARITY_REFRESH_SECONDS,
+        batch: int = POPULARITY_REFRESH_BATCH,
+        id_overlap: int = POPULARITY_ID_OVERLAP,
+    ):
+        self.session_factory = session_factory
+        self.refresh_interval = refresh_interval
+        self.batch = batch
+        self.id_overlap = id_overlap
+        self.generation = 0
+        self._last_id: Optional[int] = None
+        # Ids already counted that lie within the overlap below ``_last_id``.
+        self._seen: Set[int] = set()
+        self._hour = 0
+        self._buckets: Dict[int, Counter] = {}
+        self._totals: Dict[str, Counter] = {window: Counter() for window in WINDOWS}
+        self._rankings: Dict[tuple, Tuple[List[Tuple[int, int]], List[dict]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def count(self, meditation_id: int, window: str = "week") -> int:
+        return self._totals[window][meditation_id]
+
+    def totals(self, window: str = "week") -> Counter:
+        return self._totals[window]
+
+    def add(self, meditation_id: int, hour: int):
+        for window, hours in WINDOWS.items():
+            if hour > self._hour - hours:
+                self._totals[window][meditation_id] += 1
+        if hour > self._hour - WINDOWS["week"]:
+            self._buckets.setdefault(hour, Counter())[meditation_id] += 1
+
+    def advance(self, hour: int):
+        """Move the current hour forward, dropping buckets that left a window."""
+        for window, hours in WINDOWS.items():
+            for bucket_hour, bucket in self._buckets.items():
+                if self._hour - hours < bucket_hour <= hour - hours:
+                    self._totals[window].subtract(bucket)
+            self._totals[window] = +self._totals[window]
+        self._buckets = {h: bucket for h, bucket in self._buckets.items() if h > hour - WINDOWS["week"]}
+        self._hour = hour
+
+    async def refresh(self):
+        """Count ``start`` events written since the previous refresh."""
+        now = datetime.now(timezone.utc)
+        current = hour_of(now)
+        changed = current > self._hour
+        if changed:
+            self.advance(current)
+
+        async with self.session_factory() as db:
+            if self._last_id is None:
+                # First load: every event of the last week has an id at or
+                # above the smallest one created within it.
+                cutoff = (now - timedelta(hours=WINDOWS["week"])).replace(tzinfo=None)
+                first = await db.scalar(select(func.min(PlayEvent.id)).where(PlayEvent.created_at >= cutoff))
+                if first is None:
+                    self._last_id = await db.scalar(select(func.max(PlayEvent.id))) or 0
+                else:
+                    self._last_id = first - 1
+            after = self._last_id - self.id_overlap
+            while True:
+                rows = (await db.execute(
+                    select(PlayEvent.id, PlayEvent.meditation_id, PlayEvent.created_at)
+                    .where(PlayEvent.id > after, PlayEvent.kind == START)
+                    .order_by(PlayEvent.id)
+                    .limit(self.batch)
+                )).all()
+                for event_id, meditation_id, created_at in rows:
+                    if event_id in self._seen:
+                        continue
+                    self._seen.add(event_id)
+                    # Client clocks run ahead at times; count those plays now.
+                    self.add(meditation_id, min(hour_of(created_at), current))
+                    changed = True
+                if rows:
+                    after = rows[-1][0]
+                    if after > self._last_id:
+                        self._last_id = after
+                        self._seen = {i for i in self._seen if i > after - self.id_overlap}
+                if len(rows) < self.batch:
+                    break
+        if changed:
+            self.generation += 1
+            self._rankings.clear()
+
+    def ranking(self, catalog, window: str, category: Optional[str], include_premium: bool) -> Tuple[List[Tuple[int, int]], List[dict]]:
+        """Catalog rows of a listing, most played first, with their sort keys.
+
+        Keys are ``(-plays, id)`` so callers can bisect to a keyset cursor.
+        """
+        key = (catalog.version, window, category, include_premium)
+        ranked = self._rankings.get(key)
+        if ranked is None:
+            totals = self._totals[window]
+            rows = sorted(catalog.listing(category, include_premium), key=lambda row: (-totals[row["id"]], row["id"]))
+            ranked = ([(-totals[row["id"]], row["id"]) for row in rows], rows)
+            self._rankings[key] = ranked
+        return ranked
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh popularity counters")
+
+    async def start(self):
+        """Load the last week of plays, then keep refreshing in the background."""
+        try:
+            await self.refresh()
+        except Exception:
+            logger.exception("Failed to load popularity counters")
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def clear(self):
+        self.generation += 1
+        self._last_id = None
+        self._seen.clear()
+        self._hour = 0
+        self._buckets.clear()
+        self._totals = {window: Counter() for window in WINDOWS}
+        self._rankings.clear()
+
+
+popularity = PopularityCounters()
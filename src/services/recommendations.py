@@ -0,0 +1,134 @@
+"""Content-based recommendations scored with NumPy over a catalog feature matrix.
+
+Each meditation is a row of one-hot category and duration bucket columns plus
+mood affinities derived from its text. A user becomes a vector over the same
+columns, built from recent plays and the moods named in recent chat messages,
+so ranking the whole catalog is a single matrix-vector product.
+"""
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from src.services.play_events import COMPLETE
+from src.services.search import DURATION_BUCKETS, duration_bucket, tokenize
+
+# Mood -> stems of words that signal it, in titles and descriptions as well as
+# in what users write to the assistant. Matched as token prefixes.
+MOODS = {
+    "sleep": ("сон", "сна", "сну", "усн", "засып", "бессон", "ноч", "вечер", "sleep", "insomnia", "night"),
+    "stress": ("стресс", "напряж", "нерв", "раздраж", "устал", "выгора", "stress", "tense", "tired"),
+    "anxiety": ("тревог", "тревож", "беспоко", "страх", "паник", "волну", "anxi", "worr", "panic", "fear"),
+    "focus": ("фокус", "концентр", "внима", "работ", "учеб", "focus", "concentr", "work", "study"),
+    "energy": ("энерг", "бодр", "утр", "заряд", "energ", "morning"),
+    "calm": ("спокой", "успока", "расслаб", "релакс", "дыха", "calm", "relax", "breath"),
+}
+
+CATEGORY_WEIGHT = 1.0
+DURATION_WEIGHT = 0.5
+MOOD_WEIGHT = 1.5
+# Breaks ties between equally matching items, and orders the catalog for users
+# with no history at all.
+POPULARITY_WEIGHT = 0.01
+# Applied to items the user finished recently, so the list keeps moving.
+COMPLETED_PENALTY = 0.5
+
+
+@lru_cache(maxsize=65536)
+def moods_of(token: str) -> Tuple[int, ...]:
+    return tuple(i for i, stems in enumerate(MOODS.values()) if token.startswith(stems))
+
+
+def mood_counts(tokens: Iterable[str]) -> List[int]:
+    counts = [0] * len(MOODS)
+    for token in tokens:
+        for i in moods_of(token):
+            counts[i] += 1
+    return counts
+
+
+class CatalogFeatures:
+    """Feature matrix of a catalog snapshot, rebuilt together with it."""
+
+    def __init__(self, rows: Iterable[dict]):
+        rows = list(rows)
+        self.ids = np.array([row["id"] for row in rows], dtype=np.int64)
+        self.index: Dict[int, int] = {row["id"]: i for i, row in enumerate(rows)}
+        self.premium = np.array([bool(row["is_premium"]) for row in rows], dtype=bool)
+        self.categories = sorted({row["category"] for row in rows if row["category"]})
+
+        columns = {name: i for i, name in enumerate(self.categories)}
+        self.duration_start = len(self.categories)
+        self.mood_start = self.duration_start + len(DURATION_BUCKETS)
+        buckets = [name for name, _ in DURATION_BUCKETS]
+
+        self.matrix = np.zeros((len(rows), self.mood_start + len(MOODS)), dtype=np.float32)
+        positions = np.arange(len(rows))
+        category_columns = [columns.get(row["category"], -1) for row in rows]
+        has_category = np.array(category_columns) >= 0 if rows else np.zeros(0, dtype=bool)
+        self.matrix[positions[has_category], np.array(category_columns, dtype=np.int64)[has_category]] = 1.0
+        self.matrix[positions, [self.duration_start + buckets.index(duration_bucket(row["duration_seconds"] or 0)) for row in rows]] = 1.0
+        moods = np.array(
+            [mood_counts(tokenize(" ".join(filter(None, (row["title"], row["description"], row["category"]))))) for row in rows],
+            dtype=np.float32,
+        ).reshape(len(rows), len(MOODS))
+        peaks = moods.max(axis=1, initial=0.0, keepdims=True)
+        self.matrix[:, self.mood_start:] = np.divide(moods, peaks, out=np.zeros_like(moods), where=peaks > 0)
+
+        self._prior_generation: Optional[int] = None
+        self._prior = np.zeros(len(rows), dtype=np.float32)
+
+    def prior(self, totals, generation: int) -> np.ndarray:
+        """Play counts scaled to 0..1, recomputed only after a popularity refresh."""
+        if generation != self._prior_generation:
+            counts = np.fromiter((totals[med_id] for med_id in self.ids.tolist()), dtype=np.float32, count=len(self.ids))
+            self._prior = counts / counts.max() if counts.any() else counts
+            self._prior_generation = generation
+        return self._prior
+
+    def profile(self, plays: Sequence[Tuple[int, int]], messages: Iterable[str]) -> np.ndarray:
+        """User vector from recent ``(meditation_id, kind)`` plays and chat messages.
+
+        Category and duration preferences are shares of the played items, a
+        finished item counting double; moods are shares of mood words used.
+        """
+        vector = np.zeros(self.matrix.shape[1], dtype=np.float32)
+        known = [(self.index[med_id], kind) for med_id, kind in plays if med_id in self.index]
+        if known:
+            rows = [row for row, _ in known]
+            weights = np.array([2.0 if kind == COMPLETE else 1.0 for _, kind in known], dtype=np.float32)
+            history = weights @ self.matrix[rows, :self.mood_start]
+            categories, durations = history[:self.duration_start], history[self.duration_start:]
+            if categories.any():
+                vector[:self.duration_start] = CATEGORY_WEIGHT * categories / categories.sum()
+            vector[self.duration_start:self.mood_start] = DURATION_WEIGHT * durations / durations.sum()
+
+        moods = np.array(mood_counts(token for text in messages for token in tokenize(text)), dtype=np.float32)
+        if moods.any():
+            vector[self.mood_start:] = MOOD_WEIGHT * moods / moods.sum()
+        return vector
+
+    def recommend(
+        self,
+        profile: np.ndarray,
+        include_premium: bool,
+        limit: int,
+        completed: Iterable[int] = (),
+        prior: Optional[np.ndarray] = None,
+    ) -> List[Tuple[int, float]]:
+        """Best ``limit`` ``(meditation_id, score)`` pairs, highest score first."""
+        if not len(self.ids):
+            return []
+        scores = self.matrix @ profile
+        if prior is not None:
+            scores += POPULARITY_WEIGHT * prior
+        done = [self.index[med_id] for med_id in completed if med_id in self.index]
+        if done:
+            scores[done] *= COMPLETED_PENALTY
+        if not include_premium:
+            scores[self.premium] = -np.inf
+
+        k = min(limit, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((self.ids[top], -scores[top]))]
+        return [(int(self.ids[i]), round(float(scores[i]), 4)) for i in top]
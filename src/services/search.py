@@ -0,0 +1,141 @@
+import bisect
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Upper bounds in seconds, matched in order; the last bucket is open-ended.
+DURATION_BUCKETS = (("0-5", 300), ("5-10", 600), ("10-20", 1200), ("20+", None))
+
+_WORD = re.compile(r"\w+")
+
+# Inflectional endings of Russian nouns, adjectives, participles and verbs,
+# longest first so "ого" wins over "о". Stripped only while a stem of at least
+# three letters remains, which keeps short words like "сон" intact.
+_RU_ENDINGS = sorted(
+    {
+        "иями", "ями", "ами", "иях", "ях", "ах", "ов", "ев", "ей", "ой", "ий", "ый", "ая", "яя", "ое", "ее",
+        "ые", "ие", "ого", "его", "ому", "ему", "ым", "им", "ом", "ем", "ую", "юю", "ой", "ых", "их",
+        "ию", "ия", "ие", "ии", "ью", "ам", "ям", "ться", "ть", "ешь", "ет", "ют", "ут", "ишь", "ит",
+        "ят", "ает", "яет", "ющий", "ющая", "ющее", "ющие", "щий", "вший", "ся", "сь",
+        "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+    },
+    key=len,
+    reverse=True,
+)
+_MIN_STEM = 3
+_STOPWORDS = frozenset({"а", "в", "во", "для", "до", "и", "из", "к", "ко", "на", "не", "но", "о", "об", "от", "перед", "по", "при", "с", "со", "у"})
+
+
+def duration_bucket(seconds: int) -> str:
+    for name, upper in DURATION_BUCKETS:
+        if upper is None or seconds < upper:
+            return name
+    return DURATION_BUCKETS[-1][0]
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    if not ("а" <= word[0] <= "я"):
+        return word
+    for _ in range(2):  # e.g. "успокаивающаяся": reflexive "ся", then "ая"
+        for ending in _RU_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+                word = word[: -len(ending)]
+                break
+        else:
+            break
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Case-folded, ё-normalized, stemmed word tokens without stop words."""
+    return [stem(w) for w in _WORD.findall(text.casefold().replace("ё", "е")) if w not in _STOPWORDS]
+
+
+class SearchIndex:
+    """Inverted index over meditation titles and descriptions.
+
+    Every query token matches indexed stems it is a prefix of, so "рассл"
+    finds "Расслабляющий вечер"; all tokens must match. Title hits rank above
+    description hits.
+    """
+
+    def __init__(self, rows: Iterable[dict]):
+        self.rows: Dict[int, dict] = {}
+        self._postings: Dict[str, Set[int]] = {}
+        self._titles: Dict[int, Set[str]] = {}
+        for row in rows:
+            self.rows[row["id"]] = row
+            title = set(tokenize(row["title"] or ""))
+            self._titles[row["id"]] = title
+            for term in title.union(tokenize(row["description"] or "")):
+                self._postings.setdefault(term, set()).add(row["id"])
+        self._terms = sorted(self._postings)
+
+    def _expand(self, token: str) -> List[str]:
+        start = bisect.bisect_left(self._terms, token)
+        end = bisect.bisect_left(self._terms, token + "\uffff")
+        return self._terms[start:end]
+
+    def match(self, query: str) -> List[int]:
+        """Ids matching every token of ``query``, best first; all ids for an empty query."""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return sorted(self.rows)
+
+        scores: Optional[Counter] = None
+        for token in tokens:
+            terms = self._expand(token)
+            hits: Counter = Counter()
+            for term in terms:
+                for med_id in self._postings[term]:
+                    hits[med_id] = max(hits[med_id], 2 if term in self._titles[med_id] else 1)
+            if scores is None:
+                scores = hits
+            else:
+                scores = Counter({med_id: score + hits[med_id] for med_id, score in scores.items() if med_id in hits})
+            if not scores:
+                return []
+        return sorted(scores, key=lambda med_id: (-scores[med_id], med_id))
+
+    def facets(self, ids: Iterable[int]) -> dict:
+        category: Counter = Counter()
+        duration: Counter = Counter()
+        premium: Counter = Counter()
+        for med_id in ids:
+            row = self.rows[med_id]
+            category[row["category"]] += 1
+            duration[duration_bucket(row["duration_seconds"] or 0)] += 1
+            premium["true" if row["is_premium"] else "false"] += 1
+        return {
+            "category": dict(category.most_common()),
+            "duration": {name: duration[name] for name, _ in DURATION_BUCKETS if duration[name]},
+            "premium": dict(premium),
+        }
+
+    def search(
+        self,
+        query: str,
+        include_premium: bool,
+        category: Optional[str] = None,
+        duration: Optional[str] = None,
+        premium: Optional[bool] = None,
+    ) -> Tuple[List[int], dict]:
+        """Ranked ids after filters, plus facet counts over the text matches.
+
+        Facets ignore the ``category``/``duration``/``premium`` filters so a
+        client can show every option next to the current selection.
+        """
+        matched = [
+            med_id for med_id in self.match(query)
+            if include_premium or not self.rows[med_id]["is_premium"]
+        ]
+        facets = self.facets(matched)
+        ids = [
+            med_id for med_id in matched
+            if (category is None or self.rows[med_id]["category"] == category)
+            and (duration is None or duration_bucket(self.rows[med_id]["duration_seconds"] or 0) == duration)
+            and (premium is None or bool(self.rows[med_id]["is_premium"]) == premium)
+        ]
+        return ids, facets
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Optional
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeout
+
+logger = logging.getLogger(__name__)
+
+# Failures that say nothing about the rows themselves; such a batch is kept
+# whole and retried for as long as they last.
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, PoolTimeout, OSError)
+
+
+class WriteBehindBuffer(ABC):
+    """Rows collected in memory and written in batches by a background task.
+
+    A batch is written every ``flush_interval`` seconds, or as soon as
+    ``max_batch`` rows are waiting; subclasses implement ``_write(batch)``.
+    Rows stay in ``_pending`` or ``_flushing`` until their batch is committed.
+
+    A batch that fails ``max_attempts`` times for another reason than a
+    transient database error is split in halves until the rows that cannot be
+    written are isolated and dropped, so they never hold up the rest.
+    """
+
+    # Plural noun for log messages.
+    rows_name = "rows"
+
+    def __init__(self, session_factory, flush_interval: float, max_batch: int, max_attempts: int = 3):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.dropped = 0
+        self._failures = 0
+        # Batch size while a failing batch is being split, until the queue drains.
+        self._split: Optional[int] = None
+        self._pending: list = []
+        self._flushing: list = []
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def _append(self, rows: list):
+        self._pending.extend(rows)
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    @abstractmethod
+    async def _write(self, batch: list):
+        """Write and commit one batch; raise to have it retried."""
+
+    async def flush(self):
+        async with self._lock:
+            while self._pending:
+                size = self._split or self.max_batch
+                self._flushing, self._pending = self._pending[:size], self._pending[size:]
+                batch = self._flushing
+                try:
+                    await self._write(batch)
+                except TRANSIENT_ERRORS:
+                    logger.exception("Failed to write %d %s, will retry", len(batch), self.rows_name)
+                    self._pending[:0] = batch
+                    return
+                except Exception:
+                    self._failures += 1
+                    if self._split is None and self._failures < self.max_attempts:
+                        logger.exception("Failed to write %d %s, will retry", len(batch), self.rows_name)
+                        self._pending[:0] = batch
+                        return
+                    if len(batch) == 1:
+                        logger.exception("Dropping unwritable %s: %r", self.rows_name, batch)
+                        self.dropped += 1
+                        self._failures = 0
+                        self._split = None
+                    else:
+                        logger.exception("Failed to write %d %s, splitting the batch", len(batch), self.rows_name)
+                        self._pending[:0] = batch
+                        self._split = len(batch) // 2
+                    continue
+                finally:
+                    self._flushing = []
+                self._failures = 0
+            self._split = None
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the flush loop and drain everything still buffered."""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
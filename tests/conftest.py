@@ -1,14 +1,24 @@
+import asyncio
 import sys
 import os
 import pytest
+from contextlib import contextmanager
 
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + "/.."))
 
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
-from src.models.models import Base, get_db
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from src.models.models import Base, SessionLocal, get_db, instrument_queries
 from src.main import app
+from src.services.catalog import catalog_cache
+from src.services.code_cache import activation_code_cache
+from src.services.entitlements import entitlement_cache
+from src.services.chat_buffer import chat_buffer, CHAT_FLUSH_INTERVAL_MS
+from src.services.chat_jobs import chat_jobs
+from src.services.play_events import play_events, PLAY_FLUSH_INTERVAL_MS
+from src.services.popularity import popularity, POPULARITY_REFRESH_SECONDS
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 
@@ -16,6 +26,14 @@ engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+instrument_queries(engine)
+
+
+class SharedAsyncSession(AsyncSession):
+    """Async facade over the test's sync session; the fixture owns its lifetime."""
+
+    async def close(self):
+        pass
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -38,15 +56,98 @@ def db_session():
         connection.close()
 
 
+@pytest.fixture()
+def async_db(db_session):
+    """The test's session behind the ``AsyncSession`` interface services expect."""
+    return SharedAsyncSession(sync_session_class=lambda **_: db_session)
+
+
+@pytest.fixture()
+def count_queries():
+    """Record SQL sent to the test database.
+
+    ``with count_queries() as queries: ...`` collects every statement executed
+    inside the block, so tests can pin a route to a fixed number of round trips.
+    """
+    @contextmanager
+    def counter():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+    return counter
+
+
+@pytest.fixture()
+def run_with_buffer(tmp_path):
+    """Run a write-behind buffer against a fresh SQLite file.
+
+    ``run_with_buffer(buffer_class, scenario, rows=..., **buffer_kwargs)``
+    creates the schema, adds ``rows``, then returns what
+    ``await scenario(buffer, sessions)`` returns.
+    """
+    def run(buffer_class, scenario, rows=(), **buffer_kwargs):
+        async def main():
+            engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'buffer.db'}")
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            sessions = async_sessionmaker(bind=engine)
+            if rows:
+                async with sessions() as db:
+                    db.add_all(rows)
+                    await db.commit()
+            try:
+                return await scenario(buffer_class(session_factory=sessions, **buffer_kwargs), sessions)
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(main())
+
+    return run
+
+
 @pytest.fixture()
 def client(db_session):
-    def override_get_db():
+    # Route handlers await an AsyncSession; wrapping the test's sync session
+    # keeps a single identity map and transaction shared with the test body.
+    def shared_session():
+        return SharedAsyncSession(sync_session_class=lambda **_: db_session)
+
+    async def override_get_db():
         try:
-            yield db_session
+            yield shared_session()
         finally:
             pass
 
     app.dependency_overrides[get_db] = override_get_db
+    catalog_cache.invalidate()
+    entitlement_cache.clear()
+    activation_code_cache.clear()
+    popularity.clear()
+    # Buffered chat messages and play events reach the test session only on
+    # shutdown or an explicit flush through the client's portal, never
+    # concurrently with the test body running in another thread.
+    chat_buffer.session_factory = shared_session
+    chat_jobs.session_factory = shared_session
+    play_events.session_factory = shared_session
+    popularity.session_factory = shared_session
+    chat_buffer.flush_interval = 3600
+    play_events.flush_interval = 3600
+    popularity.refresh_interval = 3600
     with TestClient(app) as c:
         yield c
     app.dependency_overrides.clear()
+    chat_buffer.session_factory = SessionLocal
+    chat_jobs.session_factory = SessionLocal
+    play_events.session_factory = SessionLocal
+    popularity.session_factory = SessionLocal
+    chat_buffer.flush_interval = CHAT_FLUSH_INTERVAL_MS / 1000
+    play_events.flush_interval = PLAY_FLUSH_INTERVAL_MS / 1000
+    popularity.refresh_interval = POPULARITY_REFRESH_SECONDS
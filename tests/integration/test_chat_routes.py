@@ -1,17 +1,23 @@
 from fastapi.testclient import TestClient
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import json
 from src.main import app
-
-client = TestClient(app)
+from src.models.models import ChatMessage, get_db
+from src.routes.chat_routes import ChatRequest, newest_first, stream_chat_with_psychologist
+from src.services.chat_buffer import chat_buffer
+from src.services.completion_cache import CompletionCache
 
 mock_openai_client = MagicMock()
 mock_choice = MagicMock()
 mock_choice.message.content = "Я понимаю ваши чувства, всё будет хорошо."
+mock_openai_client.chat.completions.create = AsyncMock()
 mock_openai_client.chat.completions.create.return_value.choices = [mock_choice]
 
 
 @patch("src.routes.chat_routes.get_openai_client", return_value=mock_openai_client)
-def test_chat_mock_response(mock_client_func):
+def test_chat_mock_response(mock_client_func, client: TestClient):
     payload = {"user_id": "test_user", "message": "Мне тревожно."}
     response = client.post("/api/chat/", json=payload)
 
@@ -21,7 +27,7 @@ def test_chat_mock_response(mock_client_func):
 
 
 @patch("src.routes.chat_routes.get_openai_client", return_value=mock_openai_client)
-def test_chat_history_returns_messages(mock_client_func):
+def test_chat_history_returns_messages(mock_client_func, client: TestClient):
     payload = {"user_id": "test_user", "message": "Мне тревожно."}
     client.post("/api/chat/", json=payload)
 
@@ -30,3 +36,195 @@ def test_chat_history_returns_messages(mock_client_func):
     data = response.json()
     assert any("Мне тревожно." in item["response"] for item in data)
     assert any("Я понимаю ваши чувства" in item["response"] for item in data)
+
+
+def add_history(db_session, user_id, count):
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    db_session.add_all([
+        ChatMessage(user_id=user_id, content=f"msg {i}", is_user=(i % 2 == 0), created_at=start + timedelta(minutes=i))
+        for i in range(count)
+    ])
+    db_session.commit()
+
+
+def test_chat_history_keyset_pages(client: TestClient, db_session):
+    add_history(db_session, "paged_user", 5)
+
+    first = client.get("/api/chat/history?user_id=paged_user&limit=2")
+    assert [m["response"] for m in first.json()] == ["msg 3", "msg 4"]
+
+    second = client.get(f"/api/chat/history?user_id=paged_user&limit=2&before={first.headers['x-next-cursor']}")
+    assert [m["response"] for m in second.json()] == ["msg 1", "msg 2"]
+
+    last = client.get(f"/api/chat/history?user_id=paged_user&limit=2&before={second.headers['x-next-cursor']}")
+    assert [m["response"] for m in last.json()] == ["msg 0"]
+    assert "x-next-cursor" not in last.headers
+
+
+def test_chat_history_keeps_messages_flushed_during_the_read(client: TestClient):
+    chat_buffer.add("racing_user", "only in the buffer", is_user=True)
+
+    def flush_lands_mid_read(*args):
+        # The batch commits after the SELECT saw the table but before the merge.
+        chat_buffer._pending.clear()
+        return newest_first(*args)
+
+    with patch("src.routes.chat_routes.newest_first", flush_lands_mid_read):
+        data = client.get("/api/chat/history?user_id=racing_user").json()
+    assert [m["response"] for m in data] == ["only in the buffer"]
+
+
+def test_chat_history_invalid_cursor(client: TestClient):
+    resp = client.get("/api/chat/history?user_id=paged_user&before=not-a-cursor")
+    assert resp.status_code == 400
+    assert resp.json() == {"detail": "Invalid cursor"}
+
+
+@patch("src.routes.chat_routes.CHAT_CONTEXT_MAX_MESSAGES", 4)
+@patch("src.routes.chat_routes.get_openai_client", return_value=mock_openai_client)
+def test_chat_context_window_is_bounded(mock_client_func, client: TestClient, db_session):
+    add_history(db_session, "long_user", 30)
+
+    client.post("/api/chat/", json={"user_id": "long_user", "message": "Мне тревожно."})
+
+    sent = mock_openai_client.chat.completions.create.call_args.kwargs["messages"]
+    assert sent[0]["role"] == "system"
+    assert [m["content"] for m in sent[1:]] == ["msg 26", "msg 27", "msg 28", "msg 29", "Мне тревожно."]
+
+
+class FakeStreamingClient:
+    """Local stand-in for the OpenAI client that streams one chunk per token."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, stream=False, **kwargs):
+        assert stream is True
+        return self.chunks()
+
+    async def chunks(self):
+        for token in self.tokens:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None))])
+
+
+def parse_sse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_chat_stream_sends_tokens_and_persists_reply(client: TestClient):
+    fake = FakeStreamingClient(["Я ", "рядом", "."])
+    with patch("src.routes.chat_routes.get_openai_client", return_value=fake):
+        resp = client.post("/api/chat/stream", json={"user_id": "stream_user", "message": "Не могу уснуть"})
+
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(resp.text)
+    assert [data["content"] for event, data in events if event == "token"] == ["Я ", "рядом", "."]
+    assert events[-1] == ("done", {"response": "Я рядом."})
+
+    history = client.get("/api/chat/history?user_id=stream_user").json()
+    assert [m["response"] for m in history] == ["Не могу уснуть", "Я рядом."]
+
+
+def test_chat_stream_keeps_partial_reply_when_client_disconnects(client: TestClient):
+    async def read_one_token_and_disconnect():
+        async for db in app.dependency_overrides[get_db]():
+            response = await stream_chat_with_psychologist(ChatRequest(user_id="gone_user", message="Привет"), db)
+            first = await response.body_iterator.__anext__()
+            await response.body_iterator.aclose()
+            return first
+
+    fake = FakeStreamingClient(["Я ", "рядом", "."])
+    with patch("src.routes.chat_routes.get_openai_client", return_value=fake):
+        first = client.portal.call(read_one_token_and_disconnect)
+
+    assert parse_sse(first) == [("token", {"content": "Я "})]
+    history = client.get("/api/chat/history?user_id=gone_user").json()
+    assert [m["response"] for m in history] == ["Привет", "Я"]
+
+
+def test_chat_stream_fallback_without_client(client: TestClient):
+    with patch("src.routes.chat_routes.get_openai_client", return_value=None):
+        resp = client.post("/api/chat/stream", json={"user_id": "stream_user", "message": "Привет"})
+
+    events = parse_sse(resp.text)
+    assert events[-1] == ("done", {"response": "Это пример ответа ИИ на сообщение: 'Привет'."})
+
+
+def test_chat_completion_cache_serves_repeated_opening(client: TestClient):
+    upstream = MagicMock()
+    upstream.chat.completions.create = AsyncMock()
+    upstream.chat.completions.create.return_value.choices = [mock_choice]
+
+    with patch("src.routes.chat_routes.get_openai_client", return_value=upstream), \
+            patch("src.routes.chat_routes.completion_cache", CompletionCache(enabled=True)):
+        first = client.post("/api/chat/", json={"user_id": "cache_user_1", "message": "Мне тревожно."})
+        second = client.post("/api/chat/", json={"user_id": "cache_user_2", "message": "мне тревожно"})
+
+    assert first.json() == second.json()
+    assert upstream.chat.completions.create.await_count == 1
+
+
+@patch("src.routes.chat_routes.get_openai_client", return_value=mock_openai_client)
+def test_chat_job_mode_returns_id_then_reply(mock_client_func, client: TestClient):
+    resp = client.post("/api/chat/jobs", json={"user_id": "job_user", "message": "Не могу уснуть."})
+    assert resp.status_code == 202
+    job_id = resp.json()["job_id"]
+    assert resp.headers["Location"] == f"/api/chat/jobs/{job_id}"
+
+    result = client.get(f"/api/chat/jobs/{job_id}?wait=5").json()
+    assert result == {"job_id": job_id, "status": "done", "response": "Я понимаю ваши чувства, всё будет хорошо."}
+
+    history = client.get("/api/chat/history?user_id=job_user").json()
+    assert [m["response"] for m in history] == ["Не могу уснуть.", "Я понимаю ваши чувства, всё будет хорошо."]
+    assert client.get("/api/chat/jobs/unknown").status_code == 404
+    assert "chat_jobs_completed_total" in client.get("/metrics").text
+
+
+def track_session_close(events):
+    """Wrap the ``get_db`` override so closing the request's session is recorded."""
+    shared = app.dependency_overrides[get_db]
+
+    async def tracked():
+        async for db in shared():
+            async def close():
+                events.append("close")
+            db.close = close
+            yield db
+
+    return patch.dict(app.dependency_overrides, {get_db: tracked})
+
+
+def test_chat_releases_session_before_upstream_call(client: TestClient):
+    events = []
+    upstream = MagicMock()
+
+    async def create(**kwargs):
+        events.append("upstream")
+        return SimpleNamespace(choices=[mock_choice], usage=None)
+
+    upstream.chat.completions.create = create
+    with track_session_close(events), patch("src.routes.chat_routes.get_openai_client", return_value=upstream):
+        client.post("/api/chat/", json={"user_id": "pooled_user", "message": "Привет"})
+    assert events[:2] == ["close", "upstream"]
+
+
+def test_chat_stream_releases_session_before_streaming(client: TestClient):
+    events = []
+    fake = FakeStreamingClient(["Я ", "рядом"])
+    create = fake.create
+
+    async def tracked_create(**kwargs):
+        events.append("upstream")
+        return await create(**kwargs)
+
+    fake.chat.completions.create = tracked_create
+    with track_session_close(events), patch("src.routes.chat_routes.get_openai_client", return_value=fake):
+        client.post("/api/chat/stream", json={"user_id": "stream_pool_user", "message": "Привет"})
+    assert events[:2] == ["close", "upstream"]
@@ -1,6 +1,9 @@
 from fastapi.testclient import TestClient
 from sqlalchemy.orm import Session
 from src.models.models import Meditation, User
+from src.services.chat_buffer import chat_buffer
+from src.services.play_events import play_events
+from src.services.popularity import popularity
 from datetime import datetime, timedelta, timezone
 
 UTC = timezone.utc
@@ -69,3 +72,220 @@ def test_last_played(client: TestClient, db_session: Session):
     data = resp.json()
     assert resp.status_code == 200
     assert data["last_played"] is True
+
+
+def test_catalog_refreshes_after_write(client: TestClient, db_session: Session):
+    db_session.add(Meditation(title="First", description="Desc", duration_seconds=300, audio_url="url", is_premium=False, category="Focus"))
+    db_session.commit()
+    assert [m["title"] for m in client.get("/api/meditations/?category=Focus").json()] == ["First"]
+
+    db_session.add(Meditation(title="Second", description="Desc", duration_seconds=300, audio_url="url", is_premium=False, category="Focus"))
+    db_session.commit()
+    assert [m["title"] for m in client.get("/api/meditations/?category=Focus").json()] == ["First", "Second"]
+
+
+def test_catalog_etag_not_modified(client: TestClient, db_session: Session):
+    med = Meditation(title="Tagged", description="Desc", duration_seconds=300, audio_url="url", is_premium=False, category="Sleep")
+    db_session.add(med)
+    db_session.commit()
+
+    resp = client.get("/api/meditations/")
+    etag = resp.headers["etag"]
+    assert resp.status_code == 200
+
+    resp_cached = client.get("/api/meditations/", headers={"If-None-Match": etag})
+    assert resp_cached.status_code == 304
+    assert resp_cached.content == b""
+
+    resp_item = client.get(f"/api/meditations/{med.id}")
+    assert resp_item.headers["etag"] != etag
+    assert client.get(f"/api/meditations/{med.id}", headers={"If-None-Match": resp_item.headers["etag"]}).status_code == 304
+
+
+def test_catalog_etag_changes_with_last_played(client: TestClient, db_session: Session):
+    med = Meditation(title="Played", description="Desc", duration_seconds=300, audio_url="url", is_premium=False, category="Sleep")
+    db_session.add(med)
+    db_session.commit()
+    user = User(id="etag_user", name="Etag", last_played_meditation_id=med.id)
+    db_session.add(user)
+    db_session.commit()
+
+    anonymous = client.get("/api/meditations/")
+    personal = client.get(f"/api/meditations/?user_id={user.id}")
+    assert personal.headers["etag"] != anonymous.headers["etag"]
+    assert personal.json()[0]["last_played"] is True
+    assert client.get(f"/api/meditations/?user_id={user.id}", headers={"If-None-Match": anonymous.headers["etag"]}).status_code == 200
+
+
+def test_premium_visible_right_after_activation(client: TestClient, db_session: Session):
+    db_session.add(User(id="upgrading_user", name="Upgrading"))
+    db_session.add(Meditation(title="Locked", description="Desc", duration_seconds=300, audio_url="url", is_premium=True, category="Sleep"))
+    db_session.commit()
+
+    assert client.get("/api/meditations/?user_id=upgrading_user").json() == []
+
+    raw_code = client.post("/api/subscription/generate_code?duration_days=30").json()["raw_code"]
+    client.post("/api/subscription/activate", json={"code": raw_code, "user_id": "upgrading_user"})
+
+    assert [m["title"] for m in client.get("/api/meditations/?user_id=upgrading_user").json()] == ["Locked"]
+
+
+def test_search_with_facets(client: TestClient, db_session: Session):
+    db_session.add_all([
+        Meditation(title="Расслабляющий вечер", description="Перед сном", duration_seconds=300, audio_url="u1", is_premium=False, category="Sleep"),
+        Meditation(title="Вечерняя медитация", description="Отпустите день", duration_seconds=900, audio_url="u2", is_premium=True, category="Sleep"),
+        Meditation(title="Утро", description="Вечером не слушать", duration_seconds=120, audio_url="u3", is_premium=False, category="Focus"),
+    ])
+    db_session.commit()
+
+    resp = client.get("/api/meditations/search", params={"q": "вечер"})
+    assert resp.status_code == 200
+    data = resp.json()
+    assert [m["title"] for m in data["items"]] == ["Расслабляющий вечер", "Утро"]
+    assert data["total"] == 2
+    assert data["facets"]["category"] == {"Sleep": 1, "Focus": 1}
+
+    resp = client.get("/api/meditations/search", params={"q": "вечер", "category": "Focus"})
+    data = resp.json()
+    assert [m["title"] for m in data["items"]] == ["Утро"]
+    assert data["facets"]["category"] == {"Sleep": 1, "Focus": 1}
+
+    assert client.get("/api/meditations/search", params={"duration": "1-2"}).status_code == 422
+
+
+def test_search_shows_premium_to_subscribers(client: TestClient, db_session: Session):
+    user = User(id="search_prem", name="Premium", is_premium=True, premium_expires_at=datetime.now(UTC) + timedelta(days=30))
+    db_session.add(user)
+    db_session.add(Meditation(title="Вечерняя медитация", description="d", duration_seconds=900, audio_url="u", is_premium=True, category="Sleep"))
+    db_session.commit()
+
+    assert client.get("/api/meditations/search", params={"q": "вечерн"}).json()["total"] == 0
+    data = client.get("/api/meditations/search", params={"q": "вечерн", "user_id": user.id}).json()
+    assert data["total"] == 1
+    assert data["items"][0]["is_premium"] is True
+
+
+def test_list_pages_with_sort_and_duration_filter(client: TestClient, db_session: Session):
+    db_session.add_all([
+        Meditation(title=f"Med {i}", description="d", duration_seconds=60 * (i + 1), audio_url="u", is_premium=(i % 3 == 0), category="Sleep")
+        for i in range(10)
+    ])
+    db_session.commit()
+
+    seen, after = [], None
+    while True:
+        params = {"sort": "duration", "min_duration": 120, "max_duration": 540, "limit": 2}
+        if after:
+            params["after"] = after
+        resp = client.get("/api/meditations/", params=params)
+        assert resp.status_code == 200
+        page = resp.json()
+        assert len(page) <= 2
+        seen += page
+        after = resp.headers.get("X-Next-Cursor")
+        if not after:
+            break
+
+    # Premium items (every third) are filtered out in SQL for anonymous callers.
+    assert [m["duration_seconds"] for m in seen] == [120, 180, 300, 360, 480, 540]
+    assert not any(m["is_premium"] for m in seen)
+
+
+def record_starts(client, user_id, *meditation_ids):
+    events = [{"meditation_id": med_id, "kind": "start"} for med_id in meditation_ids]
+    assert client.post(f"/api/users/{user_id}/plays", json={"events": events}).status_code == 202
+
+
+def test_list_sorted_by_popularity(client: TestClient, db_session: Session):
+    meds = [Meditation(title=f"Med {i}", description="d", duration_seconds=300, audio_url="u", is_premium=False, category="Sleep") for i in range(3)]
+    db_session.add_all(meds)
+    db_session.add(User(id="pop1", name="A"))
+    db_session.commit()
+    ids = [m.id for m in meds]
+
+    record_starts(client, "pop1", ids[2], ids[2], ids[1])
+    client.portal.call(play_events.flush)
+    client.portal.call(popularity.refresh)
+
+    resp = client.get("/api/meditations/", params={"sort": "popular", "limit": 2})
+    assert [m["title"] for m in resp.json()] == ["Med 2", "Med 1"]
+    resp = client.get("/api/meditations/", params={"sort": "popular", "after": resp.headers["X-Next-Cursor"]})
+    assert [m["title"] for m in resp.json()] == ["Med 0"]
+    assert "X-Next-Cursor" not in resp.headers
+
+    # Rankings are only rebuilt on refresh, not per request.
+    record_starts(client, "pop1", ids[0], ids[0], ids[0])
+    client.portal.call(play_events.flush)
+    assert client.get("/api/meditations/", params={"sort": "popular", "limit": 1}).json()[0]["title"] == "Med 2"
+    client.portal.call(popularity.refresh)
+    assert client.get("/api/meditations/", params={"sort": "popular", "limit": 1}).json()[0]["title"] == "Med 0"
+    assert client.get("/api/meditations/", params={"sort": "popular", "window": "day", "category": "Sleep", "limit": 1}).json()[0]["title"] == "Med 0"
+
+
+def test_continue_listening(client: TestClient, db_session: Session):
+    meds = [Meditation(title=f"Med {i}", description="d", duration_seconds=600, audio_url="u", is_premium=(i == 2), category="Sleep") for i in range(3)]
+    db_session.add_all(meds)
+    db_session.add(User(id="listener", name="L"))
+    db_session.commit()
+    ids = [m.id for m in meds]
+
+    resp = client.post("/api/users/listener/plays", json={"events": [
+        {"meditation_id": ids[0], "kind": "start", "at": "2026-01-01T10:00:00Z"},
+        {"meditation_id": ids[0], "kind": "progress", "position_seconds": 120, "at": "2026-01-01T10:02:00Z"},
+        {"meditation_id": ids[1], "kind": "start", "at": "2026-01-01T11:00:00Z"},
+        {"meditation_id": ids[1], "kind": "complete", "position_seconds": 600, "at": "2026-01-01T11:10:00Z"},
+    ]})
+    assert resp.status_code == 202
+    client.portal.call(play_events.flush)
+    # A later batch with an older timestamp does not rewind progress.
+    client.post("/api/users/listener/plays", json={"events": [
+        {"meditation_id": ids[0], "kind": "progress", "position_seconds": 30, "at": "2026-01-01T10:01:00Z"},
+        {"meditation_id": ids[2], "kind": "progress", "position_seconds": 60, "at": "2026-01-01T12:00:00Z"},
+    ]})
+    client.portal.call(play_events.flush)
+
+    data = client.get("/api/meditations/continue", params={"user_id": "listener"}).json()
+    # The premium meditation is hidden from a free user; the finished one is gone.
+    assert [(m["id"], m["position_seconds"]) for m in data] == [(ids[0], 120)]
+    assert client.get("/api/meditations/continue", params={"user_id": "nobody"}).status_code == 404
+
+
+def test_list_rejects_cursor_of_another_sort(client: TestClient, db_session: Session):
+    db_session.add_all([Meditation(title=f"Med {i}", description="d", duration_seconds=300, audio_url="u", is_premium=False, category="Sleep") for i in range(2)])
+    db_session.commit()
+
+    after = client.get("/api/meditations/", params={"sort": "title", "limit": 1}).headers["X-Next-Cursor"]
+    assert client.get("/api/meditations/", params={"sort": "duration", "after": after}).status_code == 400
+    assert client.get("/api/meditations/", params={"after": "abc"}).status_code == 400
+
+
+def test_recommended_follows_plays_and_chat(client: TestClient, db_session: Session):
+    meds = [
+        Meditation(title="Глубокий сон", description="Засыпание", duration_seconds=900, audio_url="u", is_premium=False, category="Sleep"),
+        Meditation(title="Ночной отдых", description="Перед сном", duration_seconds=900, audio_url="u", is_premium=False, category="Sleep"),
+        Meditation(title="Снятие тревоги", description="Когда беспокоит страх", duration_seconds=300, audio_url="u", is_premium=False, category="Stress"),
+        Meditation(title="Тревога и паника", description="Практика", duration_seconds=300, audio_url="u", is_premium=True, category="Stress"),
+    ]
+    db_session.add_all(meds)
+    db_session.add(User(id="sleeper", name="S"))
+    db_session.commit()
+    ids = [m.id for m in meds]
+
+    client.post("/api/users/sleeper/plays", json={"events": [
+        {"meditation_id": ids[0], "kind": "start"},
+        {"meditation_id": ids[0], "kind": "complete", "position_seconds": 900},
+    ]})
+    client.portal.call(play_events.flush)
+    data = client.get("/api/meditations/recommended", params={"user_id": "sleeper", "limit": 2}).json()
+    # The finished meditation drops below its unplayed neighbour.
+    assert [m["id"] for m in data] == [ids[1], ids[0]]
+    assert data[0]["score"] > data[1]["score"]
+
+    chat_buffer.add("sleeper", "Сегодня очень тревожно, страх и паника", is_user=True)
+    data = client.get("/api/meditations/recommended", params={"user_id": "sleeper"}).json()
+    # The anxious message lifts the anxiety practice to par with the habit.
+    assert [m["id"] for m in data] == [ids[1], ids[2], ids[0]]
+    assert data[0]["score"] == data[1]["score"]
+    # Premium stays hidden from a free user.
+    assert ids[3] not in [m["id"] for m in data]
+    assert client.get("/api/meditations/recommended", params={"user_id": "nobody"}).status_code == 404
@@ -0,0 +1,40 @@
+import logging
+from src.models import models
+from src.models.models import User
+
+
+def test_server_timing_reports_queries_per_request(client, db_session, caplog):
+    db_session.add(User(id="timed", name="Timed"))
+    db_session.commit()
+
+    with caplog.at_level(logging.INFO, logger="src.main"):
+        resp = client.get("/api/users/timed")
+
+    assert resp.status_code == 200
+    db, slowest, total = resp.headers["Server-Timing"].split(", ")
+    assert db.startswith("db;dur=") and db.endswith('desc="1 queries"')
+    assert slowest.startswith("db-slowest;dur=")
+    assert total.startswith("total;dur=")
+
+    line = next(r.getMessage() for r in caplog.records if r.name == "src.main")
+    assert line.startswith("GET /api/users/timed 200 ")
+    assert "db_queries=1 " in line
+    assert "FROM users" in line
+
+
+def test_slow_queries_are_logged(client, monkeypatch, caplog):
+    monkeypatch.setattr(models, "SQL_SLOW_QUERY_MS", 0)
+    with caplog.at_level(logging.WARNING, logger="src.models.models"):
+        client.get("/api/users/nobody")
+
+    assert any(r.getMessage().startswith("Slow query took") for r in caplog.records)
+
+
+def test_metrics_count_requests_per_router(client):
+    client.get("/api/users/nobody")
+    body = client.get("/metrics").text
+
+    assert 'http_requests_total{router="users",status="4xx"}' in body
+    assert 'http_requests_in_flight{router="users"} 0' in body
+    assert 'db_pool_checkout_wait_seconds_count' in body
+    assert 'app_cache_misses_total{cache="catalog"}' in body
@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from src.models.models import User, ActivationCode
 from datetime import datetime, timedelta, timezone
 import hashlib
+import json
 
 UTC = timezone.utc
 
@@ -93,6 +94,30 @@ def test_extend_premium(client: TestClient, db_session: Session):
     assert user.premium_expires_at.replace(tzinfo=UTC) >= initial_exp.replace(tzinfo=UTC) + timedelta(days=30) - timedelta(seconds=1)
 
 
+def test_activate_claims_and_upserts_in_two_writes(client: TestClient, db_session: Session, count_queries):
+    expires = datetime(2100, 1, 1, 12, 30, 15, 123456, tzinfo=UTC)
+    db_session.add_all([
+        User(id="running_user", name="R", is_premium=True, premium_expires_at=expires),
+        User(id="lapsed_user", name="L", is_premium=True, premium_expires_at=datetime(2020, 1, 1, tzinfo=UTC)),
+    ])
+    db_session.commit()
+    codes = [client.post("/api/subscription/generate_code?duration_days=30").json()["raw_code"] for _ in range(3)]
+
+    with count_queries() as queries:
+        running = client.post("/api/subscription/activate", json={"code": codes[0], "user_id": "running_user"}).json()
+    writes = [q for q in queries if not q.lstrip().upper().startswith("SELECT")]
+    assert [w.split()[0].upper() for w in writes] == ["UPDATE", "INSERT"]
+    # A running period is extended to the microsecond.
+    assert datetime.fromisoformat(running["until"]) == expires + timedelta(days=30)
+
+    before = datetime.now(UTC)
+    for code, user_id in zip(codes[1:], ("lapsed_user", "brand_new_user")):
+        until = datetime.fromisoformat(client.post("/api/subscription/activate", json={"code": code, "user_id": user_id}).json()["until"])
+        assert before + timedelta(days=30) <= until <= datetime.now(UTC) + timedelta(days=30)
+    new_user = db_session.get(User, "brand_new_user")
+    assert (new_user.name, new_user.is_premium) == ("New User", True)
+
+
 def test_activate_invalid(client: TestClient, db_session: Session):
     user_id = "invalid_user"
     user = User(id=user_id, name="Test User")
@@ -119,7 +144,7 @@ def test_activate_used(client: TestClient, db_session: Session):
     assert resp2.json() == {"detail": "Code already used"}
 
 
-def test_subscription_history_success(client: TestClient, db_session: Session):
+def test_subscription_history_success(client: TestClient, db_session: Session, count_queries):
     user_id = "history_user"
     user = User(id=user_id, name="History User")
     db_session.add(user)
@@ -131,7 +156,9 @@ def test_subscription_history_success(client: TestClient, db_session: Session):
         raw_codes.append(resp.json()["raw_code"])
         client.post("/api/subscription/activate", json={"code": raw_codes[-1], "user_id": user_id})
 
-    resp_hist = client.get(f"/api/subscription/history?user_id={user_id}")
+    with count_queries() as queries:
+        resp_hist = client.get(f"/api/subscription/history?user_id={user_id}")
+    assert len(queries) == 1
     assert resp_hist.status_code == 200
     data = resp_hist.json()
     assert len(data) == 2
@@ -156,3 +183,55 @@ def test_subscription_history_empty(client: TestClient, db_session: Session):
     resp = client.get(f"/api/subscription/history?user_id={user_id}")
     assert resp.status_code == 404
     assert resp.json() == {"detail": "No activation history"}
+
+
+def test_generate_codes_ndjson(client: TestClient, db_session: Session):
+    resp = client.post("/api/subscription/generate_codes?count=3&duration_days=14&format=ndjson")
+    assert resp.status_code == 201
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+
+    rows = [json.loads(line) for line in resp.text.splitlines()]
+    assert len(rows) == 3
+    assert all(row["duration_days"] == 14 for row in rows)
+    assert db_session.query(ActivationCode).filter(ActivationCode.code.in_([r["hashed_code"] for r in rows])).count() == 3
+
+    resp_check = client.get(f"/api/subscription/check?code={rows[0]['raw_code']}")
+    assert resp_check.json() == {"status": "valid", "expires_in": "14 days"}
+
+
+def test_generate_codes_csv(client: TestClient):
+    resp = client.post("/api/subscription/generate_codes?count=2")
+    lines = resp.text.splitlines()
+    assert resp.headers["content-type"].startswith("text/csv")
+    assert lines[0] == "raw_code,hashed_code,duration_days"
+    raw, hashed, days = lines[1].split(",")
+    assert hashed == hash_code(raw)
+    assert days == "30"
+
+
+def test_generate_codes_rejects_bad_count(client: TestClient):
+    assert client.post("/api/subscription/generate_codes?count=0").status_code == 422
+
+
+def test_check_reflects_generate_and_activate(client: TestClient):
+    assert client.get("/api/subscription/check?code=not-yet").status_code == 404
+
+    raw_code = client.post("/api/subscription/generate_code?duration_days=10").json()["raw_code"]
+    assert client.get(f"/api/subscription/check?code={raw_code}").json()["status"] == "valid"
+
+    resp = client.post("/api/subscription/activate", json={"code": raw_code, "user_id": "cache_user"})
+    assert resp.status_code == 200
+    assert client.get(f"/api/subscription/check?code={raw_code}").json() == {"status": "used", "expires_in": None}
+
+
+def test_activate_ignores_cached_absence(client: TestClient, db_session: Session):
+    assert client.get("/api/subscription/check?code=made-elsewhere").status_code == 404
+
+    # Inserted by another process, e.g. the offline code generator.
+    db_session.add(ActivationCode(code=hash_code("made-elsewhere"), duration_days=5, is_used=False))
+    db_session.commit()
+    assert client.get("/api/subscription/check?code=made-elsewhere").status_code == 404
+
+    resp = client.post("/api/subscription/activate", json={"code": "made-elsewhere", "user_id": "late_user"})
+    assert resp.status_code == 200
+    assert client.get("/api/subscription/check?code=made-elsewhere").json()["status"] == "used"
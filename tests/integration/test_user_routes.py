@@ -1,5 +1,7 @@
+import json
 from datetime import datetime, timedelta, timezone
-from src.models.models import User, Meditation
+from src.models.models import User, Meditation, ActivationCode
+from src.services.play_events import play_events
 
 UTC = timezone.utc
 
@@ -18,6 +20,43 @@ def test_get_users(client, db_session):
     assert "u1" in ids and "u2" in ids
 
 
+def test_get_users_pages_with_cursor(client, db_session):
+    db_session.add_all([User(id=f"p{i}", name=f"User {i}") for i in range(5)])
+    db_session.commit()
+
+    first = client.get("/api/users/?limit=2")
+    assert [u["id"] for u in first.json()] == ["p0", "p1"]
+    second = client.get(f"/api/users/?limit=2&after={first.headers['X-Next-Cursor']}")
+    assert [u["id"] for u in second.json()] == ["p2", "p3"]
+    last = client.get(f"/api/users/?limit=2&after={second.headers['X-Next-Cursor']}")
+    assert [u["id"] for u in last.json()] == ["p4"]
+    assert "X-Next-Cursor" not in last.headers
+
+
+def test_get_users_projects_fields(client, db_session):
+    db_session.add(User(id="f1", name="Fields"))
+    db_session.commit()
+
+    resp = client.get("/api/users/?fields=name")
+    assert resp.json() == [{"id": "f1", "name": "Fields"}]
+    assert client.get("/api/users/?fields=name,password").status_code == 400
+    assert client.get("/api/users/?after=abc").status_code == 400
+
+
+def test_get_users_ndjson_export(client, db_session):
+    db_session.add_all([User(id=f"e{i}", name=f"User {i}", is_premium=i % 2 == 0) for i in range(3)])
+    db_session.commit()
+
+    resp = client.get("/api/users/?format=ndjson&fields=is_premium")
+    assert resp.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in resp.text.splitlines()]
+    assert rows == [
+        {"id": "e0", "is_premium": True},
+        {"id": "e1", "is_premium": False},
+        {"id": "e2", "is_premium": True},
+    ]
+
+
 def test_get_user_by_id(client, db_session):
     u = User(id="user123", name="Charlie")
     db_session.add(u)
@@ -113,3 +152,97 @@ def test_update_last_played_meditation_not_found(client, db_session):
     resp = client.post(f"/api/users/{user.id}/last_played/9999")
     assert resp.status_code == 404
     assert resp.json() == {"detail": "Meditation not found"}
+
+
+def test_get_last_played_is_one_query(client, db_session, count_queries):
+    med = Meditation(title="Joined", description="Desc", duration_seconds=300, audio_url="url", is_premium=False, category="Sleep")
+    db_session.add(med)
+    db_session.flush()
+    db_session.add_all([User(id="lp_joined", name="LP", last_played_meditation_id=med.id), User(id="lp_none", name="None")])
+    db_session.commit()
+    db_session.expunge_all()
+
+    with count_queries() as queries:
+        resp = client.get("/api/users/lp_joined/last_played")
+    assert resp.json()["title"] == "Joined"
+    assert len(queries) == 1
+
+    assert client.get("/api/users/lp_none/last_played").json() is None
+    assert client.get("/api/users/nonexistent/last_played").status_code == 404
+
+
+def test_get_user_subscriptions_is_one_query(client, db_session, count_queries):
+    user = User(id="subs_user", name="Subs")
+    db_session.add_all([
+        user,
+        ActivationCode(code="c1", duration_days=10, is_used=True, user_id="subs_user", activated_at=datetime(2025, 1, 1)),
+        ActivationCode(code="c2", duration_days=20, is_used=True, user_id="subs_user", activated_at=datetime(2025, 2, 1)),
+    ])
+    db_session.commit()
+    db_session.expunge_all()
+
+    with count_queries() as queries:
+        resp = client.get("/api/users/subs_user/subscriptions")
+    assert [c["duration_days"] for c in resp.json()] == [20, 10]
+    assert len(queries) == 1
+
+    db_session.add(User(id="subs_empty", name="Empty"))
+    db_session.commit()
+    assert client.get("/api/users/subs_empty/subscriptions").json() == {"detail": "No activation history"}
+    assert client.get("/api/users/nonexistent/subscriptions").json() == {"detail": "User not found"}
+
+
+def test_update_last_played_is_one_query(client, db_session, count_queries):
+    user = User(id="lp_fast", name="LP")
+    med = Meditation(title="Fast", description="Desc", duration_seconds=200, audio_url="url", is_premium=False, category="Sleep")
+    db_session.add_all([user, med])
+    db_session.commit()
+    med_id = med.id
+    client.get("/api/meditations/")  # warm the catalog snapshot
+
+    with count_queries() as queries:
+        resp = client.post(f"/api/users/lp_fast/last_played/{med_id}")
+    assert resp.status_code == 200
+    assert len(queries) == 1
+
+
+def test_play_events_are_buffered_then_derive_last_played(client, db_session):
+    db_session.add(User(id="player", name="Player"))
+    meds = [Meditation(title=f"Med {i}", description="d", duration_seconds=300, audio_url="u", is_premium=False, category="Sleep") for i in range(2)]
+    db_session.add_all(meds)
+    db_session.commit()
+
+    resp = client.post("/api/users/player/plays", json={"events": [
+        {"meditation_id": meds[0].id, "kind": "start", "at": "2026-01-01T10:00:00Z"},
+        {"meditation_id": meds[0].id, "kind": "complete", "position_seconds": 300, "at": "2026-01-01T10:05:00Z"},
+        {"meditation_id": meds[1].id, "kind": "start", "at": "2026-01-01T13:10:00+03:00"},
+    ]})
+    assert resp.status_code == 202
+    assert resp.json() == {"accepted": 3}
+    assert client.get("/api/users/player/plays").json() == []
+
+    client.portal.call(play_events.flush)
+
+    history = client.get("/api/users/player/plays?limit=2")
+    assert [(e["meditation_id"], e["kind"]) for e in history.json()] == [(meds[1].id, "start"), (meds[0].id, "complete")]
+    assert history.json()[0]["at"].startswith("2026-01-01T10:10:00")
+    older = client.get(f"/api/users/player/plays?before={history.headers['x-next-cursor']}").json()
+    assert [e["position_seconds"] for e in older] == [0]
+    # 13:10+03:00 is 10:10 UTC, the newest of the batch.
+    assert client.get("/api/users/player").json()["last_played_meditation_id"] == meds[1].id
+
+
+def test_play_events_validate_user_and_meditations(client, db_session):
+    db_session.add(User(id="player2", name="Player"))
+    db_session.commit()
+
+    assert client.post("/api/users/nobody/plays", json={"events": [{"meditation_id": 1, "kind": "start"}]}).status_code == 404
+    resp = client.post("/api/users/player2/plays", json={"events": [{"meditation_id": 9999, "kind": "start"}]})
+    assert resp.status_code == 400
+    assert resp.json() == {"detail": "Unknown meditations: 9999"}
+    assert client.post("/api/users/player2/plays", json={"events": [{"meditation_id": 1, "kind": "pause"}]}).status_code == 422
+    assert client.post("/api/users/player2/plays", json={"events": []}).status_code == 422
+    # Values the database cannot store are refused up front.
+    for event in ({"position_seconds": 10**20}, {"at": "9999-12-31T23:00:00-05:00"}):
+        resp = client.post("/api/users/player2/plays", json={"events": [{"meditation_id": 1, "kind": "progress", **event}]})
+        assert resp.status_code == 422
@@ -0,0 +1,51 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from src.services.activation_codes import format_codes, generate_chunk, generate_codes, hash_code
+
+
+class RecordingDB:
+    def __init__(self):
+        self.batches = []
+        self.commits = 0
+
+    async def execute(self, statement, rows):
+        self.batches.append(rows)
+
+    async def commit(self):
+        self.commits += 1
+
+
+def collect(db, count, chunk_size, executor=None):
+    async def main():
+        return [chunk async for chunk in generate_codes(db, count, 30, chunk_size=chunk_size, executor=executor, prefetch=2)]
+    return asyncio.run(main())
+
+
+def test_generate_chunk_hashes_raw_codes():
+    chunk = generate_chunk(3)
+    assert len({raw for raw, _ in chunk}) == 3
+    assert all(hashed == hash_code(raw) for raw, hashed in chunk)
+
+
+def test_generate_codes_inserts_in_chunks():
+    db = RecordingDB()
+    chunks = collect(db, 5, chunk_size=2)
+
+    assert [len(c) for c in chunks] == [2, 2, 1]
+    assert [len(b) for b in db.batches] == [2, 2, 1]
+    assert db.commits == 3
+    assert db.batches[0][0] == {"code": chunks[0][0][1], "duration_days": 30, "is_used": False}
+
+
+def test_generate_codes_with_executor():
+    db = RecordingDB()
+    with ThreadPoolExecutor(2) as executor:
+        chunks = collect(db, 7, chunk_size=3, executor=executor)
+    assert sum(len(c) for c in chunks) == 7
+    assert db.commits == 3
+
+
+def test_format_codes():
+    chunk = [("raw", "hashed")]
+    assert format_codes(chunk, 7, "csv") == "raw,hashed,7\n"
+    assert format_codes(chunk, 7, "ndjson") == '{"raw_code": "raw", "hashed_code": "hashed", "duration_days": 7}\n'
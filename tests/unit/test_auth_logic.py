@@ -33,3 +33,12 @@ def test_user_without_premium_method():
     )
     assert user.is_premium is False
     assert user.has_active_premium() is False
+
+
+def test_user_naive_expiry_is_treated_as_utc():
+    user = User(
+        id="test_user_naive",
+        is_premium=True,
+        premium_expires_at=datetime.now(UTC).replace(tzinfo=None) + timedelta(days=1)
+    )
+    assert user.has_active_premium() is True
@@ -0,0 +1,76 @@
+import asyncio
+import orjson
+from types import SimpleNamespace
+from src.models.models import Meditation
+from src.services.catalog import CatalogCache, build_snapshot
+
+
+def make_meditations():
+    return [
+        Meditation(id=1, title="Free sleep", description="d", duration_seconds=300, audio_url="u1", is_premium=False, category="Sleep"),
+        Meditation(id=2, title="Premium sleep", description="d", duration_seconds=600, audio_url="u2", is_premium=True, category="Sleep"),
+        Meditation(id=3, title="Free focus", description="d", duration_seconds=200, audio_url="u3", is_premium=False, category="Focus"),
+    ]
+
+
+def test_snapshot_lists_per_tier_and_category():
+    snapshot = build_snapshot(7, make_meditations())
+
+    assert snapshot.version == 7
+    assert [m["id"] for m in snapshot.listing(None, False)] == [1, 3]
+    assert [m["id"] for m in snapshot.listing(None, True)] == [1, 2, 3]
+    assert [m["id"] for m in snapshot.listing("Sleep", False)] == [1]
+    assert [m["id"] for m in snapshot.listing("Sleep", True)] == [1, 2]
+    assert snapshot.listing("Unknown", True) == []
+    assert snapshot.items[2]["last_played"] is False
+
+
+def test_invalidate_bumps_version():
+    cache = CatalogCache()
+    cache._snapshot = build_snapshot(cache.version, make_meditations())
+
+    cache.invalidate()
+
+    assert cache.version == 1
+    assert cache._snapshot is None
+
+
+def test_encoded_listing_marks_last_played():
+    snapshot = build_snapshot(0, make_meditations())
+
+    body, etag = snapshot.encoded_listing(None, False)
+    played_body, played_etag = snapshot.encoded_listing(None, False, last_played_id=3)
+
+    assert orjson.loads(body)[1]["last_played"] is False
+    assert orjson.loads(played_body)[1]["last_played"] is True
+    assert played_etag != etag
+    assert snapshot.encoded_listing(None, False, last_played_id=2) == (body, etag)
+
+
+class CountingSession:
+    """Stands in for an AsyncSession, returning the catalog after a pause."""
+
+    def __init__(self):
+        self.loads = 0
+
+    async def scalars(self, statement):
+        self.loads += 1
+        await asyncio.sleep(0.01)
+        return SimpleNamespace(all=make_meditations)
+
+
+def test_concurrent_misses_share_one_load():
+    cache = CatalogCache()
+    db = CountingSession()
+
+    async def main():
+        first = await asyncio.gather(*(cache.get(db) for _ in range(20)))
+        cache.invalidate()
+        second = await asyncio.gather(*(cache.get(db) for _ in range(5)))
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert db.loads == 2
+    assert all(snapshot is first[0] for snapshot in first)
+    assert all(snapshot is second[0] and snapshot.version == 1 for snapshot in second)
+    assert (cache.misses, cache.hits) == (2, 23)
@@ -0,0 +1,47 @@
+import asyncio
+from sqlalchemy import func, select
+from src.models.models import ChatMessage
+from src.services.chat_buffer import ChatWriteBuffer
+
+
+async def stored(sessions):
+    async with sessions() as db:
+        return await db.scalar(select(func.count()).select_from(ChatMessage))
+
+
+def test_flush_writes_batch_and_clears_unflushed(run_with_buffer):
+    async def scenario(buffer, sessions):
+        buffer.add("u1", "hello", is_user=True)
+        buffer.add("u1", "hi there", is_user=False)
+        buffer.add("u2", "other", is_user=True)
+        assert [m.content for m in buffer.unflushed("u1")] == ["hello", "hi there"]
+
+        await buffer.flush()
+        return buffer.unflushed("u1"), await stored(sessions)
+
+    unflushed, count = run_with_buffer(ChatWriteBuffer, scenario)
+    assert unflushed == []
+    assert count == 3
+
+
+def test_batch_threshold_triggers_flush(run_with_buffer):
+    async def scenario(buffer, sessions):
+        await buffer.start()
+        for i in range(3):
+            buffer.add("u1", f"msg {i}", is_user=True)
+        await asyncio.sleep(0.05)
+        count = await stored(sessions)
+        await buffer.close()
+        return count
+
+    assert run_with_buffer(ChatWriteBuffer, scenario, flush_interval=3600, max_batch=3) == 3
+
+
+def test_close_drains_pending(run_with_buffer):
+    async def scenario(buffer, sessions):
+        await buffer.start()
+        buffer.add("u1", "last words", is_user=True)
+        await buffer.close()
+        return await stored(sessions)
+
+    assert run_with_buffer(ChatWriteBuffer, scenario, flush_interval=3600) == 1
@@ -0,0 +1,65 @@
+import asyncio
+from contextlib import asynccontextmanager
+import pytest
+from src.services.chat_jobs import ChatJobQueue, ChatQueueFull
+
+
+@asynccontextmanager
+async def no_session():
+    yield None
+
+
+def test_turns_of_one_user_run_in_order_while_users_overlap():
+    log = []
+
+    async def handler(session_factory, user_id, message):
+        log.append(("start", user_id, message))
+        await asyncio.sleep(0.01)
+        log.append(("end", user_id, message))
+        return message.upper()
+
+    async def main():
+        queue = ChatJobQueue(session_factory=no_session, workers=4)
+        await queue.start(handler)
+        jobs = [queue.submit("a", "a1"), queue.submit("a", "a2"), queue.submit("b", "b1")]
+        await asyncio.wait_for(asyncio.gather(*(job.done.wait() for job in jobs)), timeout=5)
+        await queue.close()
+        return queue, jobs
+
+    queue, jobs = asyncio.run(main())
+
+    assert [job.response for job in jobs] == ["A1", "A2", "B1"]
+    assert all(job.status == "done" for job in jobs)
+    a_events = [(kind, message) for kind, user, message in log if user == "a"]
+    assert a_events == [("start", "a1"), ("end", "a1"), ("start", "a2"), ("end", "a2")]
+    # b1 started before a1 finished: different users share the worker pool.
+    assert log.index(("start", "b", "b1")) < log.index(("end", "a", "a1"))
+    assert queue.stats() == {"queued": 0, "running": 0, "completed": 3, "rejected": 0, "workers": 4}
+
+
+def test_submit_rejects_when_queue_is_full():
+    queue = ChatJobQueue(max_queued=1)
+    queue.submit("a", "first")
+
+    with pytest.raises(ChatQueueFull):
+        queue.submit("b", "second")
+    assert queue.stats()["rejected"] == 1
+
+
+def test_failed_turn_does_not_block_the_next_one():
+    async def handler(session_factory, user_id, message):
+        if message == "boom":
+            raise RuntimeError(message)
+        return "ok"
+
+    async def main():
+        queue = ChatJobQueue(session_factory=no_session, workers=1)
+        await queue.start(handler)
+        jobs = [queue.submit("a", "boom"), queue.submit("a", "fine")]
+        await asyncio.wait_for(jobs[1].done.wait(), timeout=5)
+        await queue.close()
+        return jobs
+
+    failed, ok = asyncio.run(main())
+    assert (failed.status, failed.response) == ("failed", None)
+    assert (ok.status, ok.response) == ("done", "ok")
@@ -0,0 +1,73 @@
+import asyncio
+from src.models.models import ActivationCode
+from src.services.code_cache import ActivationCodeCache
+
+
+def add_code(db_session, hashed, duration_days, is_used=False):
+    db_session.add(ActivationCode(code=hashed, duration_days=duration_days, is_used=is_used))
+    db_session.commit()
+
+
+def test_known_and_missing_codes_are_served_from_memory(db_session, async_db, count_queries):
+    add_code(db_session, "good", 30)
+    cache = ActivationCodeCache()
+
+    with count_queries() as queries:
+        for _ in range(3):
+            assert asyncio.run(cache.lookup(async_db, "good")).duration_days == 30
+            assert asyncio.run(cache.lookup(async_db, "bogus")) is None
+
+    assert len(queries) == 2
+    assert cache.stats() == {"hits": 2, "negative_hits": 2, "misses": 2, "size": 1, "missing_size": 1}
+
+
+def test_created_and_used_keep_results_correct(db_session, async_db, count_queries):
+    cache = ActivationCodeCache()
+    with count_queries() as queries:
+        assert asyncio.run(cache.lookup(async_db, "new")) is None
+
+        add_code(db_session, "new", 7)
+        cache.created(["new"])
+        assert asyncio.run(cache.lookup(async_db, "new")).is_used is False
+
+        cache.used("new")
+        status = asyncio.run(cache.lookup(async_db, "new"))
+    assert status.is_used is True
+    assert len([q for q in queries if q.lstrip().startswith("SELECT")]) == 2
+
+
+def test_missing_codes_cannot_evict_known_ones(db_session, async_db, count_queries):
+    add_code(db_session, "good", 30)
+    cache = ActivationCodeCache(max_entries=10, max_missing=2)
+    with count_queries() as queries:
+        asyncio.run(cache.lookup(async_db, "good"))
+        for guess in ("a", "b", "c"):
+            asyncio.run(cache.lookup(async_db, guess))
+
+        assert cache.stats()["missing_size"] == 2
+        asyncio.run(cache.lookup(async_db, "good"))
+    assert len(queries) == 4
+
+
+def test_entries_expire_after_ttl(db_session, async_db):
+    now = [0.0]
+    cache = ActivationCodeCache(ttl=10, clock=lambda: now[0])
+    asyncio.run(cache.lookup(async_db, "late"))
+
+    add_code(db_session, "late", 30)  # inserted by another process
+    now[0] = 11
+    assert asyncio.run(cache.lookup(async_db, "late")).duration_days == 30
+
+
+def test_cached_reports_only_known_codes(db_session, async_db, count_queries):
+    add_code(db_session, "good", 30)
+    cache = ActivationCodeCache()
+    asyncio.run(cache.lookup(async_db, "good"))
+    asyncio.run(cache.lookup(async_db, "bogus"))
+
+    assert cache.cached("good").duration_days == 30
+    assert cache.cached("bogus") is None
+    add_code(db_session, "bogus", 7)
+    with count_queries() as queries:
+        assert asyncio.run(cache.load(async_db, "bogus")).duration_days == 7
+    assert len(queries) == 1
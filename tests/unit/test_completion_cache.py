@@ -0,0 +1,46 @@
+from src.services.completion_cache import CompletionCache, normalize
+
+
+def conversation(*texts):
+    messages = [{"role": "system", "content": "Ты — психолог."}]
+    for i, text in enumerate(texts):
+        messages.append({"role": "user" if i % 2 == 0 else "assistant", "content": text})
+    return messages
+
+
+def test_normalize_ignores_case_punctuation_and_spacing():
+    assert normalize("Мне  тревожно!!") == normalize("мне тревожно")
+    assert normalize("Всё хорошо") == normalize("все хорошо")
+
+
+def test_key_depends_on_bounded_recent_context():
+    cache = CompletionCache(context_messages=2)
+
+    assert cache.key(conversation("Не могу уснуть.")) == cache.key(conversation("не могу уснуть"))
+    assert cache.key(conversation("a", "b", "Привет")) != cache.key(conversation("Привет"))
+    # Only the last two turns count, older history does not split the key.
+    assert cache.key(conversation("old 1", "old 2", "a", "b", "Привет")) == cache.key(conversation("x", "y", "a", "b", "Привет"))
+
+
+def test_lru_eviction_and_counters():
+    cache = CompletionCache(max_entries=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.stats() == {"hits": 2, "misses": 1, "evictions": 1, "size": 2}
+
+
+def test_entries_expire_after_ttl():
+    now = [0.0]
+    cache = CompletionCache(ttl=10, clock=lambda: now[0])
+    cache.put("a", "A")
+
+    now[0] = 9.0
+    assert cache.get("a") == "A"
+    now[0] = 11.0
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
@@ -0,0 +1,173 @@
+import asyncio
+import sqlite3
+from sqlalchemy import create_engine, inspect, insert, select, text, update
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from src.models import models
+from src.models.models import Base, User, SerializedWriteSession, to_async_url, apply_sqlite_pragmas, migrate_indexes
+
+
+def test_to_async_url_sqlite():
+    assert to_async_url("sqlite:///./data/app.db") == "sqlite+aiosqlite:///./data/app.db"
+
+
+def test_to_async_url_postgres():
+    assert to_async_url("postgresql://user:secret@db:5432/app") == "postgresql+asyncpg://user:secret@db:5432/app"
+    assert to_async_url("postgres://user:secret@db/app") == "postgresql+asyncpg://user:secret@db/app"
+
+
+def test_to_async_url_keeps_explicit_driver():
+    assert to_async_url("sqlite+aiosqlite:///./app.db") == "sqlite+aiosqlite:///./app.db"
+
+
+def test_sqlite_pragmas_applied(tmp_path):
+    conn = sqlite3.connect(tmp_path / "pragmas.db")
+    apply_sqlite_pragmas(conn)
+
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+    conn.close()
+
+
+def test_migrate_indexes_upgrades_existing_chat_table(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE chat_messages (id VARCHAR PRIMARY KEY, user_id VARCHAR NOT NULL, "
+            "content VARCHAR NOT NULL, is_user BOOLEAN NOT NULL, created_at DATETIME NOT NULL)"
+        ))
+        conn.execute(text("CREATE INDEX ix_chat_messages_user_id ON chat_messages (user_id)"))
+
+    with engine.begin() as conn:
+        Base.metadata.create_all(conn)
+        migrate_indexes(conn)
+
+    names = {index["name"] for index in inspect(engine).get_indexes("chat_messages")}
+    assert "ix_chat_messages_user_created" in names
+    assert "ix_chat_messages_user_id" not in names
+    engine.dispose()
+
+
+def test_migrate_indexes_adds_covering_meditation_index(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE meditations (id INTEGER PRIMARY KEY, title VARCHAR, description VARCHAR, "
+            "duration_seconds INTEGER, audio_url VARCHAR, is_premium BOOLEAN, category VARCHAR)"
+        ))
+        conn.execute(text("CREATE INDEX ix_meditations_category ON meditations (category)"))
+
+    with engine.begin() as conn:
+        Base.metadata.create_all(conn)
+        migrate_indexes(conn)
+
+    names = {index["name"] for index in inspect(engine).get_indexes("meditations")}
+    assert {"ix_meditations_category_premium_id", "ix_meditations_premium_id"} <= names
+    assert "ix_meditations_category" not in names
+    engine.dispose()
+
+
+def test_gated_meditation_pages_are_index_only(tmp_path):
+    from sqlalchemy.dialects import sqlite
+    from src.routes.meditation_routes import meditations_page
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'plans.db'}")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    conn = sqlite3.connect(tmp_path / "plans.db")
+
+    def plan(query):
+        sql = str(query.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+        return " ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"))
+
+    for category, after in ((None, None), (None, (0, 10)), ("Sleep", None), ("Sleep", (0, 10))):
+        assert "COVERING INDEX" in plan(meditations_page(False, category, None, None, "id", after, 50))
+    conn.close()
+
+
+def test_serialized_sessions_queue_writers(tmp_path, monkeypatch):
+    async def main():
+        monkeypatch.setattr(models, "sqlite_write_lock", asyncio.Lock())
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'writers.db'}", connect_args={"timeout": 0.1})
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, class_=SerializedWriteSession)
+
+        async def bulk_writer():
+            async with sessions() as db:
+                await db.execute(insert(User), [{"id": "bulk", "name": "Bulk"}])
+                await asyncio.sleep(0.3)
+                await db.commit()
+
+        async def orm_writer():
+            await asyncio.sleep(0.05)
+            async with sessions() as db:
+                db.add(User(id="orm", name="Orm"))
+                await db.commit()
+
+        await asyncio.wait_for(asyncio.gather(bulk_writer(), orm_writer()), timeout=5)
+        async with sessions() as db:
+            ids = (await db.scalars(select(User.id).order_by(User.id))).all()
+        await engine.dispose()
+        return ids
+
+    assert asyncio.run(main()) == ["bulk", "orm"]
+
+
+def test_serialized_sessions_lock_dml_through_scalar(tmp_path, monkeypatch):
+    async def main():
+        monkeypatch.setattr(models, "sqlite_write_lock", asyncio.Lock())
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'returning.db'}", connect_args={"timeout": 0.1})
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, class_=SerializedWriteSession)
+        async with sessions() as db:
+            db.add_all([User(id="a", name="A"), User(id="b", name="B")])
+            await db.commit()
+
+        async def claim(user_id, hold):
+            async with sessions() as db:
+                name = await db.scalar(
+                    update(User).where(User.id == user_id).values(is_premium=True).returning(User.name)
+                )
+                await asyncio.sleep(hold)
+                await db.commit()
+                return name
+
+        try:
+            return await asyncio.wait_for(asyncio.gather(claim("a", 0.3), claim("b", 0)), timeout=5)
+        finally:
+            await engine.dispose()
+
+    assert asyncio.run(main()) == ["A", "B"]
+
+
+def test_serialized_sessions_take_a_connection_before_the_lock(tmp_path, monkeypatch):
+    async def main():
+        monkeypatch.setattr(models, "sqlite_write_lock", asyncio.Lock())
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}", pool_size=1, max_overflow=0, pool_timeout=2)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, class_=SerializedWriteSession)
+
+        async def read_then_write():
+            async with sessions() as db:
+                await db.scalar(select(User.id))  # holds the only connection from here on
+                await asyncio.sleep(0.1)
+                await db.execute(insert(User), [{"id": "reader", "name": "R"}])
+                await db.commit()
+
+        async def write():
+            await asyncio.sleep(0.05)
+            async with sessions() as db:
+                await db.execute(insert(User), [{"id": "writer", "name": "W"}])
+                await db.commit()
+
+        try:
+            await asyncio.wait_for(asyncio.gather(read_then_write(), write()), timeout=5)
+            async with sessions() as db:
+                return (await db.scalars(select(User.id).order_by(User.id))).all()
+        finally:
+            await engine.dispose()
+
+    assert asyncio.run(main()) == ["reader", "writer"]
@@ -0,0 +1,46 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from src.models.models import Meditation, User
+from src.services.entitlements import EntitlementCache
+
+UTC = timezone.utc
+
+
+def test_resolve_caches_until_invalidated(db_session, async_db, count_queries):
+    db_session.add(Meditation(id=7, title="M7", description="d", duration_seconds=60, audio_url="u", is_premium=False, category="Sleep"))
+    db_session.add(User(id="u1", name="One", is_premium=True, premium_expires_at=datetime.now(UTC) + timedelta(days=3), last_played_meditation_id=7))
+    db_session.commit()
+    cache = EntitlementCache(ttl=60)
+
+    with count_queries() as queries:
+        first = asyncio.run(cache.resolve(async_db, "u1"))
+        second = asyncio.run(cache.resolve(async_db, "u1"))
+    assert first is second
+    assert first.active() is True
+    assert first.last_played_id == 7
+    assert len(queries) == 1
+
+    cache.invalidate("u1")
+    with count_queries() as queries:
+        asyncio.run(cache.resolve(async_db, "u1"))
+    assert len(queries) == 1
+
+
+def test_ttl_is_capped_at_premium_expiry(db_session, async_db, count_queries):
+    now = [datetime(2025, 1, 1, tzinfo=UTC).timestamp()]
+    db_session.add(User(id="u1", name="One", is_premium=True, premium_expires_at=datetime(2025, 1, 1, 0, 0, 5)))
+    db_session.commit()
+    cache = EntitlementCache(ttl=60, clock=lambda: now[0])
+
+    with count_queries() as queries:
+        assert asyncio.run(cache.resolve(async_db, "u1")).expires_at.tzinfo is UTC
+        now[0] += 4
+        asyncio.run(cache.resolve(async_db, "u1"))
+        assert len(queries) == 1
+        now[0] += 2
+        asyncio.run(cache.resolve(async_db, "u1"))
+    assert len(queries) == 2
+
+
+def test_missing_user_resolves_to_none(async_db):
+    assert asyncio.run(EntitlementCache().resolve(async_db, "ghost")) is None
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+import pytest
+from src.services.metrics import Histogram, OpenAIMetrics, OTHER, render, router_for
+
+
+def test_histogram_buckets_and_quantiles():
+    h = Histogram((0.1, 0.2, 0.4))
+    for value in (0.05, 0.15, 0.15, 0.3, 1.0):
+        h.observe(value)
+
+    assert h.counts == [1, 2, 1, 1]
+    assert h.quantile(0.5) == pytest.approx(0.175)
+    assert h.quantile(0.99) == 0.4
+    assert h.render("latency")[:4] == [
+        'latency_bucket{le="0.1"} 1',
+        'latency_bucket{le="0.2"} 3',
+        'latency_bucket{le="0.4"} 4',
+        'latency_bucket{le="+Inf"} 5',
+    ]
+    assert h.render("latency", 'router="chat"')[-1] == 'latency_count{router="chat"} 5'
+
+
+def test_router_for_matches_prefixes():
+    assert router_for("/api/users/u1/last_played").name == "users"
+    assert router_for("/api/chat/stream").name == "chat"
+    assert router_for("/metrics") is OTHER
+
+
+def test_openai_metrics_sum_reported_tokens():
+    m = OpenAIMetrics()
+    m.record(0.2, SimpleNamespace(prompt_tokens=30, completion_tokens=12))
+    m.record(0.1, failed=True)
+
+    assert (m.calls, m.errors, m.prompt_tokens, m.completion_tokens) == (2, 1, 30, 12)
+
+
+def test_render_includes_cache_stats():
+    body = render(caches={"codes": {"hits": 3, "negative_hits": 2, "misses": 1, "size": 4}})
+    assert 'app_cache_hits_total{cache="codes"} 5' in body
+    assert 'app_cache_misses_total{cache="codes"} 1' in body
+    assert "# TYPE http_request_duration_seconds histogram" in body
@@ -0,0 +1,24 @@
+import asyncio
+from src.services.openai_client import OpenAIClientPool, create_openai_client, OPENAI_CONNECT_TIMEOUT, OPENAI_READ_TIMEOUT
+
+
+def test_no_client_without_api_key(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    assert create_openai_client() is None
+
+
+def test_pool_shares_one_client_with_timeouts(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    pool = OpenAIClientPool()
+
+    async def lifecycle():
+        await pool.start()
+        client = pool.client
+        assert client.timeout.connect == OPENAI_CONNECT_TIMEOUT
+        assert client.timeout.read == OPENAI_READ_TIMEOUT
+        await pool.close()
+        return client
+
+    client = asyncio.run(lifecycle())
+    assert client.is_closed()
+    assert pool.client is None
@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, select
+from src.models.models import PlayEvent, User
+from src.services.play_events import PlayEventBuffer, PlayEventsFull, latest_per_user, latest_progress
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def users():
+    return [User(id="u1", name="One"), User(id="u2", name="Two")]
+
+
+async def stored(sessions):
+    async with sessions() as db:
+        count = await db.scalar(select(func.count()).select_from(PlayEvent))
+        last_played = dict((await db.execute(select(User.id, User.last_played_meditation_id))).all())
+        return count, last_played
+
+
+def test_latest_per_user_uses_event_time():
+    events = [
+        ("u1", 1, 0, 0, T0 + timedelta(seconds=5)),
+        ("u1", 2, 0, 0, T0),
+        ("u2", 3, 0, 0, T0),
+        ("u2", 4, 2, 60, T0),
+    ]
+    assert latest_per_user(events) == {"u1": (1, T0 + timedelta(seconds=5)), "u2": (4, T0)}
+
+
+def test_latest_progress_per_meditation():
+    events = [
+        ("u1", 1, 0, 0, T0),
+        ("u1", 1, 1, 90, T0 + timedelta(seconds=90)),
+        ("u1", 2, 2, 300, T0),
+    ]
+    assert latest_progress(events) == [
+        {"user_id": "u1", "meditation_id": 1, "position_seconds": 90, "completed": False, "updated_at": T0 + timedelta(seconds=90)},
+        {"user_id": "u1", "meditation_id": 2, "position_seconds": 300, "completed": True, "updated_at": T0},
+    ]
+
+
+def test_flush_writes_events_and_derives_last_played(run_with_buffer):
+    async def scenario(buffer, sessions):
+        buffer.add([("u1", 1, 0, 0, T0), ("u1", 1, 1, 30, T0 + timedelta(seconds=30)), ("u1", 2, 0, 0, T0 + timedelta(seconds=60))])
+        buffer.add([("u2", 3, 2, 300, T0), ("ghost", 3, 0, 0, T0)])
+        await buffer.flush()
+        return await stored(sessions), buffer.stats()
+
+    (count, last_played), stats = run_with_buffer(PlayEventBuffer, scenario, rows=users(), max_batch=2)
+    assert count == 5
+    assert last_played == {"u1": 2, "u2": 3}
+    assert stats == {"pending": 0, "written": 5, "rejected": 0, "dropped": 0}
+
+
+def test_late_batch_does_not_move_last_played_back(run_with_buffer):
+    async def scenario(buffer, sessions):
+        buffer.add([("u1", 2, 0, 0, T0 + timedelta(hours=1)), ("u2", 1, 0, 0, T0)])
+        await buffer.flush()
+        buffer.add([("u1", 1, 0, 0, T0), ("u2", 3, 0, 0, T0)])
+        await buffer.flush()
+        return await stored(sessions)
+
+    count, last_played = run_with_buffer(PlayEventBuffer, scenario, rows=users())
+    assert count == 4
+    assert last_played == {"u1": 2, "u2": 3}
+
+
+def test_add_rejects_when_full(run_with_buffer):
+    async def scenario(buffer, sessions):
+        buffer.add([("u1", 1, 0, 0, T0)] * 3)
+        try:
+            buffer.add([("u1", 1, 0, 0, T0)] * 2)
+        except PlayEventsFull:
+            pass
+        else:
+            raise AssertionError("expected PlayEventsFull")
+        await buffer.close()
+        return await stored(sessions), buffer.stats()
+
+    (count, _), stats = run_with_buffer(PlayEventBuffer, scenario, rows=users(), max_pending=4)
+    assert count == 3
+    assert stats["rejected"] == 2
+
+
+def test_batch_threshold_triggers_flush(run_with_buffer):
+    async def scenario(buffer, sessions):
+        await buffer.start()
+        buffer.add([("u1", 1, 0, 0, T0)] * 3)
+        await asyncio.sleep(0.05)
+        count, _ = await stored(sessions)
+        await buffer.close()
+        return count
+
+    assert run_with_buffer(PlayEventBuffer, scenario, rows=users(), flush_interval=3600, max_batch=3) == 3
+
+
+def test_unwritable_event_is_dropped_without_blocking_others(run_with_buffer):
+    async def scenario(buffer, sessions):
+        buffer.add([("u2", 1, 0, 0, T0), ("u1", 1, 1, 10**20, T0), ("u2", 2, 0, 0, T0), ("u2", 3, 0, 0, T0)])
+        for _ in range(3):
+            await buffer.flush()
+        return await stored(sessions), buffer.stats()
+
+    (count, last_played), stats = run_with_buffer(PlayEventBuffer, scenario, rows=users(), max_batch=4, max_attempts=2)
+    assert count == 3
+    assert last_played["u2"] == 3
+    assert stats == {"pending": 0, "written": 3, "rejected": 0, "dropped": 1}
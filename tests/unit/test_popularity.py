@@ -0,0 +1,100 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from src.models.models import Base, Meditation, PlayEvent
+from src.services.catalog import build_snapshot
+from src.services.popularity import PopularityCounters, hour_of
+
+
+def test_windows_drop_old_buckets():
+    counters = PopularityCounters()
+    counters.advance(1000)
+    counters.add(1, 1000)
+    counters.add(1, 990)
+    counters.add(2, 1000 - 100)
+    counters.add(3, 1000 - 200)  # older than a week, ignored
+    assert [counters.count(m, "day") for m in (1, 2, 3)] == [2, 0, 0]
+    assert [counters.count(m, "week") for m in (1, 2, 3)] == [2, 1, 0]
+
+    counters.advance(1000 + 20)
+    assert counters.count(1, "day") == 1
+    counters.advance(1000 + 24 * 7 - 90)
+    assert (counters.count(1, "week"), counters.count(2, "week")) == (2, 0)
+    counters.advance(1000 + 24 * 30)
+    assert counters.count(1, "week") == 0
+    assert counters._buckets == {}
+
+
+def test_ranking_orders_by_plays_then_id():
+    counters = PopularityCounters()
+    counters.advance(10)
+    for med_id in (3, 3, 2):
+        counters.add(med_id, 10)
+    catalog = build_snapshot(1, [
+        Meditation(id=i, title=f"M{i}", description="d", duration_seconds=60, audio_url="u", is_premium=(i == 3), category="Sleep")
+        for i in (1, 2, 3)
+    ])
+
+    keys, rows = counters.ranking(catalog, "week", None, True)
+    assert [row["id"] for row in rows] == [3, 2, 1]
+    assert keys == [(-2, 3), (-1, 2), (0, 1)]
+    assert [row["id"] for row in counters.ranking(catalog, "week", None, False)[1]] == [2, 1]
+
+
+def test_refresh_reads_only_new_starts(tmp_path):
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'pop.db'}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine)
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+        async def write(*events):
+            async with sessions() as db:
+                db.add_all(PlayEvent(user_id="u", meditation_id=m, kind=k, position_seconds=0, created_at=at) for m, k, at in events)
+                await db.commit()
+
+        await write((1, 0, now - timedelta(days=30)), (1, 0, now - timedelta(days=2)), (2, 1, now), (2, 0, now))
+        counters = PopularityCounters(session_factory=sessions, batch=1)
+        await counters.refresh()
+        first = (counters.count(1), counters.count(2), counters.count(1, "day"))
+
+        await write((2, 0, now), (2, 2, now))
+        await counters.refresh()
+        await engine.dispose()
+        return first, counters.count(2), counters._hour
+
+    first, second, hour = asyncio.run(main())
+    assert first == (1, 1, 0)
+    assert second == 2
+    assert hour == hour_of(datetime.now(timezone.utc))
+
+
+def test_refresh_counts_events_committed_out_of_id_order(tmp_path):
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'late.db'}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine)
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+        async def write(event_id, meditation_id):
+            async with sessions() as db:
+                db.add(PlayEvent(id=event_id, user_id="u", meditation_id=meditation_id, kind=0, position_seconds=0, created_at=now))
+                await db.commit()
+
+        counters = PopularityCounters(session_factory=sessions, batch=2, id_overlap=5)
+        await write(10, 1)
+        await counters.refresh()
+        # Allocated before id 10 but committed after it.
+        await write(7, 2)
+        await counters.refresh()
+        late = counters.count(2)
+        await counters.refresh()
+        # Too far behind the overlap to be seen.
+        await write(4, 3)
+        await counters.refresh()
+        await engine.dispose()
+        return counters.count(1), late, counters.count(2), counters.count(3), counters._seen
+
+    assert asyncio.run(main()) == (1, 1, 1, 0, {7, 10})
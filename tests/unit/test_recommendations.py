@@ -0,0 +1,58 @@
+from collections import Counter
+from src.services.play_events import COMPLETE
+from src.services.recommendations import CatalogFeatures, mood_counts, MOODS
+from src.services.search import tokenize
+
+
+def row(med_id, category, duration, title="Медитация", premium=False):
+    return {"id": med_id, "title": title, "description": "", "duration_seconds": duration, "is_premium": premium, "category": category}
+
+
+FEATURES = CatalogFeatures([
+    row(1, "Sleep", 900, "Глубокий сон"),
+    row(2, "Sleep", 240, "Перед сном"),
+    row(3, "Focus", 900, "Фокус на работе"),
+    row(4, "Stress", 600, "Снятие тревоги"),
+    row(5, "Stress", 600, "Спокойное дыхание", premium=True),
+])
+
+
+def test_mood_counts_from_stems():
+    moods = dict(zip(MOODS, mood_counts(tokenize("Не могу уснуть, тревожно и тревога"))))
+    assert moods["sleep"] == 1
+    assert moods["anxiety"] == 2
+    assert moods["focus"] == 0
+
+
+def test_plays_prefer_category_and_duration():
+    profile = FEATURES.profile([(1, 0)], [])
+    ids = [med_id for med_id, _ in FEATURES.recommend(profile, include_premium=True, limit=5)]
+    # Same category and length first, then same category, then same length.
+    assert ids[:3] == [1, 2, 3]
+
+
+def test_chat_moods_shape_a_cold_start():
+    profile = FEATURES.profile([], ["Мне очень тревожно"])
+    assert FEATURES.recommend(profile, include_premium=False, limit=1)[0][0] == 4
+
+
+def test_premium_hidden_and_completed_penalized():
+    profile = FEATURES.profile([(5, 0), (4, COMPLETE)], [])
+    ranked = FEATURES.recommend(profile, include_premium=False, limit=5, completed={4})
+    assert 5 not in [med_id for med_id, _ in ranked]
+    with_premium = FEATURES.recommend(profile, include_premium=True, limit=2, completed={4})
+    assert [med_id for med_id, _ in with_premium] == [5, 4]
+
+
+def test_popularity_orders_users_without_history():
+    prior = FEATURES.prior(Counter({3: 10, 2: 5}), generation=1)
+    ranked = FEATURES.recommend(FEATURES.profile([], []), include_premium=True, limit=3, prior=prior)
+    assert [med_id for med_id, _ in ranked] == [3, 2, 1]
+    # Cached until the popularity generation changes.
+    assert FEATURES.prior(Counter(), generation=1) is prior
+    assert not FEATURES.prior(Counter(), generation=2).any()
+
+
+def test_empty_catalog():
+    features = CatalogFeatures([])
+    assert features.recommend(features.profile([(1, 0)], ["сон"]), include_premium=True, limit=5) == []
@@ -0,0 +1,57 @@
+from src.services.search import SearchIndex, duration_bucket, stem, tokenize
+
+
+def make_rows():
+    return [
+        {"id": 1, "title": "Расслабляющий вечер", "description": "Спокойная практика перед сном", "duration_seconds": 300, "is_premium": False, "category": "Sleep"},
+        {"id": 2, "title": "Вечерняя медитация", "description": "Отпустите заботы дня", "duration_seconds": 900, "is_premium": True, "category": "Sleep"},
+        {"id": 3, "title": "Глубокий сон", "description": "Помогает быстрее уснуть и расслабиться", "duration_seconds": 1800, "is_premium": False, "category": "Sleep"},
+        {"id": 4, "title": "Morning focus", "description": "Clear the mind", "duration_seconds": 120, "is_premium": False, "category": "Focus"},
+    ]
+
+
+def test_tokenize_normalizes_case_yo_and_endings():
+    assert tokenize("Ёлочная МЕДИТАЦИЯ для сна") == ["елочн", "медитац", "сна"]
+    assert stem("сон") == "сон"
+    assert tokenize("Morning focus") == ["morning", "focus"]
+
+
+def test_duration_buckets():
+    assert [duration_bucket(s) for s in (0, 299, 300, 600, 1199, 1200, 5000)] == ["0-5", "0-5", "5-10", "10-20", "10-20", "20+", "20+"]
+
+
+def test_prefix_and_inflection_matching():
+    index = SearchIndex(make_rows())
+
+    assert index.match("рассл") == [1, 3]
+    assert index.match("вечер") == [1, 2]
+    assert index.match("уснуть") == [3]
+    assert index.match("глуб сон") == [3]
+    assert index.match("morn") == [4]
+    assert index.match("вечер заботы") == [2]
+    assert index.match("нет такого") == []
+    assert index.match("") == [1, 2, 3, 4]
+
+
+def test_title_hits_rank_first():
+    index = SearchIndex(make_rows())
+
+    # "Расслабляющий" is in the title of 1, "расслабиться" only in the description of 3.
+    assert index.match("расслаб") == [1, 3]
+    assert index.match("помог расслаб") == [3]
+
+
+def test_facets_ignore_filters_and_hide_premium():
+    index = SearchIndex(make_rows())
+
+    ids, facets = index.search("", include_premium=False, category="Sleep", duration="20+")
+    assert ids == [3]
+    assert facets == {
+        "category": {"Sleep": 2, "Focus": 1},
+        "duration": {"0-5": 1, "5-10": 1, "20+": 1},
+        "premium": {"false": 3},
+    }
+
+    ids, facets = index.search("вечер", include_premium=True, premium=True)
+    assert ids == [2]
+    assert facets["premium"] == {"false": 1, "true": 1}